@@ -47,6 +47,7 @@ PUBLISH_SENSORS = {
     "battery_percent": {},
     "battery_plugged_in": {},
     "users": {},
+    "scheduler_lag": {},
 }
 
 PUBLISH_SENSOR_PREFIX = [
@@ -69,6 +70,7 @@ ICON_MAP = {
     "processor_percent": "cpu-64-bit",
     "memory_percent": "chip",
     "users": "account",
+    "scheduler_lag": "timer-sand",
 }
 
 ICON_PREFIX_MAP = {
@@ -96,6 +98,31 @@ PREFIX_CLASS_MAP = {
     "acpitz_": CLASS_TEMP,
 }
 
+HISTORY_SENSORS = [
+    "processor_percent",
+    "memory_percent",
+    "load",
+    "temp",
+    "coretemp",
+    "k10temp_",
+    "wwan_rssi",
+    "gps_speed",
+]
+HISTORY_TIERS = {1: 600, 60: 1440, 3600: 168}
+
+QOS_MAP = {
+    "types": {
+        "sensor": {"qos": 0},
+        "binary_sensor": {"qos": 1},
+        "switch": {"qos": 1},
+        "device_tracker": {"qos": 1},
+        "command": {"qos": 1},
+        "discovery": {"qos": 1, "retain": True},
+        "availability": {"qos": 1, "retain": True},
+    },
+    "sensors": {},
+}
+
 CLASS_MAP = {
     "load": {
         "state_class": "measurement",
@@ -111,6 +138,7 @@ CLASS_MAP = {
     "battery_plugged_in": {"device_class": "plug"},
     "processor_percent": CLASS_PERCENT,
     "memory_percent": CLASS_PERCENT,
+    "scheduler_lag": {"state_class": "measurement", "unit_of_measurement": "ms"},
 }
 
 ATTRIB_MAP = {
@@ -175,6 +203,17 @@ def load_config(args: dict) -> dict:
         "dir": BASE_DIR,
         "temp_dir": TMP_DIR,
         "state_file": f"{TMP_DIR}/homeagent_state.json",
+        "publish": {"batch": False},
+        "persist": {"journal": True, "compact": 100, "format": "json"},
+        "serializer": "auto",
+        "pipeline": {"inflight": 20, "size": 500},
+        "outbox": {
+            "size": 1000,
+            "rate": 20,
+            "flush": 10,
+            "file": f"{TMP_DIR}/homeagent_outbox.json",
+        },
+        "history": {"sensors": HISTORY_SENSORS, "tiers": HISTORY_TIERS},
         "args": args,
         "device": {
             "topic": DEVICE_TOPIC,
@@ -193,8 +232,20 @@ def load_config(args: dict) -> dict:
             "publish": PUBLISH_SENSORS,
             "icons": ICON_MAP,
             "prefix_icons": ICON_PREFIX_MAP,
+            "qos": QOS_MAP,
         },
         "intervals": {"collector": 30, "publisher": 60},
+        "scheduler": {
+            "mode": "thread",
+            "workers": 0,
+            "catch_up": None,
+            "timers": "heap",
+            "timeouts": {},
+            "abandon": False,
+            "spread": 0,
+            "jitter": 0,
+            "wake_window": 0,
+        },
     }
     params.update(_config)
     params["hostname"] = HOSTNAME
@@ -1,7 +1,6 @@
 """Class for MQTT messaging"""
 
 import ssl
-import json
 import time
 import platform
 import socket
@@ -10,7 +9,11 @@ from paho.mqtt.client import WebsocketConnectionError, Client as Mqtt
 
 
 from service.log import LOGGER
-from service.const import TOPIC, PAYLOAD
+from service.const import TOPIC, PAYLOAD, QUEUED
+from service.outbox import Outbox
+from service.pipeline import PublishPipeline
+from service.scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from service.serializer import get_serializer
 
 if platform.system() == "Linux":
     TLS_CA_CERT = "/etc/ssl/certs/ca-certificates.crt"
@@ -61,6 +64,25 @@ class Connector(Mqtt):
         self._callback = None
         self._tries = 0
         self._subscribe = []
+        self._serializer = get_serializer(config.serializer)
+        self._outbox = None
+        _outbox_conf = config.get("outbox") or {}
+        if _outbox_conf.get("size"):
+            self._outbox = Outbox(
+                file_name=_outbox_conf.get("file"),
+                max_messages=_outbox_conf.get("size"),
+                rate=_outbox_conf.get("rate", 20),
+                flush=_outbox_conf.get("flush", 10),
+            )
+        _pipeline_conf = config.get("pipeline") or {}
+        self._inflight = _pipeline_conf.get("inflight", 20)
+        self._pipeline = PublishPipeline(
+            self._publish_message,
+            fallback=self._queue_message,
+            inflight=self._inflight,
+            size=_pipeline_conf.get("size", 500),
+            serializer=self._serializer,
+        )
         self._setup()
 
     ##########################################
@@ -75,8 +97,10 @@ class Connector(Mqtt):
             )
 
         self.reconnect_delay_set(min_delay=3, max_delay=30)
+        self.max_inflight_messages_set(self._inflight)
         self.on_connect = self._callback_connect
         self.on_disconnect = self._callback_disconnect
+        self.on_publish = self._callback_publish
         self.on_subscribe = self._callback_subscribe
         self.on_message = self._callback_message
         self.on_log = self._callback_log
@@ -101,14 +125,18 @@ class Connector(Mqtt):
         self._connected_event.clear()
         self._connect()
         self.loop_start()
+        self._pipeline.start()
 
     ##########################################
     def stop(self):
         """Stop message loop and disconnect"""
         LOGGER.info("%s Stopping message loop", LOG_PREFIX)
         self._tries = 0
+        self._pipeline.stop()
         self.loop_stop()
         self.disconnect()
+        if self._outbox is not None:
+            self._outbox.save(True)
         LOGGER.info("%s Exit", LOG_PREFIX)
 
     ##########################################
@@ -160,9 +188,12 @@ class Connector(Mqtt):
                 self._config.mqtt.port,
             )
 
-            for topic in self._subscribe:
+            for topic, qos in self._subscribe:
                 LOGGER.info("%s Subscribing to %s", LOG_PREFIX, topic)
-                self.subscribe(topic, 0)
+                self.subscribe(topic, qos)
+
+            if self._outbox is not None:
+                self._outbox.drain(self._drain_message, self.connected)
 
             self._connected_event.set()
 
@@ -189,6 +220,7 @@ class Connector(Mqtt):
 
         self._connected = False
         self._connected_event.clear()
+        self._pipeline.reset()
         if self._tries > 20:
             LOGGER.error("%s Failed to re-connect. Exit", LOG_PREFIX)
             self.stop()
@@ -200,6 +232,13 @@ class Connector(Mqtt):
             self._setup()
             self.start()
 
+    ##########################################
+    def _callback_publish(
+        self, mqttc, obj, mid
+    ):  # pylint: disable=unused-argument
+        """Message was sent or acknowledged by the broker"""
+        self._pipeline.acked(mid)
+
     ##########################################
     def _callback_log(
         self, mqttc, obj, level, string
@@ -218,9 +257,9 @@ class Connector(Mqtt):
             payload = str(msg.payload.decode("utf-8"))
             if payload[0] == "}":
                 try:
-                    payload = json.loads(payload)
+                    payload = self._serializer.loads(payload)
 
-                except json.JSONDecodeError as err:
+                except ValueError as err:
                     LOGGER.error(
                         "%s Failed to decode JSON payload. %s", LOG_PREFIX, err
                     )
@@ -248,9 +287,9 @@ class Connector(Mqtt):
         self._callback = callback
 
     ##########################################
-    def set_will(self, topic: str, payload: str):
+    def set_will(self, topic: str, payload: str, qos: int = 0, retain: bool = False):
         """Set exit() will message"""
-        self.will_set(topic, payload=payload, qos=0, retain=False)
+        self.will_set(topic, payload=payload, qos=qos, retain=retain)
 
     ##########################################
     def _callback_subscribe(
@@ -266,13 +305,13 @@ class Connector(Mqtt):
         )
 
     ##########################################
-    def subscribe_to(self, topic: str = None):
+    def subscribe_to(self, topic: str = None, qos: int = 0):
         """Add topic to subscribe"""
         if not topic:
             return
         LOGGER.debug("%s Subscribe to %s", LOG_PREFIX, topic)
-        self._subscribe.append(topic)
-        self.subscribe(topic, 0)
+        self._subscribe.append((topic, qos))
+        self.subscribe(topic, qos)
 
     ##########################################
     def pub(
@@ -281,33 +320,77 @@ class Connector(Mqtt):
         payload: dict,
         qos: int = 1,
         retain: bool = False,
-    ) -> bool:
-        """Publish payload to MQTT topic"""
+        priority: int = PRIORITY_NORMAL,
+    ):
+        """
+        Queue payload for MQTT topic. Dict payloads are encoded
+        on the publish thread. Return True when handed to the publish
+        pipeline, QUEUED when kept in the outbox while disconnected
+        and False when the message was dropped
+        """
         if not self._running.is_set():
             return False
 
-        if not self._connected:
+        if self._outbox is not None:
+            if not self._connected:
+                LOGGER.debug("%s queue: %s", LOG_PREFIX, topic)
+                if isinstance(payload, dict):
+                    payload = self._serializer.dumps(payload)
+                return self._outbox.put(topic, payload, qos, retain) and QUEUED
+
+            self._outbox.discard(topic)
+
+        elif not self._connected:
             self._connect()
 
-        if isinstance(payload, dict):
-            payload = json.dumps(
-                payload,
-                default=str,
-            )
+        return self._pipeline.put(topic, payload, qos, retain, priority)
 
+    ##########################################
+    def _publish_message(self, topic: str, payload, qos: int, retain: bool):
+        """Publish message. Return MQTTMessageInfo or None"""
         LOGGER.debug("%s publish: %s", LOG_PREFIX, topic)
-
         try:
-            self.publish(topic, payload=payload, qos=qos, retain=retain)
+            info = self.publish(topic, payload=payload, qos=qos, retain=retain)
             self._connected_event.set()
 
         except WebsocketConnectionError as err:
             LOGGER.error("%s Publish failed. %s", LOG_PREFIX, err)
-            return False
+            return None
+
+        if info.rc != 0:
+            LOGGER.debug("%s Publish %s failed. rc=%s", LOG_PREFIX, topic, info.rc)
+
+        return info
 
-        return True
+    ##########################################
+    def _drain_message(self, topic: str, payload: str, qos: int, retain: bool):
+        """
+        Hand message from the outbox to the pipeline so it is sent
+        before newer messages for the same topic
+        """
+        return self._pipeline.put(topic, payload, qos, retain, PRIORITY_LOW)
+
+    ##########################################
+    def _queue_message(self, topic: str, payload, qos: int, retain: bool):
+        """Keep message that could not be sent in the outbox"""
+        if self._outbox is not None:
+            self._outbox.put(topic, payload, qos, retain)
+
+    ##########################################
+    def queueing(self) -> bool:
+        """Return True if messages are kept in the outbox while disconnected"""
+        return self._outbox is not None
+
+    ##########################################
+    def stats(self) -> dict:
+        """Return publish counters"""
+        stats = self._pipeline.stats()
+        stats["outbox"] = len(self._outbox) if self._outbox is not None else 0
+        return stats
 
     ##########################################
     def ping(self, topic: str, src: str) -> bool:
         """Send ping message"""
-        return self.pub(topic, {"ping": "request", "src": src})
+        return self.pub(
+            topic, {"ping": "request", "src": src}, priority=PRIORITY_HIGH
+        )
@@ -0,0 +1,237 @@
+"""Precompiled sensor metadata registry"""
+
+import threading
+from collections import deque
+from typing import NamedTuple
+
+
+from device.setup import setup_discovery, discovery_hash
+from service.log import LOGGER
+from service.serializer import get_serializer
+from service.const import (
+    TOPIC,
+    PAYLOAD,
+    UNIQUE_ID,
+    SENSOR,
+    STRING_UNDERSCORE,
+    STRING_SPACE,
+)
+
+LOG_PREFIX = r"[Registry]"
+
+
+##########################################
+class PrefixMatcher:  # pylint: disable=too-few-public-methods
+    """
+    Aho-Corasick automaton over a list of patterns.
+    first() returns the earliest listed pattern found anywhere
+    in a text in one pass over the text
+    """
+
+    ##########################################
+    def __init__(self, patterns):
+        self.patterns = tuple(patterns)
+        self._goto = [{}]
+        self._fail = [0]
+        self._best = [None]
+        for idx, pattern in enumerate(self.patterns):
+            self._add(pattern, idx)
+
+        self._build()
+
+    ##########################################
+    def _add(self, pattern: str, idx: int):
+        """Add pattern to the trie"""
+
+        state = 0
+        for char in pattern:
+            nxt = self._goto[state].get(char)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[state][char] = nxt
+                self._goto.append({})
+                self._fail.append(0)
+                self._best.append(None)
+            state = nxt
+
+        if self._best[state] is None or idx < self._best[state]:
+            self._best[state] = idx
+
+    ##########################################
+    def _build(self):
+        """Set failure links and lowest pattern index per state"""
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                inherited = self._best[self._fail[nxt]]
+                if inherited is not None and (
+                    self._best[nxt] is None or inherited < self._best[nxt]
+                ):
+                    self._best[nxt] = inherited
+
+                queue.append(nxt)
+
+    ##########################################
+    def first(self, text: str) -> str:
+        """Return earliest listed pattern contained in text or None"""
+
+        state = 0
+        best = None
+        for char in text:
+            while state and char not in self._goto[state]:
+                state = self._fail[state]
+
+            state = self._goto[state].get(char, 0)
+            found = self._best[state]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+
+        return None if best is None else self.patterns[best]
+
+
+##########################################
+class SensorMeta(NamedTuple):
+    """Frozen sensor metadata and discovery config encoded once"""
+
+    slug: str
+    name: str
+    sensor_type: str
+    unique_id: str
+    config_topic: str
+    state_topic: str
+    attrib_topic: str
+    payload: dict
+    hash: str
+    encoded: str
+
+    ##########################################
+    def discovery(self) -> dict:
+        """Return discovery message with the pre-encoded payload"""
+
+        return {TOPIC: self.config_topic, PAYLOAD: self.encoded}
+
+
+##########################################
+class SensorRegistry:  # pylint: disable=too-many-instance-attributes
+    """
+    Sensor metadata built once per sensor. Sensors matching the
+    publish prefixes get their device class and icon from the prefix
+    maps when they are first seen. Discovery configs and their hashes
+    are cached until invalidated
+    """
+
+    ##########################################
+    def __init__(self, config: dict, batch_topic: str = None, serializer=None):
+        self._config = config
+        self._batch_topic = batch_topic
+        self._serializer = serializer or get_serializer()
+        self._lock = threading.Lock()
+        self._publish = PrefixMatcher(config.sensors.get("prefix", []))
+        self._class = PrefixMatcher(config.sensors.prefix_class.keys())
+        self._icon = PrefixMatcher(config.sensors.prefix_icons.keys())
+        self._seen = set()
+        self._meta = {}
+
+    ##########################################
+    def add(self, slugs) -> list:
+        """
+        Check state keys not seen before against the prefixes.
+        Return list of new keys matching a publish prefix
+        """
+
+        with self._lock:
+            new = [slug for slug in slugs if slug not in self._seen]
+            self._seen.update(new)
+
+        added = []
+        for slug in new:
+            if self._publish.first(slug) is None:
+                continue
+
+            added.append(slug)
+            self._meta.pop(slug, None)
+            prefix = self._class.first(slug)
+            if prefix is not None:
+                value = self._config.sensors.prefix_class.get(prefix)
+                self._config.sensors.sensor_class[slug] = value
+                LOGGER.debug(
+                    "%s prefix_class: %s for sensor: %s %s",
+                    LOG_PREFIX,
+                    prefix,
+                    slug,
+                    value,
+                )
+
+            prefix = self._icon.first(slug)
+            if prefix is not None:
+                value = self._config.sensors.prefix_icons.get(prefix)
+                self._config.sensors.icons[slug] = value
+                LOGGER.debug(
+                    "%s prefix_icon: %s for sensor: %s", LOG_PREFIX, prefix, slug
+                )
+
+        return added
+
+    ##########################################
+    def get(self, slug: str) -> SensorMeta:
+        """Return metadata for sensor, building it on first use"""
+
+        meta = self._meta.get(slug)
+        if meta is None:
+            meta = self._build(slug)
+            with self._lock:
+                self._meta[slug] = meta
+
+        return meta
+
+    ##########################################
+    def _build(self, slug: str) -> SensorMeta:
+        """Build sensor metadata from config"""
+
+        name = slug.title().replace(STRING_UNDERSCORE, STRING_SPACE)
+        _data = setup_discovery(self._config, name, self._batch_topic)
+        payload = _data[PAYLOAD]
+        topic = _data[TOPIC].split("/config", 2)[0]
+        return SensorMeta(
+            slug=slug,
+            name=name,
+            sensor_type=self._config.sensors.type.get(slug, SENSOR),
+            unique_id=payload[UNIQUE_ID],
+            config_topic=_data[TOPIC],
+            state_topic=f"{topic}/state",
+            attrib_topic=f"{topic}/attrib",
+            payload=payload,
+            hash=discovery_hash(payload),
+            encoded=self._serializer.dumps(payload),
+        )
+
+    ##########################################
+    def discard(self, slug: str):
+        """Forget sensor so it is checked again when it reappears"""
+
+        with self._lock:
+            self._seen.discard(slug)
+            self._meta.pop(slug, None)
+
+    ##########################################
+    def prune(self, slugs):
+        """Forget state keys that are gone so only current keys stay seen"""
+
+        with self._lock:
+            self._seen.difference_update(slugs)
+
+    ##########################################
+    def invalidate(self):
+        """Drop cached metadata after sensor config changed"""
+
+        with self._lock:
+            self._meta.clear()
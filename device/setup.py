@@ -1,5 +1,7 @@
 """Functions to setup devices"""
 
+import json
+import hashlib
 
 from service.log import LOGGER
 from service.const import (
@@ -10,13 +12,17 @@ from service.const import (
     MANUFACTURER,
     MODEL,
     SENSOR,
+    BINARY_SENSOR,
     UNIQUE_ID,
+    OBJECT_ID,
+    AVAILABILITY_TOPIC,
     STATE_TOPIC,
     TOPIC,
     PAYLOAD,
 )
 
 LOG_PREFIX = r"[Device]"
+BATCH_TYPES = (SENSOR, BINARY_SENSOR)
 
 
 ##########################################
@@ -43,9 +49,17 @@ def setup_device(config: dict, states: dict):
 
 ########################################################
 def setup_sensor(
-    _config: dict, sensor: str = "Status", sensor_type: str = None, attribs: dict = None
+    _config: dict,
+    sensor: str = "Status",
+    sensor_type: str = None,
+    attribs: dict = None,
+    batch_topic: str = None,
 ) -> dict:
-    """Return dict with sensor config"""
+    """
+    Return dict with sensor config. With batch_topic sensor and
+    binary_sensor entities read their state and attributes from
+    the device-level documents under batch_topic
+    """
 
     device_name = _config.hostname.lower().replace(" ", "_")
     sensor_name = sensor.lower().replace(" ", "_")
@@ -89,7 +103,46 @@ def setup_sensor(
     if _icon:
         payload.update({"icon": f"mdi:{_icon}"})
 
+    if batch_topic and sensor_type in BATCH_TYPES:
+        payload.update(
+            {
+                STATE_TOPIC: f"{batch_topic}/state",
+                "value_template": f"{{{{ value_json['{sensor_name}'] }}}}",
+                "json_attributes_topic": f"{batch_topic}/attrib",
+                "json_attributes_template": (
+                    f"{{{{ value_json.get('{sensor_name}', {{}}) | tojson }}}}"
+                ),
+            }
+        )
+
     return {
         TOPIC: config_topic,
         PAYLOAD: payload,
     }
+
+
+########################################################
+def setup_discovery(_config: dict, sensor: str, batch_topic: str = None) -> dict:
+    """
+    Return dict with complete sensor discovery config.
+    object_id keeps the entity id derived from the unique id
+    while name is the friendly sensor name
+    """
+
+    _data = setup_sensor(_config, sensor, batch_topic=batch_topic)
+    _data[PAYLOAD].update(
+        {
+            NAME: sensor,
+            OBJECT_ID: _data[PAYLOAD][UNIQUE_ID],
+            AVAILABILITY_TOPIC: _config.device.availability,
+        }
+    )
+    return _data
+
+
+########################################################
+def discovery_hash(payload: dict) -> str:
+    """Return content hash of discovery payload"""
+
+    data = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.sha1(data.encode("utf-8")).hexdigest()
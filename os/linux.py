@@ -52,6 +52,7 @@ class AgentPlatform:
         self._sysinfo = {}
         self._sensors = {}
         self._attribs = {}
+        self._polled = set()
         self._hardware = None
         self._get_system_info()
 
@@ -259,4 +260,10 @@ class AgentPlatform:
             _data["battery_percent"] = int(battery.percent)
             _data["battery_plugged_in"] = battery.power_plugged
 
+        # Drop disks, interfaces and sensors that are gone
+        for key in self._polled.difference(_data):
+            self._sensors.pop(key, None)
+            self._attribs.pop(key, None)
+
+        self._polled = set(_data)
         self._sensors.update(_data)
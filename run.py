@@ -8,7 +8,8 @@ import logging
 
 
 from service.states import ThreadSafeDict
-from service.scheduler import Scheduler
+from service.scheduler import Scheduler, SchedulerOptions
+from service.async_scheduler import AsyncScheduler
 from service.agent_args import parse_args
 from service.agent import LOG_PREFIX, HomeAgent
 from service.log import LOGGER
@@ -28,7 +29,16 @@ def run_service(config: Config, _sensors=None):
     _running = threading.Event()
     _running.set()
 
-    sched = Scheduler(_state, _running)
+    _sched_conf = config.get("scheduler", {})
+    _sched_class = Scheduler
+    if _sched_conf.get("mode") == "asyncio":
+        _sched_class = AsyncScheduler
+
+    sched = _sched_class(
+        _state,
+        _running,
+        options=SchedulerOptions.from_config(_sched_conf, config.hostname),
+    )
     agent = HomeAgent(config, _running, sched, _sensors)
 
     sched.run(agent.start)
@@ -8,16 +8,35 @@ import threading
 import importlib
 import pathlib
 import glob
-import json
 import ipaddress
+from concurrent.futures import ThreadPoolExecutor
 from psutil import LINUX
 
 
-from config import CONN_DIR, HW_DIR, MOD_DIR, ONLINE_ATTRIB, OS_DIR, Config
-from device.setup import setup_device, setup_sensor
+from config import (
+    CONN_DIR,
+    HISTORY_SENSORS,
+    HISTORY_TIERS,
+    HW_DIR,
+    MOD_DIR,
+    ONLINE_ATTRIB,
+    OS_DIR,
+    Config,
+)
+from device.setup import setup_device, setup_sensor, BATCH_TYPES
+from device.registry import SensorRegistry
 from service.log import LOGGER
-from service.scheduler import Scheduler
-from service.states import ThreadSafeDict, load_states, save_states
+from service.scheduler import (
+    Scheduler,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_LOW,
+)
+from service.states import StateStore, SensorHistory
+from service.persist import StatePersistence
+from service.filters import PublishFilter, PublishPolicy
+from service.serializer import get_serializer
+from service.router import TopicRouter
 from service.util import calc_elapsed, gps_moving, gps_update
 from service.const import (
     ATTRIBS,
@@ -30,12 +49,12 @@ from service.const import (
     PING,
     PONG,
     EVENT,
-    SET,
     BIRTH,
     WILL,
     ONLINE,
     OFFLINE,
     PUBLISH,
+    QUEUED,
     SERIAL,
     IP_ADDRESS,
     MAC_ADDRESS,
@@ -52,6 +71,19 @@ from service.const import (
     CONNECTED,
     RESET,
     GPS,
+    SCHEDULER,
+    SCHEDULER_LAG,
+    HISTORY,
+    FILTERS,
+    QOS,
+    RETAIN,
+    SENSOR,
+    SENSORS,
+    TYPES,
+    DISCOVERY,
+    AVAILABILITY,
+    COMMAND,
+    LATENESS,
     EMPTY_STRING,
     STRING_SPACE,
     STRING_UNDERSCORE,
@@ -79,16 +111,57 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         self._config: dict = config
         self._running: threading.Event = running
         self._sched: Scheduler = sched
-        self._sensors = ThreadSafeDict()
-        self._states = ThreadSafeDict()
-        self._attribs = ThreadSafeDict()
+        self._sensors = StateStore()
+        self._states = StateStore()
+        self._attribs = StateStore()
         self._stats = {LAST: {}}
         self._connector = None
         self._ha_connected: bool = False
         self._modules: dict = {}
         self._callback: dict = {}
         self._services: dict = {}
+        self._router = TopicRouter()
+        self._commands = ThreadPoolExecutor(max_workers=1, thread_name_prefix="command")
         self._last_sensors: dict = {}
+        self._published_version: int = 0
+        self._publish_lock = threading.Lock()
+        self._serializer = get_serializer(self._config.get("serializer"))
+        _persist_conf = self._config.get("persist") or {}
+        self._persist = StatePersistence(
+            self._config.state_file,
+            journal=_persist_conf.get("journal", True),
+            compact=_persist_conf.get("compact", 100),
+            file_format=_persist_conf.get("format", "json"),
+            serializer=self._serializer,
+        )
+        self._filter = PublishFilter(self._config.get(FILTERS))
+        _policy = self._config.sensors.get(QOS) or {}
+        _policy_conf = self._config.get(QOS) or {}
+        self._policy = PublishPolicy(
+            {
+                key: {**(_policy.get(key) or {}), **(_policy_conf.get(key) or {})}
+                for key in (SENSORS, TYPES)
+            }
+        )
+        _publish_conf = self._config.get("publish") or {}
+        self._batch_topic = (
+            self._config.device.topic if _publish_conf.get("batch") else None
+        )
+
+        self._batch_states: dict = {}
+        self._discovery: dict = {}
+        self._registry = SensorRegistry(
+            self._config, self._batch_topic, self._serializer
+        )
+        self._dynamic: set = set()
+        self._platform_keys: set = set()
+        self._keys_version: int = 0
+        self._batch_attribs: dict = {}
+        _history_conf = self._config.get("history") or {}
+        self._history = SensorHistory(
+            _history_conf.get("sensors", HISTORY_SENSORS),
+            _history_conf.get("tiers", HISTORY_TIERS),
+        )
         self.platform_class = None
         self.device: dict = {}
         self.icons: dict = {}
@@ -96,8 +169,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         if sensors is None:
             sensors = self._config.sensors.get(PUBLISH)
 
-        with self._sensors as _sensors:
-            _sensors.update(sensors)
+        self._sensors.update(sensors)
 
         self._os_module()
         self._connector_module()
@@ -116,6 +188,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             if hasattr(mod_class, "stop"):
                 mod_class.stop()
 
+        self._commands.shutdown(wait=False)
         LOGGER.info("%s Disconnect from HA", LOG_PREFIX)
         self._connected_event.clear()
         self._connector.stop()
@@ -142,7 +215,9 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             LOG_PREFIX,
             self._config.intervals.ping,
         )
-        self._sched.queue(self.conn_ping, self._config.intervals.ping, True)
+        self._sched.queue(
+            self.conn_ping, self._config.intervals.ping, True, priority=PRIORITY_HIGH
+        )
 
         self._add_sensor_prefixes()
         self._setup_module_sensors()
@@ -170,8 +245,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
                 LOG_PREFIX,
                 self._config.intervals.gps,
             )
-            with self._states as _states:
-                _states["has_gps"] = True
+            self._states.set("has_gps", True)
             self._sched.queue(self.gps, self._config.intervals.gps, True)
         else:
             self.update_device_tracker()
@@ -234,10 +308,15 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         )
 
         self._connector.set_callback(self.message_receive)
-        self._connector.set_will(f"{self._config.device.topic}/status", OFFLINE)
+        qos, retain = self._policy.get(sensor_type=AVAILABILITY)
+        self._connector.set_will(
+            f"{self._config.device.topic}/status", OFFLINE, qos, retain
+        )
+        qos, _ = self._policy.get(sensor_type=COMMAND)
         for topic in self._config.subscriptions:
             LOGGER.info("%s Connector subscribe: %s", LOG_PREFIX, topic)
-            self._connector.subscribe_to(topic)
+            self._connector.subscribe_to(topic, qos)
+            self._add_event_route(topic)
 
         self._connected_event.clear()
         try:
@@ -263,6 +342,16 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         )
         self._ha_connected = self._connector.connected()
 
+    ##########################################
+    def _add_event_route(self, topic: str):
+        """Route Home Assistant status and device event topics"""
+
+        if topic == f"{self._config.prefix.discover}/{STATUS}":
+            self._router.add(topic, self._cmd_ha_status)
+
+        elif topic.rsplit(FSLASH, 1)[-1] in (EVENT, STATUS):
+            self._router.add(topic, self._cmd_event)
+
     ##########################################
     def _load_hardware(self):
         """Load hardware modules"""
@@ -405,46 +494,18 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             self._conn_reset()
 
     ##########################################
-    def _add_sensor_prefixes(self):
-        """Add sensors that match prefixes"""
+    def _add_sensor_prefixes(self, keys=None) -> list:
+        """Add sensors that match prefixes and return list of added sensors"""
 
-        prefix_sensors = self._config.sensors.get("prefix", [])
-        prefix_class = tuple(self._config.sensors.prefix_class.keys())
-        prefix_icon = tuple(self._config.sensors.prefix_icons.keys())
+        if keys is None:
+            keys = self._states.keys()
 
-        with self._states as _states:
-            sensors = tuple(_states.keys())
-
-        for sensor in sensors:
-            item = [prefix for prefix in prefix_sensors if prefix in sensor]
-            if not item:
-                continue
-
-            # Add sensor to collection
-            with self._sensors as _sensors:
-                _sensors[sensor] = {}
-
-            # Add sensor device class data
-            item = [prefix for prefix in prefix_class if prefix in sensor]
-            if item:
-                value = self._config.sensors.prefix_class.get(item[0])
-                self._config.sensors.sensor_class[sensor] = value
-                LOGGER.debug(
-                    "%s prefix_class: %s for sensor: %s %s",
-                    LOG_PREFIX,
-                    item,
-                    sensor,
-                    value,
-                )
-
-            # Add sensor icon data
-            item = [prefix for prefix in prefix_icon if prefix in sensor]
-            if item:
-                LOGGER.debug(
-                    "%s prefix_icon: %s for sensor: %s", LOG_PREFIX, item, sensor
-                )
-                value = self._config.sensors.prefix_icons.get(item[0])
-                self._config.sensors.icons[sensor] = value
+        added = [
+            sensor for sensor in self._registry.add(keys) if sensor not in self._sensors
+        ]
+        self._dynamic.update(added)
+        self._sensors.update({sensor: {} for sensor in added})
+        return added
 
     ##########################################
     def get_identifiers(self):
@@ -452,8 +513,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
 
         items = [SERIAL, MAC_ADDRESS, IP_ADDRESS]
         _id = None
-        with self._states as _states:
-            states = _states.copy()
+        states = self._states.snapshot()
 
         while _id is None and len(items) > 0:
             _key = items.pop(0)
@@ -468,8 +528,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
     ##########################################
     def get_connections(self):
         """Get connection identifiers for this device"""
-        with self._states as _states:
-            states = _states.copy()
+        states = self._states.snapshot()
 
         _conn = [[IP_ADDRESS, states.get(IP_ADDRESS)]]
         for _value in states.get("mac_addresses"):
@@ -485,11 +544,14 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
 
         self.platform_class.update()
         states, attribs = self.platform_class.state()
-        with self._states as _states:
-            _states.update(states)
-
-        with self._attribs as _attribs:
-            _attribs.update(attribs)
+        removed = self._platform_keys.difference(states)
+        self._platform_keys = set(states)
+        self._states.update(states)
+        self._filter.sample(states)
+        self._attribs.update(attribs)
+        if removed:
+            self._states.remove(removed)
+            self._attribs.remove(removed)
 
     ##########################################
     def collector(self, only: str = None):
@@ -498,6 +560,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         LOGGER.debug("%s Running sensor data collection", LOG_PREFIX)
         self._stats[LAST]["collector"] = int(time.time())
         self.get_sensors()
+        self._scheduler_metrics()
 
         LOGGER.debug("%s Running modules", LOG_PREFIX)
         for slug, mod in self._modules.items():
@@ -505,14 +568,83 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
                 continue
 
             LOGGER.debug("%s module %s sensors", LOG_PREFIX, slug)
+            states = {}
+            attribs = {}
             for _sensor in mod.sensors:
                 _value, _attrib = mod.get(_sensor)
-                with self._states as _states:
-                    _states[_sensor] = _value
-
+                states[_sensor] = _value
                 if _attrib:
-                    with self._attribs as _attribs:
-                        _attribs[_sensor] = _attrib
+                    attribs[_sensor] = _attrib
+
+            self._states.update(states)
+            self._filter.sample(states)
+            if attribs:
+                self._attribs.update(attribs)
+
+        self._history.record_states(self._states.snapshot())
+        self._discover_sensors()
+
+    ##########################################
+    def _discover_sensors(self):
+        """
+        Set up sensors for state keys added since the last check
+        and remove sensors whose state keys are gone
+        """
+
+        version, keys = self._states.changed_since(self._keys_version)
+        self._keys_version = version
+        states = self._states.snapshot()
+        added = self._add_sensor_prefixes([key for key in keys if key in states])
+        gone = [key for key in keys if key not in states]
+        self._registry.prune(gone)
+        removed = [key for key in gone if key in self._dynamic]
+        if removed:
+            self._remove_sensors(removed)
+
+        if not added:
+            return
+
+        LOGGER.info("%s New sensors: %s", LOG_PREFIX, added)
+        if not self._ha_connected:
+            return
+
+        updated = {}
+        for sensor in added:
+            data = self._setup_sensor(sensor)
+            if data:
+                updated[sensor] = data
+
+        self._sensors.update(updated)
+        self.publish_sensors(list(updated), True)
+
+    ##########################################
+    def _remove_sensors(self, sensors: list):
+        """Remove sensors and their retained discovery configs"""
+
+        LOGGER.info("%s Removed sensors: %s", LOG_PREFIX, sensors)
+        for sensor in sensors:
+            if self._discovery.pop(sensor, None) is not None:
+                meta = self._registry.get(sensor)
+                qos, _ = self._policy.get(sensor_type=DISCOVERY)
+                self.message_send(
+                    {TOPIC: meta.config_topic, PAYLOAD: ""}, retain=True, qos=qos
+                )
+
+            self._registry.discard(sensor)
+            self._dynamic.discard(sensor)
+            with self._publish_lock:
+                self._last_sensors.pop(sensor, None)
+                self._batch_states.pop(sensor, None)
+                self._batch_attribs.pop(sensor, None)
+            self._sensors.pop(sensor)
+
+    ##########################################
+    def _scheduler_metrics(self):
+        """Update scheduler lag sensor with scheduler metrics"""
+
+        metrics = self._sched.get_metrics()
+        self._states.set(SCHEDULER_LAG, metrics.get(LATENESS))
+        self._attribs.set(SCHEDULER_LAG, metrics)
 
     ##########################################
     def events(self):
@@ -531,46 +663,59 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         self._save_state()
         if self._ha_connected:
             self._publish_online()
-            with self._sensors as _sensors:
-                sensors = _sensors.copy()
-            self.publish_sensors(sensors, update_all)
+            if update_all:
+                self._sched.run(self.publish_all, priority=PRIORITY_LOW)
+
+            else:
+                self.publish_sensors()
             self.update_device_tracker()
 
     ##########################################
-    def _save_state(self):
-        """Write state dict to file"""
-
-        with self._states as _states:
-            states = _states.copy()
-
-        with self._attribs as _attribs:
-            attribs = _attribs.copy()
+    def publish_all(self):
+        """Republish all sensor states"""
 
-        save_states(self._config.state_file, states, attribs, self.device)
+        LOGGER.debug("%s Publishing all sensors", LOG_PREFIX)
+        self.publish_sensors(None, True)
 
     ##########################################
-    def _load_state(self):
-        """Write state dict to file"""
-
-        if not os.path.exists(self._config.state_file):
-            return
-
-        data = load_states(self._config.state_file)
-        if not isinstance(data, dict):
-            return
+    def _save_state(self):
+        """Save states changed since last save"""
 
-        with self._states as _states:
-            _states.update(data.get(STATE))
+        try:
+            if not self._persist.save(self._states, self._attribs, self.device):
+                LOGGER.debug("%s States unchanged. Skip save", LOG_PREFIX)
 
-        with self._attribs as _attribs:
-            _attribs.update(data.get(ATTRIBS))
+        except OSError as err:
+            LOGGER.error("%s Failed to save states. %s", LOG_PREFIX, err)
 
     ##########################################
-    def message_send(self, _data):
-        """Send message to Home Assistant using connector"""
+    def _load_state(self):
+        """
+        Load states from snapshot and journal. Restored keys not owned
+        by a module are checked by the first platform collection so
+        keys gone since the last run are removed
+        """
+
+        data = self._persist.load()
+        states = data.get(STATE) or {}
+        self._states.update(states)
+        self._attribs.update(data.get(ATTRIBS))
+        owned = {SCHEDULER_LAG}.union(*(mod.sensors for mod in self._modules.values()))
+        self._platform_keys = set(states).difference(owned)
 
-        if not self._ha_connected:
-            return False
+    ##########################################
+    def message_send(
+        self,
+        _data,
+        retain: bool = False,
+        priority: int = PRIORITY_NORMAL,
+        qos: int = 1,
+    ):
+        """
+        Send message to Home Assistant using connector. Return True
+        when sent, QUEUED when kept until the broker is reachable
+        and False on error
+        """
 
         topic = _data.get(TOPIC)
         payload = _data.get(PAYLOAD)
@@ -580,7 +725,9 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             LOGGER.error("%s payload: %s", LOG_PREFIX, payload)
             return False
 
-        return self._connector.pub(topic, payload)
+        return self._connector.pub(
+            topic, payload, qos=qos, retain=retain, priority=priority
+        )
 
     ##########################################
     def message_receive(self, _data: dict):
@@ -591,91 +738,148 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
 
     ##########################################
     def process_cmd(self, _data: dict):
-        """Process message from Home Assistant"""
-
-        topic = _data.get(TOPIC, EMPTY_STRING).split(FSLASH)
-        command = topic[-1]
+        """
+        Look up handler for message from Home Assistant and
+        run it on the scheduler instead of the connector thread.
+        When the scheduler runs tasks in its loop thread commands
+        run one at a time in the command thread so a slow
+        handler does not hold up polling
+        """
+
+        topic = _data.get(TOPIC, EMPTY_STRING)
         payload = _data.get(PAYLOAD)
-        LOGGER.debug(
-            "%s %s.%s payload: %s",
-            LOG_PREFIX,
-            topic,
-            command,
-            payload,
-        )
-        now = int(time.time())
-        if command in [EVENT, STATUS]:
-            LOGGER.debug("%s Event: %s", LOG_PREFIX, command)
-            self._stats[LAST][EVENT] = now
-
-            event_type = payload.lower()
-            if event_type in [BIRTH, ONLINE, PONG]:
-                self._stats[LAST][event_type] = now
-                if not self._ha_connected:
-                    LOGGER.info("%s Home Assistant connection is online", LOG_PREFIX)
-                    self._ha_connected = True
-                    self._setup_sensors()
-                    self._setup_device_tracker()
-
-            elif event_type in [WILL, OFFLINE]:
-                self._stats[LAST][event_type] = now
-                LOGGER.warning(
-                    "%s Home Assistant connection received %s event",
-                    LOG_PREFIX,
-                    event_type,
-                )
-                # self._ha_connected = False
+        LOGGER.debug("%s %s payload: %s", LOG_PREFIX, topic, payload)
+        route = self._router.match(topic)
+        if route is None:
+            LOGGER.debug("%s No handler for %s", LOG_PREFIX, topic)
+            return
 
-            elif event_type == GET:
-                self._stats[LAST][event_type] = now
-                LOGGER.debug("%s Get %s", LOG_PREFIX, command)
-                self.message_send(
-                    {
-                        TOPIC: f"{self._config.device.topic}/status",
-                        PAYLOAD: self._stats,
-                    }
-                )
+        handler, args = route
+        if self._sched.inline:
+            self._commands.submit(self._run_cmd, (handler, args, payload))
+            return
+
+        self._sched.run(self._run_cmd, (handler, args, payload), priority=PRIORITY_HIGH)
+
+    ##########################################
+    def _run_cmd(self, cmd: tuple):
+        """Run command handler with its route arguments and payload"""
+
+        handler, args, payload = cmd
+        try:
+            handler(*args, payload)
 
-        elif command == SET:
-            sensor = (
-                _data.get(TOPIC, EMPTY_STRING)
-                .split(FSLASH)[-2]
-                .split(STRING_UNDERSCORE, 1)[1]
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.error("%s Command handler %s failed. %s", LOG_PREFIX, handler, err)
+            LOGGER.error(traceback.format_exc())
+
+    ##########################################
+    def _cmd_ha_status(self, payload: str):
+        """
+        Home Assistant status topic. Home Assistant sends online when
+        it starts so it is handled as a birth event. Other messages
+        like our own ping requests are ignored
+        """
+
+        status = str(payload).lower()
+        if status == ONLINE:
+            self._cmd_event(BIRTH)
+
+        elif status == OFFLINE:
+            self._cmd_event(OFFLINE)
+
+    ##########################################
+    def _cmd_event(self, payload: str):
+        """Home Assistant status and device events"""
+
+        now = int(time.time())
+        LOGGER.debug("%s Event: %s", LOG_PREFIX, payload)
+        self._stats[LAST][EVENT] = now
+
+        event_type = str(payload).lower()
+        if event_type in [BIRTH, ONLINE, PONG]:
+            self._stats[LAST][event_type] = now
+            if event_type == BIRTH:
+                LOGGER.info("%s Home Assistant restarted", LOG_PREFIX)
+                self._ha_connected = True
+                self._setup_sensors(True)
+                self._setup_device_tracker()
+
+            elif not self._ha_connected:
+                LOGGER.info("%s Home Assistant connection is online", LOG_PREFIX)
+                self._ha_connected = True
+                self._setup_sensors()
+                self._setup_device_tracker()
+
+        elif event_type in [WILL, OFFLINE]:
+            self._stats[LAST][event_type] = now
+            LOGGER.warning(
+                "%s Home Assistant connection received %s event",
+                LOG_PREFIX,
+                event_type,
+            )
+            # self._ha_connected = False
+
+        elif event_type == GET:
+            self._stats[LAST][event_type] = now
+            LOGGER.debug("%s Get %s", LOG_PREFIX, event_type)
+            self._stats[SCHEDULER] = self._sched.get_metrics()
+            self._stats[HISTORY] = self._history.summary()
+            self._stats[PUBLISH] = self._connector.stats()
+            stats = dict(self._stats)
+            stats[LAST] = dict(stats[LAST])
+            self.message_send(
+                {
+                    TOPIC: f"{self._config.device.topic}/status",
+                    PAYLOAD: self._serializer.dumps(stats),
+                },
+                priority=PRIORITY_HIGH,
             )
-            LOGGER.info("%s cmd set: %s state: %s", LOG_PREFIX, sensor, payload)
-            if sensor in self._callback:
-                _func = self._callback.get(sensor)
-                _state = _func(sensor, payload)
-                with self._states as _states:
-                    _states[sensor] = _state
 
-                self.publish_sensors([sensor], True)
+    ##########################################
+    def _cmd_set(self, sensor: str, payload):
+        """Set sensor state with the module callback"""
 
-        elif command == GET:
-            _type = payload.lower()
-            LOGGER.info("%s cmd get: %s", LOG_PREFIX, _type)
+        LOGGER.info("%s cmd set: %s state: %s", LOG_PREFIX, sensor, payload)
+        _func = self._callback.get(sensor)
+        if _func is None:
+            return
 
-        elif command in self._services:
-            LOGGER.info("%s cmd calling service %s()", LOG_PREFIX, command)
-            try:
-                self._services[command](json.loads(payload))
+        _state = _func(sensor, payload)
+        self._states.set(sensor, _state)
+        self.publish_sensors([sensor], True)
 
-            except json.JSONDecodeError as err:
-                LOGGER.error("%s Failed to decode command payload. %s", LOG_PREFIX, err)
-                LOGGER.error("%s payload: %s", LOG_PREFIX, payload)
+    ##########################################
+    def _cmd_service(self, service: str, payload: str):
+        """Call module service with JSON payload"""
 
-            except Exception as err:  # pylint: disable=broad-except
-                LOGGER.error("%s Module command error. %s", LOG_PREFIX, err)
+        LOGGER.info("%s cmd calling service %s()", LOG_PREFIX, service)
+        try:
+            self._services[service](self._serializer.loads(payload))
+
+        except ValueError as err:
+            LOGGER.error("%s Failed to decode command payload. %s", LOG_PREFIX, err)
+            LOGGER.error("%s payload: %s", LOG_PREFIX, payload)
+
+        except Exception as err:  # pylint: disable=broad-except
+            LOGGER.error("%s Module command error. %s", LOG_PREFIX, err)
 
     ##########################################
     def _publish_online(self, state: str = "online"):
-        """Publish online status"""
+        """Publish online status. A queued status means the broker is unreachable"""
 
-        if not self.message_send(
-            {
-                TOPIC: f"{self._config.device.topic}/status",
-                PAYLOAD: state,
-            }
+        qos, retain = self._policy.get(sensor_type=AVAILABILITY)
+        if (
+            self.message_send(
+                {
+                    TOPIC: f"{self._config.device.topic}/status",
+                    PAYLOAD: state,
+                },
+                retain=retain,
+                priority=PRIORITY_HIGH,
+                qos=qos,
+            )
+            is not True
         ):
             self._ha_connected = False
 
@@ -684,10 +888,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         """Publish device config"""
 
         LOGGER.debug("%s publish_device %s", LOG_PREFIX, self._config.hostname)
-        with self._states as _states:
-            states = _states.copy()
-
-        self.device = setup_device(self._config, states)
+        self.device = setup_device(self._config, self._states.snapshot())
 
         _data = setup_sensor(
             self._config,
@@ -703,9 +904,10 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             }
         )
 
-        self.message_send(_data)
+        qos, retain = self._policy.get(sensor_type=DISCOVERY)
+        self.message_send(_data, retain=retain, qos=qos)
         _data[PAYLOAD][NAME] = "Online"
-        self.message_send(_data)
+        self.message_send(_data, retain=retain, qos=qos)
         self._publish_online()
 
     ##########################################
@@ -727,7 +929,10 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
                 )
                 self._services[_service] = getattr(mod_class, _service)
                 topic = f"{self._config.device.topic}/{_service}"
-                self._connector.subscribe_to(topic)
+                self._router.add(topic, self._cmd_service, _service)
+                self._connector.subscribe_to(
+                    topic, self._policy.get(sensor_type=COMMAND)[0]
+                )
 
     ##########################################
     def _setup_module_sensors(self):
@@ -770,131 +975,229 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
                 _name = sensor.title().replace(STRING_UNDERSCORE, STRING_SPACE)
                 LOGGER.debug("%s Setup module sensor: %s", LOG_PREFIX, _name)
                 data = setup_sensor(self._config, _name)
-                with self._sensors as _sensors:
-                    _sensors[sensor] = data
+                self._sensors.set(sensor, data)
 
                 state, attrib = mod_class.get(sensor)
-                with self._states as _states:
-                    _states[sensor] = state
+                self._states.set(sensor, state)
 
-    ##########################################
-    def _setup_sensors(self):
-        """Publish sensor config to MQTT broker"""
-        with self._states as _states:
-            states = dict(_states).copy()
+        self._registry.invalidate()
 
-        with self._sensors as _sensors:
-            sensors = dict(_sensors).copy()
+    ##########################################
+    def _setup_sensors(self, force: bool = False):
+        """
+        Publish retained sensor configs to MQTT broker.
+        A config is only sent again when its content hash
+        changed or force is set
+        """
+        states = self._states.snapshot()
+        sensors = self._sensors.snapshot()
+        updated = {}
 
-        for sensor in tuple(sensors.keys()):
-            _state = states.get(sensor)
-            if _state is None:
+        for sensor in sensors:
+            if states.get(sensor) is None:
                 continue
 
-            _name = sensor.title().replace(STRING_UNDERSCORE, STRING_SPACE)
-            _data = setup_sensor(self._config, _name)
-            _topic = _data.get(TOPIC).split("/config", 2)[0]
+            data = self._setup_sensor(sensor, force)
+            if data:
+                updated[sensor] = data
+
+        LOGGER.info("%s Set up %s sensor configs", LOG_PREFIX, len(updated))
+        self._sensors.update(updated)
+        self.publish_sensors()
 
-            self._connected_event.clear()
-            if not self.message_send(_data):
+    ##########################################
+    def _setup_sensor(self, sensor: str, force: bool = False) -> dict:
+        """
+        Publish sensor config if its hash changed or force is set.
+        A config queued while the broker is unreachable is sent again
+        on the next setup. Return sensor data or None if publishing failed
+        """
+
+        meta = self._registry.get(sensor)
+        if force or self._discovery.get(sensor) != meta.hash:
+            qos, retain = self._policy.get(sensor_type=DISCOVERY)
+            sent = self.message_send(meta.discovery(), retain=retain, qos=qos)
+            if not sent:
                 LOGGER.error(
-                    "%s Error publishing sensor setup %s: %s", LOG_PREFIX, _name, _topic
+                    "%s Error publishing sensor setup %s: %s",
+                    LOG_PREFIX,
+                    meta.name,
+                    meta.config_topic,
                 )
-                continue
-
-            self._connected_event.wait(4)
-            _data[PAYLOAD].update(
-                {NAME: _name, AVAILABILITY_TOPIC: self._config.device.availability}
-            )
+                return None
 
-            if not self.message_send(_data):
-                LOGGER.error("%s Error publishing sensor setup %s", LOG_PREFIX, _name)
+            self._discovery[sensor] = QUEUED if sent == QUEUED else meta.hash
 
-            _data[TOPIC] = f"{_topic}/state"
-            with self._sensors as _sensors:
-                _sensors[sensor] = _data
-
-            if sensor in self._callback:
-                _topic = f"{_topic}/set"
-                LOGGER.info("%s Sensor set subscription: %s", LOG_PREFIX, _topic)
-                self._connector.subscribe_to(_topic)
+        if sensor in self._callback:
+            _topic = meta.state_topic.rsplit("/state", 1)[0] + "/set"
+            LOGGER.info("%s Sensor set subscription: %s", LOG_PREFIX, _topic)
+            self._router.add(_topic, self._cmd_set, sensor)
+            self._connector.subscribe_to(
+                _topic, self._policy.get(sensor_type=COMMAND)[0]
+            )
 
-        self.publish_sensors()
+        return {TOPIC: meta.state_topic, PAYLOAD: meta.payload}
 
     ##########################################
     def publish_sensors(self, _sensors: dict = None, force_update: bool = False):
-        """Send sensor data to MQTT broker"""
-
-        if not self._ha_connected:
+        """
+        Send sensor data to MQTT broker.
+        Without a list of sensors only states changed since
+        the last publish are checked unless force_update is set.
+        Runs from several tasks so publishing is serialized
+        """
+
+        if not self._ha_connected and not self._connector.queueing():
             LOGGER.error(
                 "%s Not connected to HA and not publishing sensor data", LOG_PREFIX
             )
             return
 
-        with self._states as _states:
-            states = _states.copy()
+        with self._publish_lock:
+            now = time.time()
+            version = None
+            if _sensors is None and force_update:
+                version = self._states.version
+                _sensors = tuple(self._sensors.keys())
+
+            elif _sensors is None:
+                version, _sensors = self._states.changed_since(self._published_version)
+                _sensors = set(_sensors).union(self._filter.due(now))
+
+            states = self._states.snapshot()
+            sensors = self._sensors.snapshot()
+            attribs = self._attribs.snapshot()
+            types = self._config.sensors.type
+            batch = {STATE: False, ATTRIBS: False, QOS: 0, RETAIN: False}
+
+            LOGGER.debug(
+                "%s Running publish state for %s sensors and force=%s",
+                LOG_PREFIX,
+                len(_sensors),
+                force_update,
+            )
 
-        with self._sensors as _sensors:
-            sensors = _sensors.copy()
+            for slug in _sensors:
+                _topic = sensors.get(slug, {}).get(TOPIC)
+                _state = self._sensor_state(slug, states.get(slug))
+                if _topic is None or _state is None:
+                    continue
 
-        if _sensors is None:
-            _sensors = tuple(sensors.keys())
+                _state = self._filter.smoothed(slug, _state)
 
-        LOGGER.debug(
-            "%s Running publish state for %s sensors and force=%s",
-            LOG_PREFIX,
-            len(sensors),
-            force_update,
-        )
+                qos, retain = self._policy.get(slug, types.get(slug, SENSOR))
+                if isinstance(_state, bytearray):
+                    self.message_send(
+                        {TOPIC: _topic, PAYLOAD: _state}, retain, PRIORITY_LOW, qos
+                    )
+                    continue
 
-        for slug in _sensors:
-            _topic = sensors[slug].get(TOPIC)
-            if _topic is None:
-                # LOGGER.debug("%s sensor[%s] topic is None", LOG_PREFIX, slug)
-                continue
+                _last = self._last_sensors.get(slug)
+                if force_update or (
+                    _last is not None and self._filter.check(slug, _state, _last, now)
+                ):
+                    if not force_update:
+                        LOGGER.debug(
+                            "%s %s changed from [%s] to [%s]. Publishing new state",
+                            LOG_PREFIX,
+                            slug,
+                            _last,
+                            _state,
+                        )
 
-            _last = self._last_sensors.get(slug)
-            _state = states.get(slug)
-            _data = {TOPIC: _topic, PAYLOAD: _state}
+                    self._last_sensors[slug] = _state
+                    self._filter.published(slug, now)
+                    self._publish_state(
+                        slug, _topic, _state, attribs.get(slug), (qos, retain), batch
+                    )
 
-            if _state is None:
-                LOGGER.debug("%s %s state is None", LOG_PREFIX, slug)
-                continue
+            if batch[STATE]:
+                self._publish_batch(batch[ATTRIBS], batch[QOS], batch[RETAIN])
 
-            if isinstance(_state, int) and int(_state) not in range(0, 10000):
-                continue
+            if version is not None:
+                self._published_version = version
 
-            if isinstance(_state, bytearray):
-                self.message_send(_data)
-                continue
+        LOGGER.debug("%s Done updating sensors", LOG_PREFIX)
 
-            if isinstance(_state, list) and len(_state) == 1:
-                _state = next(iter(_state), [])
+    ##########################################
+    def _sensor_state(self, slug: str, _state):
+        """Return state cleaned up for publishing or None to skip sensor"""
 
-            elif isinstance(_state, str) and len(_state) > 0:
-                _state = _state.strip()
+        if _state is None:
+            LOGGER.debug("%s %s state is None", LOG_PREFIX, slug)
+            return None
 
-            if force_update or (_last is not None and _state != _last):
-                if not force_update:
-                    LOGGER.debug(
-                        "%s %s changed from [%s] to [%s]. Publishing new state",
-                        LOG_PREFIX,
-                        slug,
-                        _last,
-                        _state,
-                    )
+        if isinstance(_state, int) and int(_state) not in range(0, 10000):
+            return None
 
-                _data = {TOPIC: _topic, PAYLOAD: {STATE: _state}}
-                self.message_send(_data)
-                self._last_sensors[slug] = _state
-                with self._attribs as _attribs:
-                    _attrib = _attribs.get(slug)
+        if isinstance(_state, list) and len(_state) == 1:
+            return next(iter(_state), [])
 
-                if _attrib and _topic:
-                    _topic = _topic.split("/state", 2)[0] + "/attrib"
-                    self.message_send({TOPIC: _topic, PAYLOAD: _attrib})
+        if isinstance(_state, str) and len(_state) > 0:
+            return _state.strip()
 
-        LOGGER.debug("%s Done updating sensors", LOG_PREFIX)
+        return _state
+
+    ##########################################
+    def _publish_state(  # pylint: disable=too-many-arguments
+        self, slug: str, _topic: str, _state, _attrib, policy: tuple, batch: dict
+    ):
+        """Send sensor state and attributes or add them to the batch"""
+
+        qos, retain = policy
+        if self._batched(slug):
+            self._batch_states[slug] = _state
+            batch[STATE] = True
+            batch[QOS] = max(batch[QOS], qos)
+            batch[RETAIN] = batch[RETAIN] or retain
+            if _attrib:
+                self._batch_attribs[slug] = _attrib
+                batch[ATTRIBS] = True
+            return
+
+        self.message_send(
+            {TOPIC: _topic, PAYLOAD: {STATE: _state}}, retain, PRIORITY_LOW, qos
+        )
+        if _attrib:
+            self.message_send(
+                {TOPIC: self._registry.get(slug).attrib_topic, PAYLOAD: _attrib},
+                retain,
+                PRIORITY_LOW,
+                qos,
+            )
+
+    ##########################################
+    def _batched(self, slug: str) -> bool:
+        """Return True if sensor state is published in the batch document"""
+
+        if self._batch_topic is None:
+            return False
+
+        return self._registry.get(slug).sensor_type in BATCH_TYPES
+
+    ##########################################
+    def _publish_batch(self, attribs: bool = False, qos: int = 1, retain: bool = False):
+        """Publish states and attributes of batched sensors as one document each"""
+
+        LOGGER.debug(
+            "%s Publishing batch of %s sensors", LOG_PREFIX, len(self._batch_states)
+        )
+        self.message_send(
+            {TOPIC: f"{self._batch_topic}/state", PAYLOAD: dict(self._batch_states)},
+            retain,
+            PRIORITY_LOW,
+            qos,
+        )
+        if attribs:
+            self.message_send(
+                {
+                    TOPIC: f"{self._batch_topic}/attrib",
+                    PAYLOAD: dict(self._batch_attribs),
+                },
+                retain,
+                PRIORITY_LOW,
+                qos,
+            )
 
     ##########################################
     def _setup_device_tracker(self):
@@ -908,9 +1211,8 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             unique_id,
         )
         source_type = ROUTER
-        with self._states as _states:
-            if _states.get("has_gps") is True:
-                source_type = GPS
+        if self._states.get("has_gps") is True:
+            source_type = GPS
 
         _data[PAYLOAD].update(
             {
@@ -920,14 +1222,14 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
             }
         )
 
-        if self.message_send(_data):
+        qos, retain = self._policy.get(sensor_type=DISCOVERY)
+        if self.message_send(_data, retain=retain, qos=qos):
             _data[PAYLOAD].update({NAME: self._config.host.friendly_name})
-            self.message_send(_data)
+            self.message_send(_data, retain=retain, qos=qos)
 
         _topic = _data.get(TOPIC).split("/config", 2)[0]
         _data[TOPIC] = f"{_topic}/state"
-        with self._sensors as _sensors:
-            _sensors["device_tracker"] = _data
+        self._sensors.set("device_tracker", _data)
 
     ##########################################
     def update_device_tracker(self):
@@ -935,11 +1237,8 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
 
         LOGGER.debug("%s Running device_tracker update", LOG_PREFIX)
 
-        with self._states as _states:
-            states = _states.copy()
-
-        with self._sensors as _sensors:
-            sensor = _sensors.get("device_tracker")
+        states = self._states.snapshot()
+        sensor = self._sensors.get("device_tracker")
 
         _topic = sensor.get(TOPIC)
         location = "not_home"
@@ -964,7 +1263,8 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
                         )
                         location = self._config.locations.get(_loc)
 
-        self.message_send({TOPIC: _topic, PAYLOAD: f"{location}"})
+        qos, retain = self._policy.get("device_tracker", "device_tracker")
+        self.message_send({TOPIC: _topic, PAYLOAD: f"{location}"}, retain, qos=qos)
 
         payload = {
             SOURCE_TYPE: ROUTER,
@@ -978,8 +1278,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         if value > 0:
             payload[BATTERY_LEVEL] = str(value)
 
-        with self._attribs as _attribs:
-            value = _attribs.get("location")
+        value = self._attribs.get("location")
 
         if isinstance(value, dict):
             payload[SOURCE_TYPE] = GPS
@@ -987,7 +1286,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
 
         if len(payload) > 0:
             _topic = _topic.split("/state", 2)[0] + "/attrib"
-            self.message_send({TOPIC: _topic, PAYLOAD: payload})
+            self.message_send({TOPIC: _topic, PAYLOAD: payload}, retain, qos=qos)
 
     #######################################################
     def gps(self):
@@ -1006,6 +1305,7 @@ class HomeAgent:  # pylint:disable=too-many-instance-attributes
         last = self._stats[LAST].get(GPS)
         force = gps_update(last)
         moving = gps_moving(data)
+        self._history.record("gps_speed", data.get("speed"))
         if force or moving:
             self.update_device_tracker()
             self._stats[LAST][GPS] = int(time.time())
@@ -0,0 +1,173 @@
+"""Home Agent asyncio event scheduler"""
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+
+from service.log import LOGGER
+from service.scheduler import Scheduler, KEY
+from service.const import ABANDONED, OVERRUN
+
+LOG_PREFIX = r"[AsyncScheduler]"
+EXECUTOR_WORKERS = 4
+
+
+##########################################
+class AsyncScheduler(Scheduler):
+    """
+    Event Scheduler running on an asyncio event loop.
+    Coroutine functions run directly on the loop and
+    blocking functions are offloaded to a thread pool executor
+    """
+
+    ##########################################
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.loop = None
+        self._wakeup = None
+        self._executor = None
+        self._aio_tasks = set()
+
+    ##########################################
+    @property
+    def inline(self) -> bool:
+        """Blocking tasks run in the executor and never on the loop"""
+
+        return False
+
+    ##########################################
+    def _wake(self):
+        """Wake the event loop from any thread"""
+
+        if self.loop is None or self.loop.is_closed():
+            return
+
+        self.loop.call_soon_threadsafe(self._wakeup.set)
+
+    ##########################################
+    def _busy(self) -> bool:
+        """Return True if asyncio tasks are running"""
+
+        return bool(self._aio_tasks)
+
+    ##########################################
+    def start(self):
+        """
+        Run the Event loop
+        """
+        asyncio.run(self.async_start())
+
+    ##########################################
+    async def async_start(self):
+        """
+        Run the Event loop in the running asyncio loop
+        """
+        LOGGER.info("%s Starting scheduler", LOG_PREFIX)
+        self.loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self._workers or EXECUTOR_WORKERS,
+            thread_name_prefix="scheduler",
+        )
+        self.loop.set_default_executor(self._executor)
+
+        self.state_running()
+        if self._timeouts:
+            self._start_watchdog()
+
+        while self._pending():
+            self._wakeup.clear()
+            timeout = self._step()
+            if timeout is None:
+                break
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout)
+
+            except asyncio.TimeoutError:
+                pass
+
+        for task in self._aio_tasks:
+            task.cancel()
+        await asyncio.gather(*self._aio_tasks, return_exceptions=True)
+
+        self._shutdown(self._executor)
+        self._executor = None
+        self.state_running(False)
+        LOGGER.info("%s Finished tasks", LOG_PREFIX)
+
+    ##########################################
+    def _dispatch(self) -> bool:
+        """
+        Create asyncio tasks for ready tasks.
+        Return True if tasks were deferred by concurrency limits
+        """
+
+        self.metrics.record_depth(len(self.ready), len(self.sleeping))
+        deferred = []
+        while self.ready:
+            priority, task = self.ready.popleft()
+            if not self._acquire(task[1]):
+                deferred.append((priority, task))
+                continue
+
+            aio_task = self.loop.create_task(self._run_async(*task))
+            self._aio_tasks.add(aio_task)
+            aio_task.add_done_callback(self._task_done)
+
+        self.ready.requeue(deferred)
+        return len(deferred) > 0
+
+    ##########################################
+    def _task_done(self, aio_task: asyncio.Task):
+        """Remove finished asyncio task and wake the loop"""
+
+        self._aio_tasks.discard(aio_task)
+        self._wakeup.set()
+
+    ##########################################
+    async def _run_async(  # pylint: disable=too-many-arguments
+        self, _id: str, func, args: list, log: bool, deadline: float
+    ):
+        """Run coroutine on the loop or blocking function in the executor"""
+
+        timeout, abandon = self._timeouts.get(_id, (None, False))
+        if not abandon:
+            timeout = None
+
+        if not asyncio.iscoroutinefunction(func):
+            future = self.loop.run_in_executor(
+                self._executor, self._run_task, _id, func, args, log, deadline, None, True
+            )
+            await asyncio.wait({future}, timeout=timeout)
+            return
+
+        run = self._begin_run(_id, func, deadline, pooled=True)
+        try:
+            if args is not None:
+                await asyncio.wait_for(func(args), timeout)
+            else:
+                await asyncio.wait_for(func(), timeout)
+
+        except asyncio.TimeoutError:
+            self._abandon_run(run, timeout)
+
+        except Exception:  # pylint: disable=broad-except
+            self._log_exception(_id, args)
+
+        finally:
+            self._end_run(run, log)
+
+    ##########################################
+    def _abandon_run(self, run: dict, timeout: float):
+        """Mark coroutine cancelled by its timeout as abandoned"""
+
+        with self._inflight_lock:
+            flagged = run[OVERRUN]
+            run[OVERRUN] = True
+            if not flagged:
+                run[ABANDONED] = True
+                self._release(run[KEY])
+
+        if not flagged:
+            self._record_overrun(run, timeout)
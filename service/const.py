@@ -58,6 +58,22 @@ SENSORS = "sensors"
 TYPES = "types"
 ATTRIBS = "attribs"
 STATES = "states"
+JOURNAL = "journal"
+GENERATION = "generation"
+DELETED = "deleted"
+COMPACT = "compact"
+HISTORY = "history"
+FILTERS = "filters"
+DEADBAND = "deadband"
+DEADBAND_PCT = "deadband_pct"
+MIN_INTERVAL = "min_interval"
+MAX_AGE = "max_age"
+EMA = "ema"
+QOS = "qos"
+RETAIN = "retain"
+DISCOVERY = "discovery"
+AVAILABILITY = "availability"
+COMMAND = "command"
 
 SCHEDULER = "scheduler"
 FUNCTION = "function"
@@ -67,6 +83,23 @@ NEXT = "next"
 SLEEP = "sleep"
 ARGS = "args"
 LOG = "log"
+WORKERS = "workers"
+SKIPPED = "skipped"
+RESUMED = "resumed"
+CATCH_UP = "catch_up"
+TIMERS = "timers"
+TIMEOUT = "timeout"
+ABANDON = "abandon"
+ABANDONED = "abandoned"
+OVERRUN = "overrun"
+OVERRUNS = "overruns"
+LATENESS = "lateness"
+SLEEPING = "sleeping"
+COUNT = "count"
+MIN = "min"
+MAX = "max"
+MEAN = "mean"
+SCHEDULER_LAG = "scheduler_lag"
 
 START_TIME = "start_time"
 PING = "ping"
@@ -78,6 +111,7 @@ WILL = "will"
 ONLINE = "online"
 OFFLINE = "offline"
 PUBLISH = "publish"
+QUEUED = "queued"
 SERIAL = "serial"
 IP_ADDRESS = "ip_address"
 MAC_ADDRESS = "mac_address"
@@ -95,4 +129,5 @@ CONNECTIONS = "connections"
 MANUFACTURER = "manufacturer"
 MODEL = "model"
 UNIQUE_ID = "unique_id"
+OBJECT_ID = "object_id"
 STATUS = "status"
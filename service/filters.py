@@ -0,0 +1,214 @@
+"""Publish filters for sensor states"""
+
+import threading
+
+
+from service.const import (
+    DEADBAND,
+    DEADBAND_PCT,
+    MIN_INTERVAL,
+    MAX_AGE,
+    EMA,
+    QOS,
+    RETAIN,
+    SENSORS,
+    TYPES,
+)
+
+EMA_PRECISION = 3
+DEFAULT_QOS = 1
+
+
+##########################################
+def _numeric(value) -> bool:
+    """Return True for int and float values but not bool"""
+
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+##########################################
+def _resolve(conf: dict, prefixes: list, slug: str):
+    """
+    Return config for exact name or longest prefix found in the name.
+    Prefixes match anywhere in the name like PREFIX_CLASS_MAP
+    """
+
+    if slug in conf:
+        return conf[slug]
+
+    return next((conf[key] for key in prefixes if key in slug), None)
+
+
+##########################################
+class PublishFilter:  # pylint: disable=too-many-instance-attributes
+    """
+    Decide when a changed sensor state is published. Filters are
+    configured per sensor name or name prefix with an absolute or
+    relative deadband, a minimum interval between publishes, a
+    maximum age after which the state is republished and optional
+    EMA smoothing of collected samples. Smoothing only changes the
+    published value. Sensors without a filter publish on any change
+    """
+
+    ##########################################
+    def __init__(self, filters: dict = None):
+        self._filters = dict(filters or {})
+        self._prefixes = sorted(self._filters, key=len, reverse=True)
+        self._lock = threading.Lock()
+        self._resolved = {}
+        self._ema = {}
+        self._published = {}
+        self._pending = set()
+        self._smoothed = any(
+            conf and conf.get(EMA) for conf in self._filters.values()
+        )
+
+    ##########################################
+    def get(self, slug: str) -> dict:
+        """Return filter for sensor from exact name or longest prefix"""
+
+        if slug in self._resolved:
+            return self._resolved[slug]
+
+        conf = _resolve(self._filters, self._prefixes, slug)
+        self._resolved[slug] = conf
+        return conf
+
+    ##########################################
+    def smooth(self, slug: str, value):
+        """Return EMA of numeric value if the sensor filter sets ema"""
+
+        conf = self.get(slug)
+        if not conf or not conf.get(EMA) or not _numeric(value):
+            return value
+
+        alpha = conf[EMA]
+        with self._lock:
+            last = self._ema.get(slug)
+            smoothed = value if last is None else alpha * value + (1 - alpha) * last
+            self._ema[slug] = smoothed
+
+        return round(smoothed, EMA_PRECISION)
+
+    ##########################################
+    def sample(self, states: dict):
+        """Update EMA of smoothed sensors with collected states"""
+
+        if not self._smoothed:
+            return
+
+        for slug, value in states.items():
+            self.smooth(slug, value)
+
+    ##########################################
+    def smoothed(self, slug: str, value):
+        """Return EMA to publish for value or value if the sensor is not smoothed"""
+
+        if not self._smoothed or not _numeric(value):
+            return value
+
+        with self._lock:
+            smoothed = self._ema.get(slug)
+
+        if smoothed is None:
+            return value
+
+        return round(smoothed, EMA_PRECISION)
+
+    ##########################################
+    @staticmethod
+    def _band(conf: dict, last) -> float:
+        """Return deadband for last published value"""
+
+        band = conf.get(DEADBAND, 0)
+        percent = conf.get(DEADBAND_PCT, 0)
+        if percent and _numeric(last):
+            band = max(band, abs(last) * percent / 100)
+
+        return band
+
+    ##########################################
+    def check(self, slug: str, value, last, now: float) -> bool:
+        """Return True if value should be published"""
+
+        conf = self.get(slug)
+        if conf is None:
+            return value != last
+
+        with self._lock:
+            age = now - self._published.get(slug, 0)
+            if conf.get(MAX_AGE) and age >= conf[MAX_AGE]:
+                return True
+
+            if value == last:
+                self._pending.discard(slug)
+                return False
+
+            if _numeric(value) and _numeric(last):
+                if abs(value - last) <= self._band(conf, last):
+                    self._pending.discard(slug)
+                    return False
+
+            if conf.get(MIN_INTERVAL) and age < conf[MIN_INTERVAL]:
+                self._pending.add(slug)
+                return False
+
+        return True
+
+    ##########################################
+    def published(self, slug: str, now: float):
+        """Record publish time of sensor"""
+
+        with self._lock:
+            self._published[slug] = now
+            self._pending.discard(slug)
+
+    ##########################################
+    def due(self, now: float) -> list:
+        """
+        Return list of sensors to check again without a state change.
+        Sensors held back by rate limit and sensors
+        older than their maximum age
+        """
+
+        with self._lock:
+            due = set(self._pending)
+            for slug, published in self._published.items():
+                conf = self._resolved.get(slug)
+                if conf and conf.get(MAX_AGE) and now - published >= conf[MAX_AGE]:
+                    due.add(slug)
+
+        return list(due)
+
+
+##########################################
+class PublishPolicy:  # pylint: disable=too-few-public-methods
+    """
+    MQTT QoS and retain flag for published messages. Sensors are
+    matched by exact name or longest prefix, then by sensor type.
+    Types also cover discovery, availability and command messages
+    """
+
+    ##########################################
+    def __init__(self, policy: dict = None):
+        policy = policy or {}
+        self._sensors = dict(policy.get(SENSORS) or {})
+        self._types = dict(policy.get(TYPES) or {})
+        self._prefixes = sorted(self._sensors, key=len, reverse=True)
+        self._resolved = {}
+
+    ##########################################
+    def get(self, slug: str = None, sensor_type: str = None) -> tuple:
+        """Return (qos, retain) for sensor name and type"""
+
+        key = (slug, sensor_type)
+        if key in self._resolved:
+            return self._resolved[key]
+
+        conf = _resolve(self._sensors, self._prefixes, slug) if slug else None
+        if conf is None:
+            conf = self._types.get(sensor_type) or {}
+
+        policy = (conf.get(QOS, DEFAULT_QOS), bool(conf.get(RETAIN, False)))
+        self._resolved[key] = policy
+        return policy
@@ -0,0 +1,155 @@
+"""Fixed size histograms for scheduler metrics"""
+
+import bisect
+import threading
+
+
+from service.const import (
+    COUNT,
+    LAST,
+    MIN,
+    MAX,
+    MEAN,
+    RUNTIME,
+    LATENESS,
+    TASKS,
+    READY,
+    SLEEPING,
+)
+
+BUCKETS = tuple(0.001 * 2**num for num in range(21))
+PERCENTILES = (50, 90, 99)
+
+
+##########################################
+class Histogram:
+    """Histogram with fixed exponential buckets in seconds"""
+
+    ##########################################
+    def __init__(self, buckets: tuple = BUCKETS):
+        self._buckets = buckets
+        self._counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.last = None
+        self.min = None
+        self.max = None
+
+    ##########################################
+    def record(self, value: float):
+        """Add value to histogram"""
+
+        value = max(value, 0.0)
+        self._counts[bisect.bisect_left(self._buckets, value)] += 1
+        self.count += 1
+        self.total += value
+        self.last = value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    ##########################################
+    def percentile(self, percent: float) -> float:
+        """
+        Return percentile interpolated linearly within the bucket
+        holding it. Bucket bounds are clamped to min and max
+        """
+
+        if self.count == 0:
+            return None
+
+        rank = self.count * percent / 100
+        total = 0
+        for idx, count in enumerate(self._counts):
+            if count and total + count >= rank:
+                lower = self._buckets[idx - 1] if idx else 0.0
+                upper = self._buckets[idx] if idx < len(self._buckets) else self.max
+                lower = max(lower, self.min)
+                upper = min(upper, self.max)
+                return lower + (upper - lower) * max(rank - total, 0) / count
+
+            total += count
+
+        return self.max
+
+    ##########################################
+    def to_dict(self, scale: int = 1000) -> dict:
+        """Return dict of statistics. Values scaled to ms by default"""
+
+        if self.count == 0:
+            return {COUNT: 0}
+
+        data = {
+            COUNT: self.count,
+            LAST: round(self.last * scale, 3),
+            MIN: round(self.min * scale, 3),
+            MAX: round(self.max * scale, 3),
+            MEAN: round(self.total / self.count * scale, 3),
+        }
+        for percent in PERCENTILES:
+            data[f"p{percent}"] = round(self.percentile(percent) * scale, 3)
+
+        return data
+
+
+##########################################
+class SchedulerMetrics:
+    """Per-task run time and lateness histograms plus queue depths"""
+
+    ##########################################
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tasks = {}
+        self._depth = {READY: 0, SLEEPING: 0}
+        self._depth_max = {READY: 0, SLEEPING: 0}
+
+    ##########################################
+    def record_run(self, name: str, runtime: float, lateness: float):
+        """Record task run time and lateness in seconds"""
+
+        with self._lock:
+            task = self._tasks.get(name)
+            if task is None:
+                task = self._tasks[name] = {
+                    RUNTIME: Histogram(),
+                    LATENESS: Histogram(),
+                }
+            task[RUNTIME].record(runtime)
+            task[LATENESS].record(lateness)
+
+    ##########################################
+    def record_depth(self, ready: int, sleeping: int):
+        """Record queue depths"""
+
+        with self._lock:
+            self._depth[READY] = ready
+            self._depth[SLEEPING] = sleeping
+            self._depth_max[READY] = max(self._depth_max[READY], ready)
+            self._depth_max[SLEEPING] = max(self._depth_max[SLEEPING], sleeping)
+
+    ##########################################
+    def worst(self, percent: int = 90) -> float:
+        """Return highest lateness percentile across tasks in ms"""
+
+        with self._lock:
+            values = [
+                task[LATENESS].percentile(percent) or 0.0
+                for task in self._tasks.values()
+            ]
+
+        return round(max(values, default=0.0) * 1000, 3)
+
+    ##########################################
+    def snapshot(self) -> dict:
+        """Return dict of all metrics. Times in ms"""
+
+        with self._lock:
+            return {
+                TASKS: {
+                    name: {key: hist.to_dict() for key, hist in task.items()}
+                    for name, task in self._tasks.items()
+                },
+                READY: self._depth[READY],
+                SLEEPING: self._depth[SLEEPING],
+                f"{READY}_max": self._depth_max[READY],
+                f"{SLEEPING}_max": self._depth_max[SLEEPING],
+            }
@@ -0,0 +1,177 @@
+"""Outbound message queue kept while the MQTT broker is unreachable"""
+
+import os
+import json
+import time
+import threading
+from collections import OrderedDict
+
+
+from service.log import LOGGER
+from service.states import write_atomic
+
+LOG_PREFIX = r"[Outbox]"
+
+
+##########################################
+class Outbox:  # pylint: disable=too-many-instance-attributes
+    """
+    Bounded outbound queue with one message per topic. A newer message
+    replaces the queued one so only the last value is delivered.
+    The queue is saved to disk and drained at a limited rate
+    once the connection returns
+    """
+
+    ##########################################
+    def __init__(
+        self,
+        file_name: str = None,
+        max_messages: int = 1000,
+        rate: float = 20,
+        flush: float = 10,
+    ):
+        self._file = file_name
+        self._max = max_messages
+        self._rate = rate
+        self._flush = flush
+        self._lock = threading.Lock()
+        self._queue = OrderedDict()
+        self._dirty = False
+        self._last_flush = 0.0
+        self._thread = None
+        self.dropped = 0
+        self.load()
+
+    ##########################################
+    def __len__(self) -> int:
+        return len(self._queue)
+
+    ##########################################
+    def put(self, topic: str, payload, qos: int = 0, retain: bool = False) -> bool:
+        """Queue message replacing a queued message for the same topic"""
+
+        if not isinstance(payload, str):
+            LOGGER.debug("%s Not queueing binary payload for %s", LOG_PREFIX, topic)
+            return False
+
+        with self._lock:
+            self._queue[topic] = (payload, qos, retain)
+            self._queue.move_to_end(topic)
+            while len(self._queue) > self._max:
+                dropped, _ = self._queue.popitem(last=False)
+                self.dropped += 1
+                LOGGER.warning("%s Queue full. Dropped %s", LOG_PREFIX, dropped)
+
+            self._dirty = True
+
+        self.save()
+        return True
+
+    ##########################################
+    def discard(self, topic: str):
+        """Remove queued message for topic"""
+
+        with self._lock:
+            if self._queue.pop(topic, None) is not None:
+                self._dirty = True
+
+    ##########################################
+    def load(self):
+        """Load queue saved by a previous run"""
+
+        if not self._file or not os.path.exists(self._file):
+            return
+
+        try:
+            with open(self._file, "r", encoding="utf-8") as read_file:
+                items = json.load(read_file)
+
+        except (OSError, json.JSONDecodeError) as err:
+            LOGGER.error("%s Failed to load %s. %s", LOG_PREFIX, self._file, err)
+            return
+
+        with self._lock:
+            for topic, payload, qos, retain in items[-self._max :]:
+                self._queue[topic] = (payload, qos, retain)
+
+        LOGGER.info("%s Loaded %s queued messages", LOG_PREFIX, len(self._queue))
+
+    ##########################################
+    def save(self, force: bool = False):
+        """Write queue to disk at most once per flush interval"""
+
+        if not self._file:
+            return
+
+        now = time.monotonic()
+        with self._lock:
+            if not self._dirty or (not force and now - self._last_flush < self._flush):
+                return
+
+            items = [
+                [topic, payload, qos, retain]
+                for topic, (payload, qos, retain) in self._queue.items()
+            ]
+            self._dirty = False
+            self._last_flush = now
+
+        try:
+            if items:
+                write_atomic(self._file, json.dumps(items, separators=(",", ":")))
+
+            elif os.path.exists(self._file):
+                os.remove(self._file)
+
+        except OSError as err:
+            LOGGER.error("%s Failed to save %s. %s", LOG_PREFIX, self._file, err)
+
+    ##########################################
+    def drain(self, publish, connected):
+        """
+        Start background thread sending queued messages with publish
+        while connected() is True. publish is called with the queue
+        locked and must not block
+        """
+
+        with self._lock:
+            if not self._queue or (self._thread and self._thread.is_alive()):
+                return
+
+            self._thread = threading.Thread(
+                target=self._drain_loop,
+                args=(publish, connected),
+                name="outbox",
+                daemon=True,
+            )
+            self._thread.start()
+
+    ##########################################
+    def _drain_loop(self, publish, connected):
+        """
+        Send queued messages oldest first at the configured rate.
+        A message is taken and handed over in one step so a newer
+        message for the topic discarding it is always sent after it
+        """
+
+        LOGGER.info("%s Sending %s queued messages", LOG_PREFIX, len(self._queue))
+        sent = 0
+        while connected():
+            with self._lock:
+                if not self._queue:
+                    break
+
+                topic, message = self._queue.popitem(last=False)
+                self._dirty = True
+                if not publish(topic, *message):
+                    self._queue[topic] = message
+                    self._queue.move_to_end(topic, last=False)
+                    break
+
+            sent += 1
+            if self._rate:
+                time.sleep(1 / self._rate)
+
+        LOGGER.info(
+            "%s Sent %s queued messages. %s left", LOG_PREFIX, sent, len(self._queue)
+        )
+        self.save(True)
@@ -0,0 +1,415 @@
+"""Atomic and incremental persistence of agent states"""
+
+import os
+import mmap
+import threading
+from datetime import date, datetime
+
+try:
+    import msgpack
+
+except ImportError:
+    msgpack = None
+
+
+from service.log import LOGGER
+from service.states import StateStore, write_atomic
+from service.serializer import get_serializer
+from service.const import STATE, ATTRIBS, DEVICE, GENERATION, DELETED
+
+LOG_PREFIX = r"[Persist]"
+EXCLUDE = ("screen_capture",)
+SECTIONS = (STATE, ATTRIBS)
+
+EXT_DATETIME = 1
+EXT_DATE = 2
+EXT_TUPLE = 3
+EXT_SET = 4
+
+
+##########################################
+class JsonFormat:
+    """JSON state file. Unknown types are saved as strings"""
+
+    name = "json"
+    suffix = ".json"
+
+    ##########################################
+    def __init__(self, serializer=None):
+        self._serializer = serializer or get_serializer()
+
+    ##########################################
+    def dumps(self, data) -> bytes:
+        """Return data encoded as bytes"""
+
+        return self._serializer.dumpb(data)
+
+    ##########################################
+    def loads(self, buffer):
+        """Return data decoded from buffer"""
+
+        return self._serializer.loadb(buffer)
+
+    ##########################################
+    def dump_entry(self, entry: dict) -> bytes:
+        """Return journal entry encoded as one line"""
+
+        return self.dumps(entry) + b"\n"
+
+    ##########################################
+    def iter_entries(self, buffer):
+        """Yield journal entries and stop at a torn entry"""
+
+        for line in bytes(buffer).splitlines():
+            try:
+                yield self._serializer.loads(line)
+
+            except ValueError:
+                LOGGER.warning("%s Ignoring torn journal entry", LOG_PREFIX)
+                return
+
+
+##########################################
+class MsgpackFormat:
+    """
+    Compact binary msgpack state file. Bytes, tuples, sets, dates
+    and datetimes keep their type. It is smaller than JSON but loads
+    slower than the orjson path. Needs the optional msgpack package
+    """
+
+    name = "msgpack"
+    suffix = ".msgpack"
+
+    ##########################################
+    def __init__(self, serializer=None):  # pylint: disable=unused-argument
+        pass
+
+    ##########################################
+    @staticmethod
+    def _default(obj):  # pylint: disable=too-many-return-statements
+        """Encode types msgpack does not handle natively"""
+
+        if isinstance(obj, datetime):
+            return msgpack.ExtType(EXT_DATETIME, obj.isoformat().encode("utf-8"))
+
+        if isinstance(obj, date):
+            return msgpack.ExtType(EXT_DATE, obj.isoformat().encode("utf-8"))
+
+        if isinstance(obj, tuple):
+            return msgpack.ExtType(EXT_TUPLE, MsgpackFormat.dumps(list(obj)))
+
+        if isinstance(obj, (set, frozenset)):
+            return msgpack.ExtType(EXT_SET, MsgpackFormat.dumps(list(obj)))
+
+        if isinstance(obj, dict):
+            return dict(obj)
+
+        if isinstance(obj, list):
+            return list(obj)
+
+        return str(obj)
+
+    ##########################################
+    @staticmethod
+    def _ext_hook(code: int, data: bytes):
+        """Decode types encoded by _default"""
+
+        if code == EXT_DATETIME:
+            return datetime.fromisoformat(data.decode("utf-8"))
+
+        if code == EXT_DATE:
+            return date.fromisoformat(data.decode("utf-8"))
+
+        if code == EXT_TUPLE:
+            return tuple(MsgpackFormat.loads(data))
+
+        if code == EXT_SET:
+            return set(MsgpackFormat.loads(data))
+
+        return msgpack.ExtType(code, data)
+
+    ##########################################
+    @staticmethod
+    def dumps(data) -> bytes:
+        """Return data encoded as bytes"""
+
+        return msgpack.packb(
+            data,
+            default=MsgpackFormat._default,
+            use_bin_type=True,
+            strict_types=True,
+        )
+
+    ##########################################
+    @staticmethod
+    def loads(buffer):
+        """Return data decoded from buffer"""
+
+        with memoryview(buffer) as view:
+            return msgpack.unpackb(
+                view,
+                ext_hook=MsgpackFormat._ext_hook,
+                raw=False,
+                strict_map_key=False,
+            )
+
+    ##########################################
+    @staticmethod
+    def dump_entry(entry: dict) -> bytes:
+        """Return journal entry encoded as bytes"""
+
+        return MsgpackFormat.dumps(entry)
+
+    ##########################################
+    @staticmethod
+    def iter_entries(buffer):
+        """Yield journal entries and stop at a torn entry"""
+
+        unpacker = msgpack.Unpacker(
+            ext_hook=MsgpackFormat._ext_hook, raw=False, strict_map_key=False
+        )
+        unpacker.feed(buffer)
+        try:
+            yield from unpacker
+
+        except (ValueError, msgpack.UnpackException):
+            LOGGER.warning("%s Ignoring torn journal entry", LOG_PREFIX)
+
+
+FORMATS = {
+    JsonFormat.name: JsonFormat,
+    MsgpackFormat.name: MsgpackFormat,
+}
+
+
+##########################################
+def get_format(name: str, serializer=None):
+    """Return state file format. Fall back to JSON"""
+
+    if name == MsgpackFormat.name and msgpack is None:
+        LOGGER.warning(
+            "%s msgpack is not installed. Please run python3 -m pip install "
+            "msgpack. Using json",
+            LOG_PREFIX,
+        )
+        name = JsonFormat.name
+
+    return FORMATS.get(name, JsonFormat)(serializer)
+
+
+##########################################
+def read_file(file_name: str):
+    """Return memory-mapped file contents or empty bytes"""
+
+    with open(file_name, "rb") as map_file:
+        if os.fstat(map_file.fileno()).st_size == 0:
+            return b""
+
+        return mmap.mmap(map_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+##########################################
+class StatePersistence:  # pylint: disable=too-many-instance-attributes
+    """
+    Save states to a snapshot file that is replaced atomically plus
+    an append-only journal holding only keys changed since the last
+    save. The journal is folded into a new snapshot every compact
+    entries. Journal entries carry the snapshot generation so entries
+    left behind by an interrupted compaction are ignored
+    """
+
+    ##########################################
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        state_file: str,
+        journal: bool = True,
+        compact: int = 100,
+        exclude: tuple = EXCLUDE,
+        file_format: str = JsonFormat.name,
+        serializer=None,
+    ):
+        self._serializer = serializer
+        self._format = get_format(file_format, serializer)
+        base, suffix = os.path.splitext(state_file)
+        if suffix in (_format.suffix for _format in FORMATS.values()):
+            state_file = f"{base}{self._format.suffix}"
+
+        self.state_file = state_file
+        self.journal_file = f"{state_file}.journal"
+        self._journal = journal
+        self._compact = compact
+        self._exclude = set(exclude)
+        self._lock = threading.Lock()
+        self._generation = 0
+        self._entries = 0
+        self._versions = None
+        self._device = None
+
+    ##########################################
+    def load(self) -> dict:
+        """Return dict of states, attribs and device from snapshot and journal"""
+
+        data = {STATE: {}, ATTRIBS: {}, DEVICE: {}}
+        snapshot = self._read_snapshot()
+        if isinstance(snapshot, dict):
+            for section, values in data.items():
+                values.update(snapshot.get(section) or {})
+            self._generation = snapshot.get(GENERATION, 0)
+
+        self._entries = self._replay(data)
+        LOGGER.debug(
+            "%s Loaded %s states and %s journal entries",
+            LOG_PREFIX,
+            len(data[STATE]),
+            self._entries,
+        )
+        return data
+
+    ##########################################
+    def _read_snapshot(self) -> dict:
+        """
+        Return snapshot dict. Falls back to a state file
+        of another format to migrate after a format change
+        """
+
+        base = os.path.splitext(self.state_file)[0]
+        candidates = [(self.state_file, self._format)] + [
+            (f"{base}{_format.suffix}", _format(self._serializer))
+            for _format in FORMATS.values()
+            if _format.name != self._format.name
+        ]
+        for file_name, _format in candidates:
+            if not os.path.exists(file_name):
+                continue
+
+            if _format.name == MsgpackFormat.name and msgpack is None:
+                continue
+
+            try:
+                buffer = read_file(file_name)
+                try:
+                    return _format.loads(buffer) if buffer else {}
+
+                finally:
+                    if isinstance(buffer, mmap.mmap):
+                        buffer.close()
+
+            except Exception as err:  # pylint: disable=broad-except
+                LOGGER.error("%s Failed to load %s. %s", LOG_PREFIX, file_name, err)
+
+        return {}
+
+    ##########################################
+    def _replay(self, data: dict) -> int:
+        """Apply journal entries of the current generation to data"""
+
+        if not os.path.exists(self.journal_file):
+            return 0
+
+        entries = 0
+        with open(self.journal_file, "rb") as journal_file:
+            buffer = journal_file.read()
+
+        for entry in self._format.iter_entries(buffer):
+            if not isinstance(entry, dict) or entry.get(GENERATION) != self._generation:
+                continue
+
+            for section in SECTIONS:
+                data[section].update(entry.get(section, {}))
+                for key in entry.get(DELETED, {}).get(section, []):
+                    data[section].pop(key, None)
+
+            if DEVICE in entry:
+                data[DEVICE] = entry[DEVICE]
+
+            entries += 1
+
+        return entries
+
+    ##########################################
+    def save(self, states: StateStore, attribs: StateStore, device: dict) -> bool:
+        """
+        Save changes since the last save.
+        Return False if nothing changed
+        """
+
+        with self._lock:
+            versions = (states.version, attribs.version)
+            if versions == self._versions and device == self._device:
+                return False
+
+            if (
+                self._versions is None
+                or not self._journal
+                or self._entries >= self._compact
+            ):
+                self._write_snapshot(states, attribs, device)
+
+            else:
+                versions = self._append(states, attribs, device)
+
+            self._versions = versions
+            self._device = device
+            return True
+
+    ##########################################
+    def _write_snapshot(self, states: StateStore, attribs: StateStore, device: dict):
+        """Replace snapshot file and start a new journal generation"""
+
+        generation = self._generation + 1
+        data = {
+            GENERATION: generation,
+            STATE: self._filter(states.snapshot()),
+            ATTRIBS: dict(attribs.snapshot()),
+            DEVICE: device,
+        }
+        write_atomic(self.state_file, self._format.dumps(data))
+        self._generation = generation
+        if os.path.exists(self.journal_file):
+            os.remove(self.journal_file)
+
+        self._entries = 0
+        LOGGER.debug("%s Wrote snapshot generation %s", LOG_PREFIX, self._generation)
+
+    ##########################################
+    def _append(self, states: StateStore, attribs: StateStore, device: dict) -> tuple:
+        """Append changed keys to the journal and return saved versions"""
+
+        entry = {GENERATION: self._generation}
+        deleted = {}
+        versions = []
+        for section, store, version in zip(SECTIONS, (states, attribs), self._versions):
+            version, keys = store.changed_since(version)
+            versions.append(version)
+            snapshot = store.snapshot()
+            changed = {key: snapshot[key] for key in keys if key in snapshot}
+            if section == STATE:
+                changed = self._filter(changed)
+
+            if changed:
+                entry[section] = changed
+
+            removed = [key for key in keys if key not in snapshot]
+            if removed:
+                deleted[section] = removed
+
+        if deleted:
+            entry[DELETED] = deleted
+
+        if device != self._device:
+            entry[DEVICE] = device
+
+        # Appends are not synced. A torn last entry is dropped on load
+        with open(self.journal_file, "ab") as write_file:
+            write_file.write(self._format.dump_entry(entry))
+
+        self._entries += 1
+        return tuple(versions)
+
+    ##########################################
+    def _filter(self, states) -> dict:
+        """Return dict of states without excluded keys"""
+
+        return {
+            key: value for key, value in states.items() if key not in self._exclude
+        }
@@ -0,0 +1,263 @@
+"""Outbound publish pipeline with in-flight window and backpressure"""
+
+import time
+import threading
+from collections import OrderedDict
+
+
+from service.log import LOGGER
+from service.scheduler import PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from service.serializer import get_serializer
+
+LOG_PREFIX = r"[Pipeline]"
+
+ACK_TIMEOUT = 30
+COUNTERS = ("queued", "coalesced", "sent", "acked", "dropped", "failed", "expired")
+
+
+##########################################
+class PublishPipeline:  # pylint: disable=too-many-instance-attributes
+    """
+    Messages are queued per priority with one message per topic and
+    sent from a worker thread. QoS 1 and 2 messages stay in flight until
+    acked and no more than the in-flight limit are outstanding. When
+    the queue is full the oldest message of the lowest priority is
+    dropped so connection health messages go out first
+    """
+
+    ##########################################
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        publish,
+        fallback=None,
+        inflight: int = 20,
+        size: int = 500,
+        serializer=None,
+    ):
+        self._publish = publish
+        self._serializer = serializer or get_serializer()
+        self._fallback = fallback
+        self._limit = max(1, inflight)
+        self._size = size
+        self._cond = threading.Condition()
+        self._pending = [OrderedDict() for _ in range(PRIORITY_LOW + 1)]
+        self._priority = {}
+        self._inflight = {}
+        self._early = set()
+        self._sending = False
+        self._running = False
+        self._thread = None
+        self.counters = dict.fromkeys(COUNTERS, 0)
+
+    ##########################################
+    def start(self):
+        """Start worker thread"""
+
+        with self._cond:
+            if self._running:
+                return
+
+            self._running = True
+            self._thread = threading.Thread(
+                target=self._run, name="publish", daemon=True
+            )
+            self._thread.start()
+
+    ##########################################
+    def stop(self):
+        """Stop worker thread and hand pending messages to the fallback"""
+
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(5)
+        self._thread = None
+
+        for topic, message in self._take_all():
+            if self._fallback is not None:
+                self._fallback(topic, self._encode(message[0]), *message[1:])
+
+    ##########################################
+    def put(
+        self,
+        topic: str,
+        payload,
+        qos: int = 1,
+        retain: bool = False,
+        priority: int = PRIORITY_NORMAL,
+    ) -> bool:
+        """
+        Queue message replacing a pending message for the same topic.
+        Dict payloads are encoded later and must not be changed after put
+        """
+
+        priority = min(max(priority, PRIORITY_HIGH), PRIORITY_LOW)
+        with self._cond:
+            level = self._priority.get(topic)
+            if level is not None:
+                del self._pending[level][topic]
+                self.counters["coalesced"] += 1
+
+            elif len(self._priority) >= self._size and not self._drop(priority):
+                self.counters["dropped"] += 1
+                LOGGER.debug("%s Queue full. Dropped %s", LOG_PREFIX, topic)
+                return False
+
+            self._pending[priority][topic] = (payload, qos, retain)
+            self._priority[topic] = priority
+            self.counters["queued"] += 1
+            self._cond.notify()
+
+        return True
+
+    ##########################################
+    def _drop(self, priority: int) -> bool:
+        """Drop oldest message with the same or lower priority"""
+
+        for level in range(PRIORITY_LOW, priority - 1, -1):
+            if self._pending[level]:
+                topic, _ = self._pending[level].popitem(last=False)
+                del self._priority[topic]
+                self.counters["dropped"] += 1
+                LOGGER.debug("%s Queue full. Dropped %s", LOG_PREFIX, topic)
+                return True
+
+        return False
+
+    ##########################################
+    def acked(self, mid: int):
+        """
+        Message acknowledged by the broker. An ack can arrive before
+        publish returns its mid so it is kept until the send finishes.
+        Acks for other messages are ignored
+        """
+
+        with self._cond:
+            if self._inflight.pop(mid, None) is None:
+                if self._sending:
+                    self._early.add(mid)
+                return
+
+            self.counters["acked"] += 1
+            self._cond.notify()
+
+    ##########################################
+    def reset(self):
+        """Forget in-flight messages after the connection was lost"""
+
+        with self._cond:
+            self._inflight.clear()
+            self._early.clear()
+            self._cond.notify()
+
+    ##########################################
+    def stats(self) -> dict:
+        """Return counters and queue sizes"""
+
+        with self._cond:
+            stats = dict(self.counters)
+            stats["pending"] = len(self._priority)
+            stats["inflight"] = len(self._inflight)
+
+        return stats
+
+    ##########################################
+    def _expire(self):
+        """Drop in-flight messages not acked within ACK_TIMEOUT"""
+
+        limit = time.monotonic() - ACK_TIMEOUT
+        expired = [mid for mid, sent in self._inflight.items() if sent < limit]
+        for mid in expired:
+            del self._inflight[mid]
+
+        self.counters["expired"] += len(expired)
+
+    ##########################################
+    def _take(self):
+        """Return highest priority pending message"""
+
+        for pending in self._pending:
+            if pending:
+                topic, message = pending.popitem(last=False)
+                del self._priority[topic]
+                return topic, message
+
+        return None, None
+
+    ##########################################
+    def _take_all(self) -> list:
+        """Return and clear all pending messages"""
+
+        with self._cond:
+            messages = []
+            for pending in self._pending:
+                messages.extend(pending.items())
+                pending.clear()
+            self._priority.clear()
+
+        return messages
+
+    ##########################################
+    def _run(self):
+        """Send pending messages while the in-flight window has room"""
+
+        while True:
+            with self._cond:
+                while self._running and (
+                    not self._priority or len(self._inflight) >= self._limit
+                ):
+                    self._cond.wait(1 if self._inflight else None)
+                    self._expire()
+
+                if not self._running:
+                    break
+
+                topic, message = self._take()
+
+            self._send(topic, *message)
+
+    ##########################################
+    def _encode(self, payload):
+        """Encode dict payload as JSON"""
+
+        if isinstance(payload, dict):
+            return self._serializer.dumps(payload)
+
+        return payload
+
+    ##########################################
+    def _send(self, topic: str, payload, qos: int, retain: bool):
+        """Encode and publish message"""
+
+        try:
+            payload = self._encode(payload)
+
+        except (TypeError, ValueError) as err:
+            LOGGER.error("%s Failed to encode %s. %s", LOG_PREFIX, topic, err)
+            self.counters["failed"] += 1
+            return
+
+        with self._cond:
+            self._sending = True
+
+        info = self._publish(topic, payload, qos, retain)
+        with self._cond:
+            early = self._early
+            self._early = set()
+            self._sending = False
+            if info is None or info.rc != 0:
+                self.counters["failed"] += 1
+
+            else:
+                self.counters["sent"] += 1
+                if qos and info.mid in early:
+                    self.counters["acked"] += 1
+
+                elif qos:
+                    self._inflight[info.mid] = time.monotonic()
+                return
+
+        if self._fallback is not None:
+            self._fallback(topic, payload, qos, retain)
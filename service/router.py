@@ -0,0 +1,76 @@
+"""Topic dispatch table for incoming messages"""
+
+import threading
+
+
+from service.const import FSLASH
+
+WILDCARD_LEVEL = "+"
+WILDCARD_MULTI = "#"
+
+
+##########################################
+def _matches(levels: tuple, topic: list) -> bool:
+    """Return True if topic levels match MQTT filter levels"""
+
+    for idx, level in enumerate(levels):
+        if level == WILDCARD_MULTI:
+            return True
+
+        if idx >= len(topic) or (level not in (WILDCARD_LEVEL, topic[idx])):
+            return False
+
+    return len(levels) == len(topic)
+
+
+##########################################
+class TopicRouter:
+    """
+    Map topics to a handler and its arguments. Exact topics are one
+    dict lookup. Filters with + and # wildcards are checked in the
+    order they were added when no exact route matches
+    """
+
+    ##########################################
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exact = {}
+        self._wildcard = {}
+
+    ##########################################
+    def add(self, topic: str, handler, *args):
+        """Route topic or topic filter to handler(*args, payload)"""
+
+        with self._lock:
+            if WILDCARD_LEVEL in topic or WILDCARD_MULTI in topic:
+                self._wildcard[topic] = (tuple(topic.split(FSLASH)), handler, args)
+
+            else:
+                self._exact[topic] = (handler, args)
+
+    ##########################################
+    def remove(self, topic: str):
+        """Remove route for topic or topic filter"""
+
+        with self._lock:
+            self._exact.pop(topic, None)
+            self._wildcard.pop(topic, None)
+
+    ##########################################
+    def match(self, topic: str) -> tuple:
+        """Return (handler, args) for topic or None"""
+
+        route = self._exact.get(topic)
+        if route is not None or not self._wildcard:
+            return route
+
+        levels = topic.split(FSLASH)
+        for pattern, handler, args in tuple(self._wildcard.values()):
+            if _matches(pattern, levels):
+                return handler, args
+
+        return None
+
+    ##########################################
+    def __len__(self) -> int:
+        return len(self._exact) + len(self._wildcard)
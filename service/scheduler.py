@@ -1,16 +1,24 @@
 """Home Agent event scheduler"""
 
+import asyncio
 from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import sys
 import time
-import heapq
 import signal
 import traceback
 import threading
-from typing import Any
+import itertools
+import hashlib
+import platform
+from types import ModuleType
+from typing import Any, NamedTuple
 
 
 from service.log import LOGGER
 from service.states import ThreadSafeDict
+from service.timers import TIMERS, HeapTimers
+from service.metrics import SchedulerMetrics
 from service.util import calc_elapsed
 from service.const import (
     SCHEDULER,
@@ -22,10 +30,164 @@ from service.const import (
     SLEEP,
     ARGS,
     LOG,
+    WORKERS,
+    RUNTIME,
+    SKIPPED,
+    RESUMED,
+    CATCH_UP,
+    TIMERS as TIMERS_KEY,
+    TIMEOUT,
+    ABANDON,
+    ABANDONED,
+    OVERRUN,
+    OVERRUNS,
+    START_TIME,
+    ID,
+    LATENESS,
 )
 
 LOG_PREFIX = r"[Scheduler]"
 
+CATCH_UP_SKIP = "skip"
+CATCH_UP_COALESCE = "coalesce"
+CATCH_UP_BURST = "burst"
+CATCH_UP_MODES = (CATCH_UP_SKIP, CATCH_UP_COALESCE, CATCH_UP_BURST)
+MAX_BURST = 10
+TIME_JUMP = 5
+WATCHDOG_INTERVAL = 1
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+STARVATION_LIMIT = 5
+MAX_WAIT = 30
+MIN_SLEEP = 0.01
+POOLED = "pooled"
+DONE = "done"
+KEY = "key"
+LAST_OVERRUN = "last_overrun"
+
+
+##########################################
+def task_name(func) -> str:
+    """Return module and qualified name of func"""
+
+    name = getattr(func, "__qualname__", func.__name__)
+    return f"{getattr(func, '__module__', None)}.{name}"
+
+
+##########################################
+def task_key(func) -> str:
+    """
+    Return identity of func used for concurrency limits. Bound methods
+    and nested functions include the object id so functions with the
+    same name from other objects or modules do not share a limit
+    """
+
+    key = task_name(func)
+    owner = getattr(func, "__self__", None)
+    if owner is not None and not isinstance(owner, ModuleType):
+        key = f"{key}@{id(owner):x}"
+
+    elif "<locals>" in key:
+        key = f"{key}@{id(func):x}"
+
+    return key
+
+
+##########################################
+class ReadyQueue:
+    """
+    Ready queues per priority level. Higher priority tasks are
+    taken first but a waiting lower priority task is taken after
+    it has been passed over STARVATION_LIMIT times. Tasks are tuples
+    starting with the task id and queued ids are counted so a
+    membership check does not scan the queues
+    """
+
+    ##########################################
+    def __init__(self, levels: int = PRIORITY_LOW + 1, limit: int = STARVATION_LIMIT):
+        self._queues = [deque() for _ in range(levels)]
+        self._passed = [0] * levels
+        self._limit = limit
+        self._ids = {}
+
+    ##########################################
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    ##########################################
+    def __contains__(self, task_id: str) -> bool:
+        return task_id in self._ids
+
+    ##########################################
+    def __iter__(self):
+        for queue in self._queues:
+            yield from queue
+
+    ##########################################
+    def append(self, task: tuple, priority: int = PRIORITY_NORMAL):
+        """Add task to queue for priority level"""
+
+        priority = min(max(priority, 0), len(self._queues) - 1)
+        self._queues[priority].append(task)
+        self._ids[task[0]] = self._ids.get(task[0], 0) + 1
+
+    ##########################################
+    def requeue(self, items: list):
+        """Put (priority, task) items back at the front of their queues"""
+
+        for priority, task in reversed(items):
+            self._queues[priority].appendleft(task)
+            self._ids[task[0]] = self._ids.get(task[0], 0) + 1
+
+    ##########################################
+    def popleft(self) -> tuple:
+        """Remove and return (priority, task) of next task to run"""
+
+        levels = range(len(self._queues))
+        level = next(num for num in levels if self._queues[num])
+        for lower in levels[level + 1 :]:
+            if self._queues[lower] and self._passed[lower] >= self._limit:
+                level = lower
+                break
+
+        for lower in levels[level + 1 :]:
+            if self._queues[lower]:
+                self._passed[lower] += 1
+
+        self._passed[level] = 0
+        task = self._queues[level].popleft()
+        count = self._ids.pop(task[0]) - 1
+        if count > 0:
+            self._ids[task[0]] = count
+
+        return level, task
+
+
+##########################################
+class SchedulerOptions(NamedTuple):
+    """Scheduler settings. See the scheduler section of config-example.yaml"""
+
+    workers: int = 0
+    catch_up: str = None
+    timers: str = HeapTimers.name
+    timeouts: dict = None
+    abandon: bool = False
+    spread: float = 0
+    jitter: float = 0
+    wake_window: float = 0
+    seed: str = None
+
+    ##########################################
+    @classmethod
+    def from_config(cls, conf: dict, seed: str = None):
+        """Return options from scheduler config section"""
+
+        conf = conf or {}
+        options = {key: conf[key] for key in cls._fields if conf.get(key) is not None}
+        options.setdefault("seed", seed)
+        return cls(**options)
+
 
 ##########################################
 class Scheduler:  # pylint: disable=too-many-instance-attributes
@@ -37,27 +199,70 @@ class Scheduler:  # pylint: disable=too-many-instance-attributes
         state: ThreadSafeDict,
         running_event: threading.Event,
         run_maintenance: bool = True,
+        options: SchedulerOptions = None,
     ):
         LOGGER.debug("%s init", LOG_PREFIX)
+        if options is None:
+            options = SchedulerOptions()
+
         signal.signal(signal.SIGINT, self.stop)
         signal.signal(signal.SIGTERM, self.stop)
 
         self._running = False
         self._task_event = threading.Event()
         self._task_event.clear()
-        self.ready = deque()
-        self.sleeping = []
+        self.ready = ReadyQueue()
+        self.sleeping = TIMERS.get(options.timers, HeapTimers)(time.monotonic())
+        self._task_seq = itertools.count(1)
         self._state = state
         self._running_event = running_event
+        self._workers = options.workers if isinstance(options.workers, int) else 0
+        self._pool = None
+        self._limits = {}
+        self._inflight = {}
+        self._inflight_lock = threading.Lock()
+        self._queue_lock = threading.Lock()
+        self._catch_up = (
+            options.catch_up if options.catch_up in CATCH_UP_MODES else None
+        )
+        self._clock_offset = time.time() - time.monotonic()
+        self._default_timeouts = (
+            options.timeouts if isinstance(options.timeouts, dict) else {}
+        )
+        self._abandon = options.abandon
+        self._timeouts = {}
+        self._active = []
+        self._watchdog = None
+        self._watchdog_lock = threading.Lock()
+        self.metrics = SchedulerMetrics()
+        self._spread = min(max(options.spread or 0, 0), 1)
+        self._jitter = max(options.jitter or 0, 0)
+        self._wake_window = max(options.wake_window or 0, 0)
+        self._min_interval = float("inf")
+        self._seed = options.seed or platform.node()
 
         with self._state as _state:
-            _state[SCHEDULER] = {RUNNING: False, TASKS: {}}
+            _state[SCHEDULER] = {
+                RUNNING: False,
+                TASKS: {},
+                WORKERS: self._workers,
+                CATCH_UP: self._catch_up,
+                TIMERS_KEY: self.sleeping.name,
+                OVERRUNS: 0,
+            }
 
         self.log_output = None
         self._output_handler = None
         if run_maintenance:
             self.queue(self._sched_maint, 600, True)
 
+    ##########################################
+    @property
+    def inline(self) -> bool:
+        """Return True if ready tasks run in the loop thread"""
+
+        return self._workers <= 0
+
     ##########################################
     def update_state(self, key: str, value: Any = None):
         """Update scheduler state dict"""
@@ -70,17 +275,8 @@ class Scheduler:  # pylint: disable=too-many-instance-attributes
         """Update task state dict with key, value"""
 
         with self._state as _state:
-            _state[SCHEDULER][TASKS][task_id][key] = value
-
-    ##########################################
-    def _get_tasks(self) -> list:
-        """Return list of task ids"""
-
-        task_ids = []
-        with self._state as _state:
-            task_ids = list(_state[SCHEDULER][TASKS].keys())
-
-        return task_ids
+            if task_id in _state[SCHEDULER][TASKS]:
+                _state[SCHEDULER][TASKS][task_id][key] = value
 
     ##########################################
     def set_task_state(
@@ -90,7 +286,7 @@ class Scheduler:  # pylint: disable=too-many-instance-attributes
         args: list,
         log: bool,
         next_run: int = 0,
-        sleep: int = 0,
+        sleep: float = 0,
     ):
         """Set initial task state dict with details"""
 
@@ -105,6 +301,17 @@ class Scheduler:  # pylint: disable=too-many-instance-attributes
                 RUNNING: False,
             }
 
+    ##########################################
+    def get_metrics(self) -> dict:
+        """Return dict of scheduler metrics. Times in ms"""
+
+        data = self.metrics.snapshot()
+        data[LATENESS] = self.metrics.worst()
+        with self._state as _state:
+            data[OVERRUNS] = _state[SCHEDULER].get(OVERRUNS, 0)
+
+        return data
+
     ##########################################
     def state_running(self, state: bool = True):
         """Set running state"""
@@ -122,57 +329,186 @@ class Scheduler:  # pylint: disable=too-many-instance-attributes
             for _task, _data in tuple(_state[SCHEDULER][TASKS].items()):
                 if _data[NEXT] == 0 and _data[RUNNING] is False:
                     _state[SCHEDULER][TASKS].pop(_task, None)
+                    self._timeouts.pop(_task, None)
 
     ##########################################
     def _get_task_id(self, name: str) -> str:
         """Return unique task id"""
 
-        task_ids = self._get_tasks()
-        _id = None
-        while _id is None and _id not in task_ids:
-            _id = f"{name}_{int(time.time()*1000)}"
-        return _id
+        return f"{name}_{next(self._task_seq)}"
 
     ##########################################
-    def run(self, func, args: list = None, log: bool = False) -> str:
+    def run(  # pylint: disable=too-many-arguments
+        self,
+        func,
+        args: list = None,
+        log: bool = False,
+        concurrency: int = None,
+        timeout: float = None,
+        abandon: bool = None,
+        priority: int = PRIORITY_NORMAL,
+    ) -> str:
         """
         Adds the func to the ready queue immediately
         """
 
-        _id = self._get_task_id(func.__name__)
-        self.queue(func, 1, False, args)
-        self.set_task_state(_id, func, args, log)
-        if self._running:
-            self._task_event.set()
-
-        return _id
+        return self.queue(
+            func,
+            0,
+            False,
+            args,
+            log,
+            concurrency,
+            timeout=timeout,
+            abandon=abandon,
+            priority=priority,
+        )
 
     ##########################################
     def queue(  # pylint: disable=too-many-arguments
         self,
         func,
-        sleep: int = 10,
+        sleep: float = 10,
         forever: bool = False,
         args: list = None,
         log: bool = False,
+        concurrency: int = None,
+        catch_up: str = None,
+        timeout: float = None,
+        abandon: bool = None,
+        priority: int = PRIORITY_NORMAL,
     ) -> str:
         """
         Adds the func to the sleeping queue
-        after calculating deadline
+        after calculating deadline.
+        concurrency limits how many runs of func may
+        execute at once in worker pool mode (default 1).
+        catch_up selects fixed-rate scheduling for forever
+        tasks and how missed periods are handled:
+        skip, coalesce or burst. None re-arms the task
+        after each run (fixed-delay).
+        timeout is the run time limit in seconds checked by
+        the watchdog. With abandon the run is left behind
+        once it overruns and the task is free to run again.
+        Forever tasks start after a per-host phase offset
+        when spread or jitter are set.
+        priority is PRIORITY_HIGH, PRIORITY_NORMAL or PRIORITY_LOW.
+        Ready tasks run in priority order
         """
 
         _id = self._get_task_id(func.__name__)
         LOGGER.debug("%s Scheduling task %s in %s second(s)", LOG_PREFIX, _id, sleep)
-        if not isinstance(sleep, int):
+        if isinstance(sleep, bool) or not isinstance(sleep, (int, float)):
             sleep = 10
 
-        deadline = time.time() + sleep
-        heapq.heappush(self.sleeping, (deadline, _id, func, args, log, sleep, forever))
-        self.set_task_state(_id, func, args, log, deadline, sleep)
+        if forever:
+            sleep = max(sleep, MIN_SLEEP)
+
+        if isinstance(concurrency, int) and concurrency > 0:
+            self._limits[task_key(func)] = concurrency
+
+        if catch_up not in CATCH_UP_MODES:
+            catch_up = self._catch_up
+
+        if timeout is None:
+            timeout = self._default_timeout(func)
+
+        if timeout:
+            self._timeouts[_id] = (
+                timeout,
+                self._abandon if abandon is None else abandon,
+            )
+            self._start_watchdog()
+
+        deadline = time.monotonic() + sleep
+        if forever:
+            deadline += self._phase(task_name(func), sleep)
+            self._min_interval = min(self._min_interval, sleep)
+
+        self.set_task_state(_id, func, args, log, self._wall(deadline), sleep)
+        with self._queue_lock:
+            self.sleeping.push(
+                (deadline, _id, func, args, log, sleep, forever, catch_up, priority)
+            )
+
         if self._running:
-            self._task_event.set()
+            self._wake()
         return _id
 
+    ##########################################
+    def _default_timeout(self, func) -> float:
+        """
+        Return configured timeout for func. Keys are matched from
+        module.Class.method to Class.method to the function name
+        """
+
+        for name in (task_name(func), func.__qualname__, func.__name__):
+            if name in self._default_timeouts:
+                return self._default_timeouts[name]
+
+        return None
+
+    ##########################################
+    def _phase(self, name: str, sleep: float) -> float:
+        """
+        Return deterministic start offset for periodic task.
+        Derived from the seed (hostname) so hosts spread out
+        their runs while each host keeps the same phase
+        """
+
+        if not self._spread and not self._jitter:
+            return 0
+
+        digest = hashlib.sha1(f"{self._seed}:{name}".encode()).digest()
+        phase = int.from_bytes(digest[:4], "big") / 0xFFFFFFFF
+        jitter = int.from_bytes(digest[4:8], "big") / 0xFFFFFFFF
+        return phase * self._spread * sleep + jitter * self._jitter
+
+    ##########################################
+    def cancel(self, task_id: str) -> bool:
+        """
+        Remove task from the sleeping queue.
+        A run already in the ready queue is not stopped
+        """
+
+        with self._queue_lock:
+            task = self.sleeping.cancel(task_id)
+
+        if task is None:
+            return False
+
+        LOGGER.debug("%s Cancelled task %s", LOG_PREFIX, task_id)
+        self._timeouts.pop(task_id, None)
+        self.update_task_state(task_id, NEXT, 0)
+        return True
+
+    ##########################################
+    def reschedule(self, task_id: str, sleep: float) -> bool:
+        """Change interval of task and re-arm it from now"""
+
+        with self._queue_lock:
+            task = self.sleeping.get(task_id)
+            if task is None:
+                return False
+
+            deadline = time.monotonic() + sleep
+            self.sleeping.push((deadline, task_id) + task[2:5] + (sleep,) + task[6:])
+            if task[6]:
+                self._min_interval = min(self._min_interval, sleep)
+
+        LOGGER.debug("%s Rescheduled task %s every %s", LOG_PREFIX, task_id, sleep)
+        self.update_task_state(task_id, SLEEP, sleep)
+        self.update_task_state(task_id, NEXT, self._wall(deadline))
+        if self._running:
+            self._wake()
+        return True
+
+    ##########################################
+    def _wake(self):
+        """Wake the event loop"""
+
+        self._task_event.set()
+
     ##########################################
     def stop(self, sig_num: int = 0, frame=None):  # pylint: disable=unused-argument
         """
@@ -183,114 +519,530 @@ class Scheduler:  # pylint: disable=too-many-instance-attributes
 
         LOGGER.info("%s Stopping", LOG_PREFIX)
         self._running_event.clear()
-        self._task_event.set()
+        self._wake()
         if self._running:
             self._running = False
 
         LOGGER.info("%s Exit", LOG_PREFIX)
 
     ##########################################
-    def start(self):  # pylint: disable=too-many-branches, too-many-statements
+    def _run_task(  # pylint: disable=too-many-arguments
+        self,
+        _id: str,
+        func,
+        args: list,
+        log: bool,
+        deadline: float,
+        done: threading.Event = None,
+        pooled: bool = False,
+    ):
+        """Run task function and update task state"""
+
+        run = self._begin_run(_id, func, deadline, done, pooled)
+        try:
+            if args is not None:
+                result = func(args)
+            else:
+                result = func()
+
+            if asyncio.iscoroutine(result):
+                asyncio.run(result)
+
+        except Exception:  # pylint: disable=broad-except
+            self._log_exception(_id, args)
+
+        finally:
+            self._end_run(run, log)
+
+    ##########################################
+    def _begin_run(  # pylint: disable=too-many-arguments
+        self,
+        _id: str,
+        func,
+        deadline: float,
+        done: threading.Event = None,
+        pooled: bool = False,
+    ) -> dict:
+        """Register task run for the watchdog and update task state"""
+
+        run = {
+            ID: _id,
+            FUNCTION: func.__name__,
+            KEY: task_key(func),
+            START_TIME: time.monotonic(),
+            LATENESS: time.monotonic() - deadline,
+            LAST: time.time(),
+            OVERRUN: False,
+            ABANDONED: False,
+            POOLED: pooled,
+            DONE: done,
+        }
+        with self._inflight_lock:
+            self._active.append(run)
+
+        self.update_task_state(_id, LAST, run[LAST])
+        self.update_task_state(_id, RUNNING, True)
+        return run
+
+    ##########################################
+    def _end_run(self, run: dict, log: bool):
+        """Release task run and record metrics"""
+
+        _id = run[ID]
+        with self._inflight_lock:
+            self._active.remove(run)
+            if run[POOLED] and not run[ABANDONED]:
+                self._release(run[KEY])
+
+        if run[DONE] is not None:
+            run[DONE].set()
+
+        self.metrics.record_run(
+            run[FUNCTION], time.monotonic() - run[START_TIME], run[LATENESS]
+        )
+        runtime = calc_elapsed(run[LAST], True)
+        if run[ABANDONED]:
+            LOGGER.warning(
+                "%s Abandoned task %s finished after %s", LOG_PREFIX, _id, runtime
+            )
+            return
+
+        self.update_task_state(_id, RUNNING, False)
+        self.update_task_state(_id, RUNTIME, runtime)
+
+        _log = LOGGER.info if log else LOGGER.debug
+        _log(
+            "%s Finished task %s in %s",
+            LOG_PREFIX,
+            _id,
+            runtime,
+        )
+
+    ##########################################
+    def _log_exception(self, _id: str, args: list):
+        """Log exception raised by task"""
+
+        LOGGER.error(
+            "%s Exception running task %s args: %s",
+            LOG_PREFIX,
+            _id,
+            args,
+        )
+        LOGGER.error(sys.exc_info()[1])
+        LOGGER.error(traceback.format_exc())
+
+    ##########################################
+    def _run_pooled(  # pylint: disable=too-many-arguments
+        self, _id: str, func, args: list, log: bool, deadline: float
+    ):
+        """Run task in worker thread and wake the loop when done"""
+
+        try:
+            self._run_task(_id, func, args, log, deadline, pooled=True)
+
+        finally:
+            self._wake()
+
+    ##########################################
+    def _run_inline(  # pylint: disable=too-many-arguments
+        self, _id: str, func, args: list, log: bool, deadline: float
+    ):
         """
-        Run the Event loop
+        Run task in the loop thread. Tasks that can be abandoned
+        run in a helper thread so the loop can move on
         """
-        LOGGER.info("%s Starting scheduler", LOG_PREFIX)
-        self.state_running()
-        timeout = 10
-        while self.ready or self.sleeping:
-            LOGGER.debug(
-                "%s [Loop] tasks sleeping %s. timeout: %s",
-                LOG_PREFIX,
-                len(self.sleeping),
-                timeout,
-            )
 
-            if self._task_event.is_set():
-                self.update_state("last_event", time.time())
-                self._task_event.clear()
+        limit = self._timeouts.get(_id)
+        if limit is None or not limit[1]:
+            self._run_task(_id, func, args, log, deadline)
+            return
+
+        done = threading.Event()
+        threading.Thread(
+            target=self._run_task,
+            args=(_id, func, args, log, deadline, done),
+            name=f"task_{_id}",
+            daemon=True,
+        ).start()
+        done.wait()
 
+    ##########################################
+    def _start_watchdog(self):
+        """Start watchdog thread if scheduler is running and none is alive"""
+
+        with self._watchdog_lock:
             if not self._running:
-                LOGGER.error("%s running is False. Exit", LOG_PREFIX)
-                break
+                return
+
+            if self._watchdog is not None and self._watchdog.is_alive():
+                return
+
+            LOGGER.info("%s Starting task watchdog", LOG_PREFIX)
+            self._watchdog = threading.Thread(
+                target=self._watchdog_loop, name="scheduler_watchdog", daemon=True
+            )
+            self._watchdog.start()
+
+    ##########################################
+    def _watchdog_loop(self):
+        """
+        Check running tasks for overruns. The decision to stop is made
+        under the lock so a restart either sees this thread gone or
+        keeps it running
+        """
+
+        while True:
+            time.sleep(WATCHDOG_INTERVAL)
+            with self._watchdog_lock:
+                if not self._running:
+                    if self._watchdog is threading.current_thread():
+                        self._watchdog = None
+                    return
+
+            self._check_overruns()
+
+    ##########################################
+    def _check_overruns(self):
+        """Flag tasks running longer than their timeout"""
+
+        now = time.monotonic()
+        overruns = []
+        with self._inflight_lock:
+            for run in self._active:
+                limit = self._timeouts.get(run[ID])
+                if limit is None or run[OVERRUN]:
+                    continue
+
+                timeout, abandon = limit
+                elapsed = now - run[START_TIME]
+                if elapsed < timeout:
+                    continue
+
+                run[OVERRUN] = True
+                if abandon:
+                    run[ABANDONED] = True
+                    if run[POOLED]:
+                        self._release(run[KEY])
+
+                overruns.append((run, elapsed))
+
+        for run, elapsed in overruns:
+            self._record_overrun(run, elapsed)
+
+    ##########################################
+    def _record_overrun(self, run: dict, elapsed: float):
+        """Log overrun and update scheduler state"""
 
-            if self.sleeping:
-                timeout = min(int(self.sleeping[0][0] - time.time()), 10)
-
-            if not self.ready:
-                while self.sleeping:
-                    deadline = self.sleeping[0][0]
-                    timeout = int(deadline - time.time())
-                    LOGGER.debug(
-                        "%s [Sleeping] tasks sleeping %s. timeout: %s",
-                        LOG_PREFIX,
-                        len(self.sleeping),
-                        timeout,
-                    )
-                    timeout = min(timeout, 3)
-                    if deadline > time.time():
-                        break
-
-                    deadline, _id, func, args, log, sleep, forever = heapq.heappop(
-                        self.sleeping
-                    )
-
-                    self.ready.append((_id, func, args, log))
-
-                    if forever:
-                        deadline = time.time() + sleep
-                        self.update_task_state(_id, NEXT, deadline)
-                        heapq.heappush(
-                            self.sleeping,
-                            (deadline, _id, func, args, log, sleep, forever),
-                        )
-
-            while self.ready:
+        _id = run[ID]
+        LOGGER.warning(
+            "%s Task %s overran timeout. running %.1f second(s). abandon: %s",
+            LOG_PREFIX,
+            _id,
+            elapsed,
+            run[ABANDONED],
+        )
+        with self._state as _state:
+            _sched = _state[SCHEDULER]
+            _sched[OVERRUNS] = _sched.get(OVERRUNS, 0) + 1
+            _sched[LAST_OVERRUN] = {
+                ID: _id,
+                TIMEOUT: self._timeouts.get(_id, (None,))[0],
+                ABANDON: run[ABANDONED],
+                "time": time.time(),
+            }
+            _task = _sched[TASKS].get(_id)
+            if _task is not None:
+                _task[OVERRUNS] = _task.get(OVERRUNS, 0) + 1
+                if run[ABANDONED]:
+                    _task[RUNNING] = False
+
+        if run[ABANDONED]:
+            if run[DONE] is not None:
+                run[DONE].set()
+            self._wake()
+
+    ##########################################
+    def _acquire(self, func) -> bool:
+        """Reserve a concurrency slot for func. Return False if at limit"""
+
+        key = task_key(func)
+        with self._inflight_lock:
+            count = self._inflight.get(key, 0)
+            if count >= self._limits.get(key, 1):
+                return False
+
+            self._inflight[key] = count + 1
+
+        return True
+
+    ##########################################
+    def _release(self, key: str):
+        """Free concurrency slot. Caller holds the inflight lock"""
+
+        count = self._inflight.pop(key) - 1
+        if count > 0:
+            self._inflight[key] = count
+
+    ##########################################
+    def _dispatch(self) -> bool:
+        """
+        Run or submit ready tasks.
+        Return True if tasks were deferred by concurrency limits
+        """
+
+        self.metrics.record_depth(len(self.ready), len(self.sleeping))
+        if self._pool is None:
+            while self.ready and self._running:
                 LOGGER.debug(
-                    "%s [Ready] tasks ready %s. timeout: %s",
+                    "%s [Ready] tasks ready %s",
                     LOG_PREFIX,
                     len(self.ready),
-                    timeout,
                 )
-                start = time.time()
-                _id, func, args, log = self.ready.popleft()
-                self.update_task_state(_id, LAST, time.time())
-                self.update_task_state(_id, RUNNING, True)
-                try:
-                    if args is not None:
-                        func(args)
-                    else:
-                        func()
-
-                except Exception as err:  # pylint: disable=broad-except
-                    LOGGER.error(
-                        "%s Exception running task %sk args: %s",
-                        LOG_PREFIX,
-                        _id,
-                        args,
-                    )
-                    LOGGER.error(err)
-                    LOGGER.error(traceback.format_exc())
-
-                runtime = calc_elapsed(start, True)
-                self.update_task_state(_id, RUNNING, False)
-                self.update_task_state(_id, "runtime", runtime)
+                self._run_inline(*self.ready.popleft()[1])
+                with self._queue_lock:
+                    self._promote_ready()
+
+            return False
 
+        deferred = []
+        while self.ready and self._inflight_count() < self._workers:
+            priority, task = self.ready.popleft()
+            _id, func, args, log, deadline = task
+            if not self._acquire(func):
                 LOGGER.debug(
-                    "%s Finished task %s in %s",
+                    "%s [Ready] task %s deferred. %s already running",
                     LOG_PREFIX,
                     _id,
-                    runtime,
+                    func.__name__,
                 )
+                deferred.append((priority, task))
+                continue
+
+            LOGGER.debug("%s [Ready] submit task %s to worker", LOG_PREFIX, _id)
+            self._pool.submit(self._run_pooled, _id, func, args, log, deadline)
+
+        self.ready.requeue(deferred)
+        return len(deferred) > 0
+
+    ##########################################
+    def _wall(self, deadline: float) -> float:
+        """Convert monotonic deadline to wall clock time"""
+
+        return deadline + time.time() - time.monotonic()
+
+    ##########################################
+    def _next_deadline(
+        self, deadline: float, now: float, sleep: float, catch_up: str
+    ) -> tuple:
+        """
+        Return next deadline for forever task and bool
+        if the current run should execute
+        """
+
+        if catch_up is None or sleep <= 0:
+            return now + sleep, True
+
+        missed = int((now - deadline) // sleep)
+        if missed < 1 or (catch_up == CATCH_UP_BURST and missed <= MAX_BURST):
+            return deadline + sleep, True
+
+        LOGGER.debug(
+            "%s Task missed %s period(s). catch_up: %s", LOG_PREFIX, missed, catch_up
+        )
+        return deadline + (missed + 1) * sleep, catch_up != CATCH_UP_SKIP
+
+    ##########################################
+    def _check_clock(self):
+        """Detect wall clock jumps from suspend/resume or NTP"""
+
+        offset = time.time() - time.monotonic()
+        jump = offset - self._clock_offset
+        self._clock_offset = offset
+        if abs(jump) < TIME_JUMP:
+            return
+
+        LOGGER.warning("%s Wall clock jumped %.1f second(s)", LOG_PREFIX, jump)
+        if jump < 0:
+            return
+
+        LOGGER.info("%s Resumed. Running forever tasks now", LOG_PREFIX)
+        self.update_state(RESUMED, time.time())
+        now = time.monotonic()
+        with self._queue_lock:
+            for task in self.sleeping.tasks():
+                if task[6]:
+                    self.sleeping.push((now,) + task[1:])
 
-            if len(self.ready) == 0:
-                sleep = 1 if timeout < 1 else timeout
+    ##########################################
+    def _window(self) -> float:
+        """Return wake window capped below the shortest forever interval"""
+
+        return min(self._wake_window, self._min_interval / 2)
+
+    ##########################################
+    def _pop_due(self, now: float) -> list:
+        """
+        Return sleeping tasks past deadline. Forever tasks due within
+        the wake window after the earliest of them are added so they
+        share the wake-up. One-shot tasks never run early
+        """
+
+        due = self.sleeping.pop_due(now)
+        window = self._window()
+        if not due or not window:
+            return due
+
+        for task in self.sleeping.pop_due(due[0][0] + window):
+            if task[6]:
+                due.append(task)
+
+            else:
+                self.sleeping.push(task)
+
+        return due
+
+    ##########################################
+    def _promote_ready(self):
+        """
+        Move sleeping tasks past deadline to ready queue. Forever tasks
+        due within the wake window run now to save a wake-up
+        """
+
+        now = time.monotonic()
+        for task in self._pop_due(now):
+            deadline, _id, func, args, log, sleep, forever, catch_up, priority = task
+            run_task = True
+            if forever:
+                next_deadline, run_task = self._next_deadline(
+                    deadline, now, sleep, catch_up
+                )
+
+            if run_task and forever and self._is_ready(_id):
                 LOGGER.debug(
-                    "%s [Wait] tasks sleeping: %s. wait %s.",
-                    LOG_PREFIX,
-                    len(self.sleeping),
-                    sleep,
+                    "%s Task %s is still waiting. Skipping run", LOG_PREFIX, _id
                 )
-                self._task_event.wait(sleep)
+                run_task = False
+
+            if run_task:
+                self.ready.append((_id, func, args, log, deadline), priority)
+
+            else:
+                self.update_task_state(_id, SKIPPED, time.time())
+
+            if forever:
+                self.update_task_state(_id, NEXT, self._wall(next_deadline))
+                self.sleeping.push((next_deadline,) + task[1:])
+
+            else:
+                self.update_task_state(_id, NEXT, 0)
+
+    ##########################################
+    def _next_wait(self) -> float:
+        """Return seconds to wait until the next task is due"""
+
+        deadline = self.sleeping.next_deadline()
+        if deadline is None:
+            return MAX_WAIT
+
+        wait = deadline - time.monotonic()
+        return min(max(wait, 0), MAX_WAIT)
+
+    ##########################################
+    def _inflight_count(self) -> int:
+        """Return number of tasks in flight in the worker pool"""
+
+        with self._inflight_lock:
+            return sum(self._inflight.values())
+
+    ##########################################
+    def _busy(self) -> bool:
+        """Return True if worker pool has tasks in flight"""
+
+        return self._inflight_count() > 0
+
+    ##########################################
+    def _pending(self) -> bool:
+        """Return True while tasks are ready, sleeping or running"""
+
+        return bool(self.ready or self.sleeping or self._busy())
+
+    ##########################################
+    def _is_ready(self, _id: str) -> bool:
+        """Return True if task id is waiting in ready queue"""
+
+        return _id in self.ready
+
+    ##########################################
+    def _step(self) -> float:
+        """
+        Run one pass of the event loop. Return seconds to wait
+        for the next task or None when the loop should exit
+        """
+
+        if not self._running:
+            LOGGER.error("%s running is False. Exit", LOG_PREFIX)
+            return None
+
+        self._check_clock()
+        with self._queue_lock:
+            self._promote_ready()
+
+        self._dispatch()
+        if not self._pending():
+            return 0
+
+        with self._queue_lock:
+            timeout = self._next_wait()
+
+        LOGGER.debug(
+            "%s [Wait] tasks sleeping: %s. wait %.3f.",
+            LOG_PREFIX,
+            len(self.sleeping),
+            timeout,
+        )
+        return timeout
+
+    ##########################################
+    def _shutdown(self, pool: ThreadPoolExecutor):
+        """Wait for running tasks unless a run was abandoned"""
+
+        with self._inflight_lock:
+            hung = any(run[ABANDONED] for run in self._active)
+
+        LOGGER.info("%s Waiting for running tasks", LOG_PREFIX)
+        pool.shutdown(wait=not hung, cancel_futures=True)
+
+    ##########################################
+    def start(self):
+        """
+        Run the Event loop
+        """
+        LOGGER.info("%s Starting scheduler", LOG_PREFIX)
+        if self._workers > 0:
+            LOGGER.info("%s Using worker pool. workers: %s", LOG_PREFIX, self._workers)
+            self._pool = ThreadPoolExecutor(
+                max_workers=self._workers, thread_name_prefix="scheduler"
+            )
+
+        self.state_running()
+        if self._timeouts:
+            self._start_watchdog()
+
+        while self._pending():
+            if self._task_event.is_set():
+                self.update_state("last_event", time.time())
+                self._task_event.clear()
+
+            timeout = self._step()
+            if timeout is None:
+                break
+
+            if timeout > 0:
+                self._task_event.wait(timeout)
+
+        if self._pool is not None:
+            self._shutdown(self._pool)
+            self._pool = None
 
         self.state_running(False)
         LOGGER.info("%s Finished tasks", LOG_PREFIX)
@@ -0,0 +1,117 @@
+"""JSON serializers for MQTT payloads and state files"""
+
+import json
+
+try:
+    import orjson
+
+except ImportError:
+    orjson = None
+
+
+from service.log import LOGGER
+
+LOG_PREFIX = r"[Serializer]"
+AUTO = "auto"
+
+
+##########################################
+class JsonSerializer:
+    """Standard library json. Unknown types are encoded as strings"""
+
+    name = "json"
+
+    ##########################################
+    @staticmethod
+    def dumps(data) -> str:
+        """Return data encoded as compact JSON"""
+
+        return json.dumps(data, default=str, separators=(",", ":"))
+
+    ##########################################
+    @staticmethod
+    def dumpb(data) -> bytes:
+        """Return data encoded as compact JSON bytes"""
+
+        return JsonSerializer.dumps(data).encode("utf-8")
+
+    ##########################################
+    @staticmethod
+    def loads(data):
+        """Return data decoded from str or bytes"""
+
+        return json.loads(data)
+
+    ##########################################
+    @staticmethod
+    def loadb(buffer):
+        """Return data decoded from a bytes-like buffer such as an mmap"""
+
+        return json.loads(bytes(buffer))
+
+
+##########################################
+class OrjsonSerializer:
+    """
+    orjson fast path. Datetimes and unknown types are encoded as
+    strings like JsonSerializer. Needs the optional orjson package
+    """
+
+    # pylint: disable=no-member
+    name = "orjson"
+    options = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME if orjson else 0
+    )
+
+    ##########################################
+    @staticmethod
+    def dumps(data) -> str:
+        """Return data encoded as compact JSON"""
+
+        return OrjsonSerializer.dumpb(data).decode("utf-8")
+
+    ##########################################
+    @staticmethod
+    def dumpb(data) -> bytes:
+        """Return data encoded as compact JSON bytes"""
+
+        return orjson.dumps(data, default=str, option=OrjsonSerializer.options)
+
+    ##########################################
+    @staticmethod
+    def loads(data):
+        """Return data decoded from str or bytes"""
+
+        return orjson.loads(data)
+
+    ##########################################
+    @staticmethod
+    def loadb(buffer):
+        """Return data decoded from a bytes-like buffer without copying it"""
+
+        with memoryview(buffer) as view:
+            return orjson.loads(view)
+
+
+SERIALIZERS = {
+    JsonSerializer.name: JsonSerializer,
+    OrjsonSerializer.name: OrjsonSerializer,
+}
+
+
+##########################################
+def get_serializer(name: str = AUTO):
+    """Return serializer class. auto picks orjson if installed"""
+
+    if name in (None, AUTO):
+        return OrjsonSerializer if orjson is not None else JsonSerializer
+
+    if name == OrjsonSerializer.name and orjson is None:
+        LOGGER.warning(
+            "%s orjson is not installed. Please run python3 -m pip install "
+            "orjson. Using json",
+            LOG_PREFIX,
+        )
+        return JsonSerializer
+
+    return SERIALIZERS.get(name, JsonSerializer)
@@ -2,14 +2,17 @@
 # pylint: disable=consider-using-with
 
 import os
+import time
 import threading
-import json
+from array import array
+from collections import OrderedDict
+from types import MappingProxyType
 
 
-from service.log import LOGGER
-from service.const import STATE, ATTRIBS, DEVICE
+from service.const import COUNT, MIN, MAX, MEAN
 
-LOG_PREFIX = r"[State]"
+MUTABLE_TYPES = (dict, list, set, bytearray)
+_MISSING = object()
 
 
 ##########################################
@@ -28,6 +31,412 @@ class ThreadSafeDict(dict):
         self._lock.release()
 
 
+##########################################
+class StateStore:
+    """
+    Copy-on-write state store. Readers take the current
+    immutable snapshot without locking. Writers copy the
+    current version, apply changes and publish the new version.
+    Each changed key records the version it last changed in
+    so consumers can read only keys changed since a version
+    """
+
+    ##########################################
+    def __init__(self, *p_arg, **n_arg):
+        self._lock = threading.Lock()
+        self._view = MappingProxyType(dict(*p_arg, **n_arg))
+        self._txn = None
+        self._changes = OrderedDict()
+        self.version = 0
+
+    ##########################################
+    def __enter__(self) -> dict:
+        """Start write transaction and return mutable copy"""
+
+        self._lock.acquire()
+        self._txn = dict(self._view)
+        return self._txn
+
+    ##########################################
+    def __exit__(self, _type, _value, _traceback):
+        """Publish write transaction"""
+
+        try:
+            if _type is None:
+                old, new = self._view, self._txn
+                keys = [
+                    key
+                    for key in old.keys() | new.keys()
+                    if _changed(old.get(key, _MISSING), new.get(key, _MISSING))
+                ]
+                self._publish(new, keys)
+
+        finally:
+            self._txn = None
+            self._lock.release()
+
+    ##########################################
+    def _publish(self, data: dict, keys: list):
+        """Replace current version with data if keys changed"""
+
+        if not keys:
+            return
+
+        self._view = MappingProxyType(data)
+        self.version += 1
+        for key in keys:
+            self._changes[key] = self.version
+            self._changes.move_to_end(key)
+
+    ##########################################
+    def changed_since(self, version: int) -> tuple:
+        """Return current version and list of keys changed after version"""
+
+        with self._lock:
+            keys = []
+            for key in reversed(self._changes):
+                if self._changes[key] <= version:
+                    break
+                keys.append(key)
+
+            return self.version, keys
+
+    ##########################################
+    def key_version(self, key: str) -> int:
+        """Return version key last changed in or 0"""
+
+        return self._changes.get(key, 0)
+
+    ##########################################
+    def snapshot(self) -> MappingProxyType:
+        """Return read-only view of current version"""
+
+        return self._view
+
+    ##########################################
+    def update(self, items: dict = None, **n_arg):
+        """Publish new version with items added"""
+
+        items = dict(items or {}, **n_arg)
+        with self._lock:
+            keys = [
+                key
+                for key, value in items.items()
+                if _changed(self._view.get(key, _MISSING), value)
+            ]
+            if not keys:
+                return
+
+            data = dict(self._view)
+            data.update(items)
+            self._publish(data, keys)
+
+    ##########################################
+    def set(self, key: str, value):
+        """Publish new version with key set to value"""
+
+        self.update({key: value})
+
+    ##########################################
+    def pop(self, key: str, default=None):
+        """Publish new version without key and return its value"""
+
+        with self._lock:
+            if key not in self._view:
+                return default
+
+            data = dict(self._view)
+            value = data.pop(key)
+            self._publish(data, [key])
+
+        return value
+
+    ##########################################
+    def remove(self, keys):
+        """Publish new version without keys"""
+
+        with self._lock:
+            keys = [key for key in keys if key in self._view]
+            if not keys:
+                return
+
+            data = dict(self._view)
+            for key in keys:
+                del data[key]
+            self._publish(data, keys)
+
+    ##########################################
+    def get(self, key: str, default=None):
+        """Return value for key from current version"""
+
+        return self._view.get(key, default)
+
+    ##########################################
+    def copy(self) -> dict:
+        """Return dict copy of current version"""
+
+        return dict(self._view)
+
+    ##########################################
+    def keys(self):
+        """Return keys of current version"""
+
+        return self._view.keys()
+
+    ##########################################
+    def items(self):
+        """Return items of current version"""
+
+        return self._view.items()
+
+    ##########################################
+    def values(self):
+        """Return values of current version"""
+
+        return self._view.values()
+
+    ##########################################
+    def __getitem__(self, key: str):
+        return self._view[key]
+
+    ##########################################
+    def __contains__(self, key: str) -> bool:
+        return key in self._view
+
+    ##########################################
+    def __iter__(self):
+        return iter(self._view)
+
+    ##########################################
+    def __len__(self) -> int:
+        return len(self._view)
+
+
+##########################################
+class HistoryTier:
+    """
+    Fixed size ring buffer of min, max, sum and count per time bucket.
+    Values are kept in arrays and a bucket maps to slot bucket % depth
+    """
+
+    ##########################################
+    def __init__(self, resolution: float, depth: int):
+        self.resolution = resolution
+        self.depth = depth
+        self._bucket = array("q", [-1]) * depth
+        self._min = array("d", [0.0]) * depth
+        self._max = array("d", [0.0]) * depth
+        self._sum = array("d", [0.0]) * depth
+        self._count = array("L", [0]) * depth
+
+    ##########################################
+    @property
+    def span(self) -> float:
+        """Return seconds of history kept"""
+
+        return self.resolution * self.depth
+
+    ##########################################
+    def add(self, timestamp: float, value: float):
+        """Add value to bucket for timestamp"""
+
+        bucket = int(timestamp // self.resolution)
+        slot = bucket % self.depth
+        if self._bucket[slot] == bucket:
+            self._min[slot] = min(self._min[slot], value)
+            self._max[slot] = max(self._max[slot], value)
+            self._sum[slot] += value
+            self._count[slot] += 1
+
+        elif self._bucket[slot] < bucket:
+            self._bucket[slot] = bucket
+            self._min[slot] = value
+            self._max[slot] = value
+            self._sum[slot] = value
+            self._count[slot] = 1
+
+    ##########################################
+    def buckets(self, start: float, end: float):
+        """Yield (time, min, max, sum, count) of buckets overlapping (start, end]"""
+
+        last = int(end // self.resolution)
+        first = int(start // self.resolution)
+        if start % self.resolution == 0:
+            first += 1
+
+        first = max(first, last - self.depth + 1)
+        for bucket in range(first, last + 1):
+            slot = bucket % self.depth
+            if self._bucket[slot] == bucket:
+                yield (
+                    bucket * self.resolution,
+                    self._min[slot],
+                    self._max[slot],
+                    self._sum[slot],
+                    self._count[slot],
+                )
+
+
+##########################################
+class SensorHistory:
+    """
+    Time-series history of numeric sensors. Each sensor keeps one
+    HistoryTier per resolution. Queries use the finest tier
+    covering the requested window
+    """
+
+    ##########################################
+    def __init__(self, sensors: tuple, tiers: dict):
+        self._prefixes = tuple(sensors)
+        self._tiers = sorted((float(res), int(depth)) for res, depth in tiers.items())
+        self._lock = threading.Lock()
+        self._history = {}
+        self._tracked = {}
+
+    ##########################################
+    def tracked(self, sensor: str) -> bool:
+        """Return True if a history prefix is found in the sensor name"""
+
+        tracked = self._tracked.get(sensor)
+        if tracked is None:
+            tracked = self._tracked[sensor] = any(
+                prefix in sensor for prefix in self._prefixes
+            )
+
+        return tracked
+
+    ##########################################
+    def sensors(self) -> list:
+        """Return list of sensors with history"""
+
+        with self._lock:
+            return list(self._history.keys())
+
+    ##########################################
+    def record(self, sensor: str, value, timestamp: float = None):
+        """Add numeric value for sensor. Other values are ignored"""
+
+        if isinstance(value, bool) or not self.tracked(sensor):
+            return
+
+        try:
+            value = float(value)
+
+        except (TypeError, ValueError):
+            return
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        with self._lock:
+            tiers = self._history.get(sensor)
+            if tiers is None:
+                tiers = self._history[sensor] = [
+                    HistoryTier(res, depth) for res, depth in self._tiers
+                ]
+
+            for tier in tiers:
+                tier.add(timestamp, value)
+
+    ##########################################
+    def record_states(self, states: dict, timestamp: float = None):
+        """Add values of tracked sensors in states"""
+
+        if timestamp is None:
+            timestamp = time.time()
+
+        for sensor, value in states.items():
+            self.record(sensor, value, timestamp)
+
+    ##########################################
+    def _tier(self, sensor: str, window: float) -> HistoryTier:
+        """Return finest tier covering window or coarsest tier"""
+
+        tiers = self._history.get(sensor)
+        if not tiers:
+            return None
+
+        for tier in tiers:
+            if tier.span >= window:
+                return tier
+
+        return tiers[-1]
+
+    ##########################################
+    def stats(self, sensor: str, window: float, now: float = None) -> dict:
+        """Return dict of count, min, max and mean over last window seconds"""
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            tier = self._tier(sensor, window)
+            if tier is None:
+                return None
+
+            count = total = 0
+            low = high = None
+            for _, _min, _max, _sum, _count in tier.buckets(now - window, now):
+                count += _count
+                total += _sum
+                low = _min if low is None else min(low, _min)
+                high = _max if high is None else max(high, _max)
+
+        if count == 0:
+            return {COUNT: 0}
+
+        return {COUNT: count, MIN: low, MAX: high, MEAN: round(total / count, 3)}
+
+    ##########################################
+    def series(
+        self, sensor: str, window: float, resolution: float = None, now: float = None
+    ) -> list:
+        """
+        Return list of (time, mean) over last window seconds
+        from the tier with resolution or the finest covering window
+        """
+
+        if now is None:
+            now = time.time()
+
+        with self._lock:
+            tiers = self._history.get(sensor, [])
+            tier = next(
+                (tier for tier in tiers if tier.resolution == resolution),
+                self._tier(sensor, window),
+            )
+            if tier is None:
+                return []
+
+            return [
+                (_time, _sum / _count)
+                for _time, _, _, _sum, _count in tier.buckets(now - window, now)
+            ]
+
+    ##########################################
+    def summary(self, window: float = 3600, now: float = None) -> dict:
+        """Return dict of stats for all sensors over window"""
+
+        return {sensor: self.stats(sensor, window, now) for sensor in self.sensors()}
+
+
+##########################################
+def _changed(old, new) -> bool:
+    """
+    Return True if new value differs from old. The same mutable
+    object may have been changed in place so it counts as changed
+    """
+
+    if old is new:
+        return isinstance(new, MUTABLE_TYPES)
+
+    try:
+        return bool(old != new)
+
+    except Exception:  # pylint: disable=broad-except
+        return True
+
+
 ##########################################
 def set_state(state_obj: ThreadSafeDict, key: str, value):
     """Set key and value in thread safe dict"""
@@ -67,39 +476,26 @@ def append_state(state: ThreadSafeDict, lst: list, item):
 
 
 ##########################################
-def load_states(state_file: str) -> dict:
-    """Read states dict from JSON file"""
+def write_atomic(file_name: str, data):
+    """
+    Write data to a temporary file and replace file_name with it
+    so readers never see a partially written file
+    """
 
-    LOGGER.debug("%s Loading states from %s", LOG_PREFIX, state_file)
+    tmp_file = f"{file_name}.tmp"
+    if isinstance(data, str):
+        data = data.encode("utf-8")
 
-    if not os.path.exists(state_file):
-        LOGGER.error("%s Failed to load states from %s", LOG_PREFIX, state_file)
-        return None
+    with open(tmp_file, "wb") as write_file:
+        write_file.write(data)
+        write_file.flush()
+        os.fsync(write_file.fileno())
 
-    states = None
-    with open(state_file, "r", encoding="utf-8") as read_file:
-        data = read_file.read()
+    os.replace(tmp_file, file_name)
+    if hasattr(os, "O_DIRECTORY"):
+        dir_fd = os.open(os.path.dirname(os.path.abspath(file_name)), os.O_DIRECTORY)
+        try:
+            os.fsync(dir_fd)
 
-    try:
-        states = json.loads(data)
-
-    except json.JSONDecodeError as err:
-        LOGGER.error("%s Failed to load states from json", LOG_PREFIX)
-        LOGGER.error(err)
-
-    return states
-
-
-##########################################
-def save_states(states_file: str, states: dict, attribs: dict, device: dict):
-    """Save states and attribs dicts to JSON file"""
-
-    with open(states_file, "w", encoding="utf-8") as write_file:
-        _state = {
-            STATE: states,
-            ATTRIBS: attribs,
-            DEVICE: device,
-        }
-        if "screen_capture" in _state[STATE]:
-            _state[STATE].pop("screen_capture")
-        write_file.write(json.dumps(_state, default=str, indent=4))
+        finally:
+            os.close(dir_fd)
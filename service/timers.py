@@ -0,0 +1,302 @@
+"""Timer backends used by the event scheduler"""
+
+import heapq
+import itertools
+
+
+##########################################
+class HeapTimers:
+    """Binary heap timer backend with lazy cancellation"""
+
+    name = "heap"
+
+    ##########################################
+    def __init__(self, start: float = None):  # pylint: disable=unused-argument
+        self._heap = []
+        self._tasks = {}
+        self._seq = itertools.count()
+
+    ##########################################
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    ##########################################
+    def push(self, task: tuple):
+        """Add task tuple (deadline, task_id, ...). Replaces task with same id"""
+
+        self._tasks[task[1]] = task
+        heapq.heappush(self._heap, (task[0], next(self._seq), task))
+        if len(self._heap) > 2 * len(self._tasks) + 64:
+            self._compact()
+
+    ##########################################
+    def get(self, task_id: str) -> tuple:
+        """Return task tuple for task id"""
+
+        return self._tasks.get(task_id)
+
+    ##########################################
+    def cancel(self, task_id: str) -> tuple:
+        """Remove task and return task tuple or None"""
+
+        return self._tasks.pop(task_id, None)
+
+    ##########################################
+    def tasks(self) -> list:
+        """Return list of task tuples"""
+
+        return list(self._tasks.values())
+
+    ##########################################
+    def next_deadline(self) -> float:
+        """Return earliest deadline or None"""
+
+        self._prune()
+        if not self._heap:
+            return None
+
+        return self._heap[0][0]
+
+    ##########################################
+    def pop_due(self, now: float) -> list:
+        """Remove and return list of tasks with deadline <= now"""
+
+        due = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, task = heapq.heappop(self._heap)
+            if self._tasks.get(task[1]) is task:
+                del self._tasks[task[1]]
+                due.append(task)
+
+        return due
+
+    ##########################################
+    def _prune(self):
+        """Drop cancelled or replaced entries from top of heap"""
+
+        while self._heap and self._tasks.get(self._heap[0][2][1]) is not self._heap[0][2]:
+            heapq.heappop(self._heap)
+
+    ##########################################
+    def _compact(self):
+        """Rebuild heap without cancelled entries"""
+
+        self._heap = [
+            item for item in self._heap if self._tasks.get(item[2][1]) is item[2]
+        ]
+        heapq.heapify(self._heap)
+
+
+##########################################
+class TimingWheel:  # pylint: disable=too-many-instance-attributes
+    """
+    Hierarchical timing wheel timer backend.
+    Each level has slots buckets and a slot on level n spans
+    slots ** n ticks. A task is kept on the lowest level where its
+    tick shares the higher digits with the current tick so push and
+    cancel are O(1). A bitmap per level finds the next non-empty slot
+    without scanning. Tasks on higher levels move down one level when
+    the wheel reaches their slot. Tasks beyond the top level wait in
+    an overflow bucket until the top level reaches the earliest of them
+    """
+
+    name = "wheel"
+
+    ##########################################
+    def __init__(self, start: float = None, tick: float = 0.01, slots: int = 64):
+        self._tick = tick
+        self._bits = max(slots.bit_length() - 1, 1)
+        self._mask = (1 << self._bits) - 1
+        self._levels = 4
+        self._wheel = [
+            [{} for _ in range(self._mask + 1)] for _ in range(self._levels)
+        ]
+        self._wheel.append([{}])
+        self._occupied = [0] * self._levels
+        self._overflow = None
+        self._found = None
+        self._tasks = {}
+        self._now = int((start or 0) // tick)
+
+    ##########################################
+    def __len__(self) -> int:
+        return len(self._tasks)
+
+    ##########################################
+    def push(self, task: tuple):
+        """Add task tuple (deadline, task_id, ...). Replaces task with same id"""
+
+        self.cancel(task[1])
+        self._place(task)
+
+    ##########################################
+    def _place(self, task: tuple):
+        """Put task in the bucket for its tick relative to the current tick"""
+
+        now = self._now
+        tick = max(int(task[0] // self._tick), now)
+        level = max(((tick ^ now).bit_length() - 1) // self._bits, 0)
+
+        shift = self._bits * level
+        slot = 0
+        if level < self._levels:
+            slot = (tick >> shift) & self._mask
+            self._occupied[level] |= 1 << slot
+
+        else:
+            level = self._levels
+            shift = self._bits * level
+            if self._overflow is None or tick < self._overflow:
+                self._overflow = tick
+
+        found = self._found
+        if found is not None and tick >> shift << shift < found[0]:
+            self._found = None
+
+        self._wheel[level][slot][task[1]] = task
+        self._tasks[task[1]] = (level, slot)
+
+    ##########################################
+    def get(self, task_id: str) -> tuple:
+        """Return task tuple for task id"""
+
+        where = self._tasks.get(task_id)
+        if where is None:
+            return None
+
+        return self._wheel[where[0]][where[1]][task_id]
+
+    ##########################################
+    def cancel(self, task_id: str) -> tuple:
+        """Remove task and return task tuple or None"""
+
+        where = self._tasks.pop(task_id, None)
+        if where is None:
+            return None
+
+        level, slot = where
+        bucket = self._wheel[level][slot]
+        task = bucket.pop(task_id)
+        if not bucket:
+            if level < self._levels:
+                self._occupied[level] &= ~(1 << slot)
+
+            if self._found is not None and self._found[1:] == where:
+                self._found = None
+
+        return task
+
+    ##########################################
+    def tasks(self) -> list:
+        """Return list of task tuples"""
+
+        return [self.get(task_id) for task_id in self._tasks]
+
+    ##########################################
+    def _next_slot(self) -> tuple:
+        """
+        Return (tick, level, slot) of the next non-empty slot or None.
+        For higher levels tick is when the slot moves down a level.
+        The result is kept until a push or cancel changes it
+        """
+
+        if self._found is None:
+            self._found = self._find_slot()
+
+        return self._found
+
+    ##########################################
+    def _find_slot(self) -> tuple:
+        """Search the bitmaps for the next non-empty slot"""
+
+        now, bits, mask = self._now, self._bits, self._mask
+        for level, occupied in enumerate(self._occupied):
+            if not occupied:
+                continue
+
+            shift = bits * level
+            first = (now >> shift) & mask
+            if level:
+                first += 1
+
+            bitmap = occupied >> first
+            if bitmap:
+                slot = first + (bitmap & -bitmap).bit_length() - 1
+                base = now >> (shift + bits) << (shift + bits)
+                return base | (slot << shift), level, slot
+
+        if self._wheel[self._levels][0]:
+            shift = self._bits * self._levels
+            return self._overflow >> shift << shift, self._levels, 0
+
+        return None
+
+    ##########################################
+    def _cascade(self, level: int, slot: int):
+        """Move tasks of slot on a higher level down to lower levels"""
+
+        bucket = self._wheel[level][slot]
+        tasks = list(bucket.values())
+        bucket.clear()
+        if level < self._levels:
+            self._occupied[level] &= ~(1 << slot)
+
+        else:
+            self._overflow = None
+
+        for task in tasks:
+            self._place(task)
+
+    ##########################################
+    def next_deadline(self) -> float:
+        """
+        Return earliest deadline or None. While the next task is on
+        a higher level the time it moves down a level is returned
+        """
+
+        found = self._next_slot()
+        if found is None:
+            return None
+
+        tick, level, _ = found
+        if level:
+            return tick * self._tick
+
+        return (tick + 1) * self._tick
+
+    ##########################################
+    def pop_due(self, now: float) -> list:
+        """Remove and return list of tasks with deadline <= now"""
+
+        due = []
+        target = int(now // self._tick)
+        found = self._next_slot()
+        while found is not None and found[0] <= target:
+            tick, level, slot = found
+            if tick == target and not level:
+                break
+
+            self._now = tick
+            self._found = None
+            if level:
+                self._cascade(level, slot)
+                found = self._next_slot()
+                continue
+
+            bucket = self._wheel[0][slot]
+            due.extend(bucket.values())
+            for task_id in bucket:
+                del self._tasks[task_id]
+            bucket.clear()
+            self._occupied[0] &= ~(1 << slot)
+            found = self._next_slot()
+
+        self._now = max(self._now, target)
+
+        return due
+
+
+TIMERS = {
+    HeapTimers.name: HeapTimers,
+    TimingWheel.name: TimingWheel,
+}
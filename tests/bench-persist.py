@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""Benchmark for persist.py state file formats
+
+Run as a script to print JSON results for comparing state file formats:
+    python tests/bench-persist.py --entries 20000
+Run the checks with:
+    python -m pytest tests/bench-persist.py
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import unittest
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+from service.persist import StatePersistence, FORMATS, msgpack
+from service.states import StateStore
+
+BACKENDS = tuple(name for name in FORMATS if name != "msgpack" or msgpack)
+
+
+##########################################
+def ble_table(entries: int, seed: int = 1) -> dict:
+    """Return BLE scan attributes with entries devices"""
+
+    rand = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    devices = [
+        {
+            "mac": ":".join(f"{rand.randrange(256):02x}" for _ in range(6)),
+            "name": f"device_{num}",
+            "rssi": rand.randint(-100, -30),
+            "tx_power": rand.choice((None, -12, 0, 4)),
+            "connectable": rand.random() > 0.5,
+            "last_seen": start + timedelta(seconds=rand.randrange(86400)),
+        }
+        for num in range(entries)
+    ]
+    return {"ble": {"count": entries, "devices": devices}}
+
+
+##########################################
+def bench_format(file_format: str, entries: int, rounds: int = 5) -> dict:
+    """Return snapshot size and best save and load time of state file format"""
+
+    attribs = StateStore(ble_table(entries))
+    states = StateStore({"ble": entries})
+    with tempfile.TemporaryDirectory() as temp_dir:
+        state_file = os.path.join(temp_dir, "state.json")
+        save_time = load_time = float("inf")
+        for _ in range(rounds):
+            persist = StatePersistence(
+                state_file, journal=False, file_format=file_format
+            )
+            start = time.perf_counter()
+            persist.save(states, attribs, {})
+            save_time = min(save_time, time.perf_counter() - start)
+
+            start = time.perf_counter()
+            data = StatePersistence(state_file, file_format=file_format).load()
+            load_time = min(load_time, time.perf_counter() - start)
+
+        size = os.path.getsize(persist.state_file)
+
+    return {
+        "bytes": size,
+        "save_ms": round(save_time * 1000, 3),
+        "load_ms": round(load_time * 1000, 3),
+        "devices": len(data["attribs"]["ble"]["devices"]),
+    }
+
+
+##########################################
+def run_benchmarks(entries: int) -> dict:
+    """Run benchmark for each state file format"""
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "entries": entries,
+        "results": {name: bench_format(name, entries) for name in BACKENDS},
+    }
+    if "msgpack" in results["results"]:
+        packed = results["results"]["msgpack"]
+        text = results["results"]["json"]
+        results["msgpack_vs_json"] = {
+            "bytes": round(packed["bytes"] / text["bytes"], 3),
+            "load": round(packed["load_ms"] / text["load_ms"], 3),
+        }
+
+    return results
+
+
+##########################################
+class TestFormats(unittest.TestCase):
+    """Round trip and size check for each state file format"""
+
+    def test_round_trip(self):
+        for name in BACKENDS:
+            self.assertEqual(bench_format(name, 500, 1)["devices"], 500)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack_size(self):
+        result = run_benchmarks(2000)
+        self.assertLess(result["msgpack_vs_json"]["bytes"], 0.9)
+
+
+##########################################
+def main():
+    """Parse arguments and print JSON results"""
+
+    parser = argparse.ArgumentParser(description="State file format benchmark")
+    parser.add_argument(
+        "--entries", type=int, default=20000, help="Number of BLE devices"
+    )
+    parser.add_argument("--output", type=str, default=None, help="Write JSON to file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.entries)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as write_file:
+            write_file.write(output)
+
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""Benchmark and soak tests for scheduler.py
+
+Run as a script to print JSON results for comparing scheduler changes:
+    python tests/bench-scheduler.py --timers 10000 --duration 600
+Run the soak tests with:
+    python -m pytest tests/bench-scheduler.py
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import threading
+import unittest
+import tracemalloc
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+# pylint: disable=wrong-import-position
+from service import scheduler as scheduler_module
+from service.scheduler import Scheduler, SchedulerOptions
+from service.states import ThreadSafeDict
+from service.timers import TIMERS
+
+BACKENDS = tuple(TIMERS.keys())
+
+
+##########################################
+class FakeClock:
+    """Clock replacing the time module inside the scheduler"""
+
+    def __init__(self, start: float = 1000.0):
+        self.now = start
+
+    def monotonic(self) -> float:
+        """Return simulated monotonic time"""
+        return self.now
+
+    def time(self) -> float:
+        """Return simulated wall clock time"""
+        return self.now + 1_700_000_000
+
+    def sleep(self, seconds: float):
+        """Advance clock instead of sleeping"""
+        self.now += seconds
+
+
+##########################################
+def new_scheduler(timers: str) -> Scheduler:
+    """Return scheduler without maintenance task"""
+
+    running = threading.Event()
+    running.set()
+    return Scheduler(ThreadSafeDict(), running, False, SchedulerOptions(timers=timers))
+
+
+##########################################
+def noop():
+    """Task doing nothing"""
+
+
+##########################################
+def bench_dispatch(timers: str, count: int) -> dict:
+    """Measure queue, cancel and run cost per task in real time"""
+
+    sched = new_scheduler(timers)
+    start = time.perf_counter()
+    ids = [sched.queue(noop, 3600, True) for _ in range(count)]
+    queue_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _id in ids:
+        sched.reschedule(_id, 1800)
+    reschedule_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _id in ids:
+        sched.cancel(_id)
+    cancel_time = time.perf_counter() - start
+
+    clock = FakeClock()
+    with mock.patch.object(scheduler_module, "time", clock):
+        sched = new_scheduler(timers)
+        for _ in range(count):
+            sched.run(noop)
+
+        sched.state_running()
+        clock.sleep(1)
+        start = time.perf_counter()
+        sched._promote_ready()  # pylint: disable=protected-access
+        sched._dispatch()  # pylint: disable=protected-access
+        run_time = time.perf_counter() - start
+
+    return {
+        "queue_us": round(queue_time / count * 1e6, 3),
+        "reschedule_us": round(reschedule_time / count * 1e6, 3),
+        "cancel_us": round(cancel_time / count * 1e6, 3),
+        "dispatch_us": round(run_time / count * 1e6, 3),
+    }
+
+
+##########################################
+def simulate(  # pylint: disable=too-many-locals
+    timers: str,
+    count: int,
+    duration: float,
+    cost: float = 0.0005,
+    seed: int = 1,
+) -> dict:
+    """
+    Run count periodic timers for duration simulated seconds.
+    Each run costs cost simulated seconds to model load.
+    Return lateness, runs, real time and memory growth
+    over the second half of the run
+    """
+
+    clock = FakeClock()
+    rand = random.Random(seed)
+    runs = [0]
+
+    def work():
+        runs[0] += 1
+        clock.sleep(cost)
+
+    with mock.patch.object(scheduler_module, "time", clock):
+        sched = new_scheduler(timers)
+        for _ in range(count):
+            sched.queue(work, rand.uniform(1, 60), True)
+
+        sched.state_running()
+        end = clock.now + duration
+        warmup = clock.now + duration / 2
+        tracemalloc.start()
+        baseline = None
+        wakeups = 0
+        start = time.perf_counter()
+        while clock.now < end:
+            if baseline is None and clock.now >= warmup:
+                baseline = tracemalloc.get_traced_memory()[0]
+
+            sched._promote_ready()  # pylint: disable=protected-access
+            sched._dispatch()  # pylint: disable=protected-access
+            wakeups += 1
+            clock.sleep(max(sched._next_wait(), 0.001))  # pylint: disable=protected-access
+
+        real = time.perf_counter() - start
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    lateness = sched.metrics.snapshot()["tasks"]["work"]["lateness"]
+    return {
+        "runs": runs[0],
+        "wakeups": wakeups,
+        "real_seconds": round(real, 3),
+        "run_us": round(real / max(runs[0], 1) * 1e6, 3),
+        "lateness_ms": lateness,
+        "memory_growth_bytes": current - (baseline or current),
+        "sleeping": len(sched.sleeping),
+    }
+
+
+##########################################
+def run_benchmarks(count: int, duration: float, cost: float) -> dict:
+    """Run all benchmarks for each timer backend"""
+
+    results = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "timers": count,
+        "duration": duration,
+        "cost": cost,
+        "results": {},
+    }
+    for timers in BACKENDS:
+        results["results"][timers] = {
+            "dispatch": bench_dispatch(timers, count),
+            "simulate": simulate(timers, count, duration, cost),
+        }
+
+    return results
+
+
+##########################################
+class TestSoak(unittest.TestCase):
+    """Shortened soak run checking accuracy and memory growth"""
+
+    def test_soak(self):
+        for timers in BACKENDS:
+            result = simulate(timers, 1000, 600, cost=0)
+            self.assertEqual(result["sleeping"], 1000)
+            self.assertGreater(result["runs"], 15000)
+            self.assertLessEqual(result["lateness_ms"]["max"], 110.0)
+            self.assertLess(result["memory_growth_bytes"], 256 * 1024)
+
+    def test_dispatch(self):
+        for timers in BACKENDS:
+            result = bench_dispatch(timers, 1000)
+            self.assertLess(result["queue_us"], 1000)
+            self.assertLess(result["dispatch_us"], 1000)
+
+
+##########################################
+def main():
+    """Parse arguments and print JSON results"""
+
+    parser = argparse.ArgumentParser(description="Scheduler benchmark")
+    parser.add_argument("--timers", type=int, default=10000, help="Number of timers")
+    parser.add_argument(
+        "--duration", type=float, default=600, help="Simulated seconds"
+    )
+    parser.add_argument(
+        "--cost", type=float, default=0.0005, help="Simulated seconds per run"
+    )
+    parser.add_argument("--output", type=str, default=None, help="Write JSON to file")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.timers, args.duration, args.cost)
+    output = json.dumps(results, indent=4)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as write_file:
+            write_file.write(output)
+
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
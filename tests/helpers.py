@@ -0,0 +1,26 @@
+"""Shared fixtures for the unit tests"""
+
+from config import Config, ATTRIB_MAP
+
+
+def new_config(**sensors) -> Config:
+    """Return minimal agent config. Keyword arguments update the sensors section"""
+
+    return Config(
+        {
+            "hostname": "host",
+            "prefix": {"discover": "homeassistant"},
+            "device": {
+                "identifiers": "abc",
+                "topic": "devices/host",
+                "availability": "devices/host/status",
+            },
+            "sensors": {
+                "type": {"battery_plugged_in": "binary_sensor", "screen": "camera"},
+                "attrib": ATTRIB_MAP,
+                "sensor_class": {},
+                "icons": {},
+                **sensors,
+            },
+        }
+    )
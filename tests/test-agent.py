@@ -0,0 +1,122 @@
+"""UnitTests for agent.py"""
+
+import types
+import unittest
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+from helpers import new_config
+from service.agent import HomeAgent
+from service.router import TopicRouter
+from service.scheduler import Scheduler
+from service.states import ThreadSafeDict
+from service.filters import PublishPolicy
+from service.serializer import get_serializer
+from service.const import LAST, TOPIC, PAYLOAD, GET, QUEUED
+
+
+SUBS = ["homeassistant/status", "devices/host/event", "devices/host/status"]
+
+
+class TestAgentEvents(unittest.TestCase):
+    def setUp(self):
+        # pylint: disable=protected-access
+        self.sent = []
+        self.forced = []
+        self.result = True
+        running = threading.Event()
+        running.set()
+        self.agent = types.SimpleNamespace(
+            _config=new_config(),
+            _stats={LAST: {}},
+            _ha_connected=True,
+            _router=TopicRouter(),
+            _commands=ThreadPoolExecutor(max_workers=1),
+            _setup_sensors=lambda force=False: self.forced.append(force),
+            _setup_device_tracker=lambda: None,
+            _serializer=get_serializer(),
+            _sched=Scheduler(ThreadSafeDict(), running, False),
+            _history=types.SimpleNamespace(summary=dict),
+            _connector=types.SimpleNamespace(stats=dict),
+            _policy=PublishPolicy(),
+            _discovery={},
+            _callback={},
+            _registry=types.SimpleNamespace(get=self.meta),
+            message_send=lambda data, **_: self.sent.append(data) or self.result,
+        )
+        for name in ("_run_cmd", "_cmd_event", "_cmd_ha_status"):
+            method = types.MethodType(getattr(HomeAgent, name), self.agent)
+            setattr(self.agent, name, method)
+        for topic in SUBS:
+            HomeAgent._add_event_route(self.agent, topic)
+
+    def meta(self, sensor):
+        return types.SimpleNamespace(
+            name=sensor,
+            hash="abc",
+            config_topic=f"homeassistant/sensor/{sensor}/config",
+            state_topic=f"devices/host/{sensor}/state",
+            payload={},
+            discovery=lambda: {TOPIC: "config", PAYLOAD: "{}"},
+        )
+
+    def tearDown(self):
+        self.agent._commands.shutdown()  # pylint: disable=protected-access
+
+    def receive(self, topic, payload):
+        # pylint: disable=protected-access
+        HomeAgent.process_cmd(self.agent, {TOPIC: topic, PAYLOAD: payload})
+        self.agent._commands.submit(int).result()
+        self.agent._sched.start()
+
+    def test_ha_birth(self):
+        self.receive("homeassistant/status", '{"ping":"request","src":"host"}')
+        self.receive("devices/host/status", "online")
+        self.assertEqual(self.forced, [])
+
+        self.receive("homeassistant/status", "online")
+        self.assertEqual(self.forced, [True])
+        self.receive("homeassistant/status", "offline")
+        self.receive("homeassistant/status", "online")
+        self.assertEqual(self.forced, [True, True])
+
+    def test_inline_commands(self):
+        # pylint: disable=protected-access
+        threads = []
+        self.agent._router.add("devices/host/set", lambda payload: 1 / payload)
+        self.agent._router.add(
+            "devices/host/slow", lambda _: threads.append(threading.current_thread())
+        )
+        self.receive("devices/host/set", 0)
+        self.receive("devices/host/slow", "")
+        self.assertIsNot(threads[0], threading.current_thread())
+        self.assertEqual(self.agent._sched.sleeping.tasks(), [])
+
+    def test_get_snapshot(self):
+        HomeAgent._cmd_event(self.agent, GET)  # pylint: disable=protected-access
+        payload = self.sent[0][PAYLOAD]
+        self.assertEqual(self.sent[0][TOPIC], "devices/host/status")
+        self.assertIsInstance(payload, str)
+
+        self.agent._stats[LAST]["collector"] = 1  # pylint: disable=protected-access
+        self.assertEqual(payload, self.sent[0][PAYLOAD])
+        self.assertNotIn("collector", get_serializer().loads(payload)[LAST])
+
+    def test_queued(self):
+        # pylint: disable=protected-access
+        self.result = QUEUED
+        self.assertIsNotNone(HomeAgent._setup_sensor(self.agent, "cpu"))
+        self.assertEqual(self.agent._discovery["cpu"], QUEUED)
+        HomeAgent._publish_online(self.agent)
+        self.assertFalse(self.agent._ha_connected)
+
+        self.result = True
+        HomeAgent._setup_sensor(self.agent, "cpu")
+        self.assertEqual(self.agent._discovery["cpu"], "abc")
+        HomeAgent._setup_sensor(self.agent, "cpu")
+        self.assertEqual(len(self.sent), 3)
+
+
+if __name__ == "__main__":
+    unittest.main()
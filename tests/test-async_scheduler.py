@@ -0,0 +1,53 @@
+"""UnitTests for async_scheduler.py"""
+
+import time
+import asyncio
+import unittest
+import threading
+
+
+from service.async_scheduler import AsyncScheduler
+from service.states import ThreadSafeDict
+
+
+class TestAsyncScheduler(unittest.TestCase):
+    def test_scheduler(self):
+        self.result = []
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = AsyncScheduler(state, running, False)
+        sched.run(self.blocking_func)
+        sched.run(self.async_func, "async")
+        sched.start()
+        self.assertEqual(sorted(self.result), ["async", "blocking"])
+
+    def test_timeout_abandon(self):
+        self.result = []
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = AsyncScheduler(state, running, False)
+        sched.run(self.hung_func, timeout=1, abandon=True)
+        sched.queue(self.async_func, 2, False, "async")
+        start = time.monotonic()
+        sched.start()
+        self.assertEqual(self.result, ["async"])
+        self.assertLess(time.monotonic() - start, 5)
+        self.assertEqual(state["scheduler"]["overruns"], 1)
+
+    def blocking_func(self):
+        time.sleep(0.1)
+        self.result.append("blocking")
+
+    async def async_func(self, value):
+        await asyncio.sleep(0.1)
+        self.result.append(value)
+
+    async def hung_func(self):
+        await asyncio.sleep(10)
+        self.result.append("hung")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,93 @@
+"""UnitTests for filters.py"""
+
+import unittest
+
+
+from service.filters import PublishFilter, PublishPolicy
+
+
+FILTER_TEMP = {"deadband": 1, "ema": 0.5, "max_age": 900}
+
+
+class TestPublishFilter(unittest.TestCase):
+    def test_resolve(self):
+        _filter = PublishFilter({"disk_": {"deadband": 1}, "disk_root": {"deadband": 5}})
+        self.assertEqual(_filter.get("disk_root"), {"deadband": 5})
+        self.assertEqual(_filter.get("disk_home"), {"deadband": 1})
+        self.assertIsNone(_filter.get("load"))
+        self.assertTrue(_filter.check("load", 1.1, 1.0, 0))
+        self.assertFalse(_filter.check("load", 1.0, 1.0, 0))
+
+    def test_resolve_substring(self):
+        _filter = PublishFilter(
+            {"temp_": FILTER_TEMP, "coretemp": FILTER_TEMP, "load": {"deadband": 1}}
+        )
+        self.assertEqual(_filter.get("cpu_thermal_temp_0"), FILTER_TEMP)
+        self.assertEqual(_filter.get("coretemp_package_id_0"), FILTER_TEMP)
+        self.assertIsNone(_filter.get("wifi_signal"))
+
+    def test_deadband(self):
+        _filter = PublishFilter(
+            {"cpu": {"deadband": 2}, "load": {"deadband_pct": 10}}
+        )
+        self.assertFalse(_filter.check("cpu", 51, 50, 0))
+        self.assertTrue(_filter.check("cpu", 53, 50, 0))
+        self.assertFalse(_filter.check("load", 2.1, 2.0, 0))
+        self.assertTrue(_filter.check("load", 2.3, 2.0, 0))
+        self.assertTrue(_filter.check("cpu", "high", 50, 0))
+
+    def test_rate_limit_and_max_age(self):
+        _filter = PublishFilter({"net": {"min_interval": 60, "max_age": 300}})
+        _filter.published("net", 1000)
+        self.assertFalse(_filter.check("net", 2, 1, 1010))
+        self.assertEqual(_filter.due(1010), ["net"])
+        self.assertTrue(_filter.check("net", 2, 1, 1060))
+        _filter.published("net", 1060)
+        self.assertEqual(_filter.due(1100), [])
+        self.assertEqual(_filter.due(1360), ["net"])
+        self.assertTrue(_filter.check("net", 2, 2, 1360))
+
+    def test_ema(self):
+        _filter = PublishFilter({"temp": {"ema": 0.5, "deadband": 0.5}})
+        self.assertEqual(_filter.smooth("temp", 40), 40)
+        self.assertEqual(_filter.smooth("temp", 50), 45)
+        self.assertEqual(_filter.smooth("temp", 50), 47.5)
+        self.assertEqual(_filter.smooth("temp", 50), 48.75)
+        self.assertEqual(_filter.smooth("temp", 50), 49.375)
+        self.assertEqual(_filter.smooth("temp", 50), 49.688)
+        self.assertEqual(_filter.due(0), [])
+        self.assertEqual(_filter.smooth("temp", "n/a"), "n/a")
+
+        states = {"cpu_temp": 60, "load": 1.0}
+        self.assertEqual(_filter.smoothed("cpu_temp", 60), 60)
+        _filter.sample(states)
+        _filter.sample({"cpu_temp": 70})
+        self.assertEqual(states, {"cpu_temp": 60, "load": 1.0})
+        self.assertEqual(_filter.smoothed("cpu_temp", 70), 65)
+        self.assertEqual(_filter.smoothed("load", 1.0), 1.0)
+        _filter = PublishFilter({"load": {"deadband": 1}})
+        _filter.sample(states)
+        self.assertEqual(_filter.smoothed("load", 2.0), 2.0)
+
+
+class TestPublishPolicy(unittest.TestCase):
+    def test_policy(self):
+        policy = PublishPolicy(
+            {
+                "types": {
+                    "sensor": {"qos": 0},
+                    "discovery": {"qos": 1, "retain": True},
+                },
+                "sensors": {"battery_": {"retain": True}, "battery_level": {"qos": 2}},
+            }
+        )
+        self.assertEqual(policy.get("processor_percent", "sensor"), (0, False))
+        self.assertEqual(policy.get("battery_percent", "sensor"), (1, True))
+        self.assertEqual(policy.get("ups_battery_charge", "sensor"), (1, True))
+        self.assertEqual(policy.get("battery_level", "sensor"), (2, False))
+        self.assertEqual(policy.get("lid", "binary_sensor"), (1, False))
+        self.assertEqual(policy.get(sensor_type="discovery"), (1, True))
+
+
+if __name__ == "__main__":
+    unittest.main()
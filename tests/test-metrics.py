@@ -0,0 +1,43 @@
+"""UnitTests for metrics.py"""
+
+import unittest
+
+
+from service.metrics import Histogram, SchedulerMetrics
+
+
+class TestMetrics(unittest.TestCase):
+    def test_histogram(self):
+        hist = Histogram()
+        for num in range(1, 101):
+            hist.record(num / 1000)
+
+        data = hist.to_dict()
+        self.assertEqual(data["count"], 100)
+        self.assertEqual(data["min"], 1.0)
+        self.assertEqual(data["max"], 100.0)
+        self.assertEqual(data["last"], 100.0)
+        self.assertEqual(data["p50"], 50.0)
+        self.assertEqual(data["p90"], 90.0)
+        self.assertEqual(data["p99"], 99.0)
+
+        hist = Histogram()
+        hist.record(0.4)
+        self.assertEqual(hist.to_dict()["p50"], 400.0)
+
+    def test_scheduler_metrics(self):
+        metrics = SchedulerMetrics()
+        metrics.record_run("collector", 0.5, 0.01)
+        metrics.record_run("collector", 1.5, 0.2)
+        metrics.record_depth(2, 10)
+        metrics.record_depth(0, 8)
+        data = metrics.snapshot()
+        self.assertEqual(data["tasks"]["collector"]["runtime"]["count"], 2)
+        self.assertEqual(data["ready"], 0)
+        self.assertEqual(data["ready_max"], 2)
+        self.assertEqual(data["sleeping_max"], 10)
+        self.assertEqual(metrics.worst(), 185.6)
+
+
+if __name__ == "__main__":
+    unittest.main()
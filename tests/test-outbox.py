@@ -0,0 +1,80 @@
+"""UnitTests for outbox.py"""
+
+import os
+import time
+import tempfile
+import unittest
+import threading
+
+
+from service.outbox import Outbox
+
+
+class TestOutbox(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.file_name = os.path.join(self._dir.name, "outbox.json")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_coalesce_and_bound(self):
+        outbox = Outbox(max_messages=2, rate=0)
+        self.assertTrue(outbox.put("a/state", "1"))
+        self.assertTrue(outbox.put("b/state", "1"))
+        self.assertTrue(outbox.put("a/state", "2"))
+        self.assertEqual(len(outbox), 2)
+        self.assertTrue(outbox.put("c/state", "1"))
+        self.assertEqual(outbox.dropped, 1)
+        self.assertFalse(outbox.put("camera", b"\x00"))
+
+        sent = []
+        outbox.drain(lambda *msg: sent.append(msg) or True, lambda: True)
+        outbox._thread.join(5)  # pylint: disable=protected-access
+        self.assertEqual(sent, [("a/state", "2", 0, False), ("c/state", "1", 0, False)])
+        self.assertEqual(len(outbox), 0)
+
+    def test_persist(self):
+        outbox = Outbox(self.file_name, flush=0)
+        outbox.put("a/state", "on", 1, True)
+        outbox.put("b/state", "off")
+        outbox.discard("b/state")
+        outbox.save(True)
+
+        outbox = Outbox(self.file_name, rate=0)
+        self.assertEqual(len(outbox), 1)
+        outbox.drain(lambda *msg: False, lambda: True)
+        outbox._thread.join(5)  # pylint: disable=protected-access
+        self.assertEqual(len(outbox), 1)
+
+        outbox.drain(lambda *msg: True, lambda: True)
+        outbox._thread.join(5)  # pylint: disable=protected-access
+        self.assertFalse(os.path.exists(self.file_name))
+
+    def test_drain_order(self):
+        outbox = Outbox(rate=0)
+        outbox.put("a/state", "old")
+        sent = []
+
+        def pub(topic, payload):
+            outbox.discard(topic)
+            sent.append((topic, payload))
+
+        def publish(topic, payload, *_):
+            newer = threading.Thread(target=pub, args=(topic, "new"))
+            newer.start()
+            newer.join(0.1)
+            sent.append((topic, payload))
+            return True
+
+        outbox.drain(publish, lambda: True)
+        outbox._thread.join(5)  # pylint: disable=protected-access
+        for _ in range(100):
+            if len(sent) == 2:
+                break
+            time.sleep(0.01)
+        self.assertEqual(sent, [("a/state", "old"), ("a/state", "new")])
+
+
+if __name__ == "__main__":
+    unittest.main()
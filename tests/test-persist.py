@@ -0,0 +1,110 @@
+"""UnitTests for persist.py"""
+
+import os
+import tempfile
+import unittest
+from datetime import datetime
+
+
+from service.persist import StatePersistence, msgpack
+from service.states import StateStore
+
+
+class TestPersist(unittest.TestCase):
+    def setUp(self):
+        self._dir = tempfile.TemporaryDirectory()
+        self.state_file = os.path.join(self._dir.name, "state.json")
+
+    def tearDown(self):
+        self._dir.cleanup()
+
+    def test_journal(self):
+        persist = StatePersistence(self.state_file, compact=10)
+        states = StateStore({"cpu": 10, "memory": 50, "screen_capture": "data"})
+        attribs = StateStore({"cpu": {"cores": 4}})
+        device = {"name": "host"}
+
+        self.assertTrue(persist.save(states, attribs, device))
+        self.assertFalse(os.path.exists(persist.journal_file))
+        self.assertFalse(persist.save(states, attribs, device))
+
+        states.set("cpu", 20)
+        states.pop("memory")
+        self.assertTrue(persist.save(states, attribs, device))
+        with open(persist.journal_file, "r", encoding="utf-8") as read_file:
+            self.assertEqual(len(read_file.readlines()), 1)
+
+        data = StatePersistence(self.state_file).load()
+        self.assertEqual(data["state"], {"cpu": 20})
+        self.assertEqual(data["attribs"], {"cpu": {"cores": 4}})
+        self.assertEqual(data["device"], device)
+
+    def test_compact(self):
+        persist = StatePersistence(self.state_file, compact=3)
+        states = StateStore()
+        attribs = StateStore()
+        for num in range(6):
+            states.set("cpu", num)
+            persist.save(states, attribs, {})
+
+        with open(persist.journal_file, "r", encoding="utf-8") as read_file:
+            self.assertEqual(len(read_file.readlines()), 1)
+
+        self.assertEqual(StatePersistence(self.state_file).load()["state"]["cpu"], 5)
+
+    def test_stale_and_torn_journal(self):
+        persist = StatePersistence(self.state_file)
+        states = StateStore({"cpu": 1})
+        attribs = StateStore()
+        persist.save(states, attribs, {})
+        states.set("cpu", 2)
+        persist.save(states, attribs, {})
+
+        with open(persist.journal_file, "a", encoding="utf-8") as write_file:
+            write_file.write('{"generation": 99, "state": {"cpu": 3}}\n{"generation"')
+
+        self.assertEqual(StatePersistence(self.state_file).load()["state"]["cpu"], 2)
+
+    def test_failed_snapshot(self):
+        # pylint: disable=protected-access
+        persist = StatePersistence(self.state_file, journal=False)
+        states = StateStore({"cpu": 1})
+        attribs = StateStore()
+        persist.save(states, attribs, {})
+        generation = persist._generation
+
+        states.set("cpu", 2)
+        persist.state_file = os.path.join(self._dir.name, "missing", "state.json")
+        with self.assertRaises(OSError):
+            persist.save(states, attribs, {})
+        self.assertEqual(persist._generation, generation)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_msgpack(self):
+        persist = StatePersistence(self.state_file, file_format="msgpack")
+        self.assertTrue(persist.state_file.endswith(".msgpack"))
+        now = datetime.now()
+        states = StateStore({"boot": now, "raw": b"\x00\x01", "pos": (1.5, 2.5)})
+        attribs = StateStore({"ble": {"devices": [{"mac": "aa", "rssi": -60}]}})
+        persist.save(states, attribs, {})
+        states.set("tags", {"a"})
+        persist.save(states, attribs, {})
+
+        data = StatePersistence(self.state_file, file_format="msgpack").load()
+        self.assertEqual(data["state"]["boot"], now)
+        self.assertEqual(data["state"]["raw"], b"\x00\x01")
+        self.assertEqual(data["state"]["pos"], (1.5, 2.5))
+        self.assertEqual(data["state"]["tags"], {"a"})
+        self.assertEqual(data["attribs"]["ble"]["devices"][0]["rssi"], -60)
+
+    @unittest.skipIf(msgpack is None, "msgpack is not installed")
+    def test_migrate(self):
+        persist = StatePersistence(self.state_file)
+        persist.save(StateStore({"cpu": 10}), StateStore(), {})
+
+        data = StatePersistence(self.state_file, file_format="msgpack").load()
+        self.assertEqual(data["state"], {"cpu": 10})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,108 @@
+"""UnitTests for pipeline.py"""
+
+import time
+import threading
+import unittest
+from collections import namedtuple
+
+
+from service.pipeline import PublishPipeline
+from service.scheduler import PRIORITY_HIGH, PRIORITY_LOW
+
+Info = namedtuple("Info", "rc mid")
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.sent = []
+        self.mid = 0
+        self.lock = threading.Lock()
+
+    def publish(self, topic, payload, qos, retain):  # pylint: disable=unused-argument
+        with self.lock:
+            self.mid += 1
+            self.sent.append((topic, payload))
+            return Info(0, self.mid)
+
+    def wait_sent(self, count):
+        for _ in range(200):
+            if len(self.sent) >= count:
+                return
+            time.sleep(0.01)
+
+    def test_priority_drop_and_coalesce(self):
+        pipeline = PublishPipeline(self.publish, size=2)
+        self.assertTrue(pipeline.put("cpu/state", {"state": 1}, 0, priority=PRIORITY_LOW))
+        self.assertTrue(pipeline.put("cpu/state", {"state": 2}, 0, priority=PRIORITY_LOW))
+        self.assertTrue(pipeline.put("status", "online", 0, priority=PRIORITY_HIGH))
+        self.assertTrue(pipeline.put("ping", "ping", 0, priority=PRIORITY_HIGH))
+        self.assertFalse(pipeline.put("load/state", "1", 0, priority=PRIORITY_LOW))
+
+        pipeline.start()
+        self.wait_sent(2)
+        pipeline.stop()
+        self.assertEqual(self.sent, [("status", "online"), ("ping", "ping")])
+        stats = pipeline.stats()
+        self.assertEqual(stats["coalesced"], 1)
+        self.assertEqual(stats["dropped"], 2)
+        self.assertEqual(stats["sent"], 2)
+
+    def test_inflight_window(self):
+        pipeline = PublishPipeline(self.publish, inflight=2)
+        for num in range(4):
+            pipeline.put(f"sensor{num}", {"state": num}, 1)
+
+        pipeline.start()
+        self.wait_sent(2)
+        time.sleep(0.05)
+        self.assertEqual(len(self.sent), 2)
+        self.assertEqual(self.sent[0], ("sensor0", '{"state":0}'))
+        pipeline.acked(1)
+        pipeline.acked(2)
+        self.wait_sent(4)
+        pipeline.acked(3)
+        pipeline.stop()
+        stats = pipeline.stats()
+        self.assertEqual(stats["sent"], 4)
+        self.assertEqual(stats["acked"], 3)
+        self.assertEqual(stats["inflight"], 1)
+
+    def test_early_ack(self):
+        pipeline = PublishPipeline(None)
+
+        def publish(*msg):
+            info = self.publish(*msg)
+            pipeline.acked(info.mid)
+            return info
+
+        pipeline._publish = publish  # pylint: disable=protected-access
+        pipeline.acked(5)
+        pipeline.put("cpu/state", {"state": 1}, 1)
+        pipeline.put("load/state", {"state": 1}, 0)
+        pipeline.start()
+        self.wait_sent(2)
+        pipeline.stop()
+        stats = pipeline.stats()
+        self.assertEqual(stats["acked"], 1)
+        self.assertEqual(stats["inflight"], 0)
+        self.assertEqual(pipeline._early, set())  # pylint: disable=protected-access
+
+    def test_fallback(self):
+        kept = []
+        pipeline = PublishPipeline(
+            lambda *msg: Info(4, 0), fallback=lambda *msg: kept.append(msg)
+        )
+        pipeline.put("cpu/state", {"state": 1}, 1, True)
+        pipeline.start()
+        for _ in range(200):
+            if kept:
+                break
+            time.sleep(0.01)
+        pipeline.put("load/state", "1", 0)
+        pipeline.stop()
+        self.assertEqual(kept[0], ("cpu/state", '{"state":1}', 1, True))
+        self.assertEqual(len(kept), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
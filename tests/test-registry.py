@@ -0,0 +1,65 @@
+"""UnitTests for device/registry.py"""
+
+import unittest
+
+
+from helpers import new_config
+from device.registry import PrefixMatcher, SensorRegistry
+
+PREFIXES = {
+    "prefix": ["disk_", "network_w", "temp"],
+    "prefix_class": {"disk_": {"unit_of_measurement": "%"}, "temp": {}},
+    "prefix_icons": {"disk_": "harddisk", "network_": "network"},
+    "type": {},
+}
+
+
+class TestPrefixMatcher(unittest.TestCase):
+    def test_first(self):
+        patterns = ["disk_", "network_w", "temp", "coretemp", "emp_"]
+        matcher = PrefixMatcher(patterns)
+        for text in ["disk_root", "coretemp_0", "acpitz_temp", "load", "network_wlan0"]:
+            expected = next((item for item in patterns if item in text), None)
+            self.assertEqual(matcher.first(text), expected, text)
+
+        self.assertIsNone(PrefixMatcher([]).first("disk_root"))
+
+
+class TestSensorRegistry(unittest.TestCase):
+    def test_add(self):
+        config = new_config(**PREFIXES)
+        registry = SensorRegistry(config)
+        added = registry.add(["disk_root", "load", "network_wlan0", "coretemp_0"])
+        self.assertEqual(added, ["disk_root", "network_wlan0", "coretemp_0"])
+        self.assertEqual(registry.add(["disk_root", "disk_home"]), ["disk_home"])
+        self.assertEqual(config.sensors.icons["network_wlan0"], "network")
+        self.assertEqual(
+            config.sensors.sensor_class.get("disk_root"), {"unit_of_measurement": "%"}
+        )
+
+        registry.discard("disk_root")
+        self.assertEqual(registry.add(["disk_root"]), ["disk_root"])
+
+        registry.prune(["load", "disk_home"])
+        self.assertNotIn("load", registry._seen)  # pylint: disable=protected-access
+        self.assertEqual(registry.add(["load", "disk_home"]), ["disk_home"])
+
+    def test_get(self):
+        registry = SensorRegistry(new_config(**PREFIXES))
+        registry.add(["disk_root"])
+        meta = registry.get("disk_root")
+        self.assertIs(meta, registry.get("disk_root"))
+        self.assertEqual(meta.name, "Disk Root")
+        self.assertEqual(meta.sensor_type, "sensor")
+        self.assertEqual(meta.state_topic, "homeassistant/sensor/host_disk_root/state")
+        self.assertEqual(meta.attrib_topic, "homeassistant/sensor/host_disk_root/attrib")
+        self.assertEqual(meta.payload["icon"], "mdi:harddisk")
+        self.assertEqual(meta.discovery()["topic"], meta.config_topic)
+
+        registry.invalidate()
+        self.assertIsNot(meta, registry.get("disk_root"))
+        self.assertEqual(meta.hash, registry.get("disk_root").hash)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,57 @@
+"""UnitTests for router.py"""
+
+import types
+import unittest
+import threading
+
+
+from service.agent import HomeAgent
+from service.router import TopicRouter
+from service.scheduler import Scheduler, SchedulerOptions
+from service.states import ThreadSafeDict
+from service.const import SCHEDULER, TASKS, TOPIC, PAYLOAD
+
+
+class TestTopicRouter(unittest.TestCase):
+    def test_exact_and_wildcard(self):
+        router = TopicRouter()
+        router.add("homeassistant/switch/host_relay_1/set", "set", "relay_1")
+        router.add("devices/+/event", "event")
+        router.add("devices/host/#", "device")
+        self.assertEqual(
+            router.match("homeassistant/switch/host_relay_1/set"), ("set", ("relay_1",))
+        )
+        self.assertEqual(router.match("devices/other/event"), ("event", ()))
+        self.assertEqual(router.match("devices/host/reboot"), ("device", ()))
+        self.assertEqual(router.match("devices/host"), ("device", ()))
+        self.assertIsNone(router.match("devices/other/event/extra"))
+        self.assertIsNone(router.match("homeassistant/status"))
+
+        router.remove("devices/host/#")
+        self.assertIsNone(router.match("devices/host/reboot"))
+        self.assertEqual(len(router), 2)
+
+    def test_dispatch_leaves_no_state(self):
+        # pylint: disable=protected-access
+        self.result = []
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        agent = types.SimpleNamespace(
+            _router=TopicRouter(),
+            _sched=Scheduler(state, running, False, SchedulerOptions(workers=1)),
+        )
+        agent._run_cmd = types.MethodType(HomeAgent._run_cmd, agent)
+        agent._router.add("devices/host/set", self.result.append)
+        for num in range(100):
+            HomeAgent.process_cmd(agent, {TOPIC: "devices/host/set", PAYLOAD: num})
+        HomeAgent.process_cmd(agent, {TOPIC: "devices/other/set", PAYLOAD: 0})
+
+        agent._sched.start()
+        self.assertEqual(self.result, list(range(100)))
+        agent._sched._sched_maint()
+        self.assertEqual(state[SCHEDULER][TASKS], {})
+
+
+if __name__ == "__main__":
+    unittest.main()
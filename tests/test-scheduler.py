@@ -1,11 +1,21 @@
 """UnitTests for scheduler.py"""
 
+import time
 import unittest
 import threading
 
 
-from service.scheduler import Scheduler
+from service.scheduler import (
+    Scheduler,
+    SchedulerOptions,
+    ReadyQueue,
+    PRIORITY_HIGH,
+    PRIORITY_NORMAL,
+    PRIORITY_LOW,
+    task_key,
+)
 from service.states import ThreadSafeDict
+from service.const import SCHEDULER, TASKS
 
 
 class TestScheduler(unittest.TestCase):
@@ -22,6 +32,215 @@ class TestScheduler(unittest.TestCase):
     def test_func(self):
         self.result = True
 
+    def test_worker_pool(self):
+        self.result = False
+        self.running = 0
+        self.max_running = 0
+        self.lock = threading.Lock()
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = Scheduler(state, running, False, SchedulerOptions(workers=4))
+        sched.run(self.slow_func)
+        sched.run(self.slow_func)
+        sched.run(self.test_func)
+        sched.start()
+        self.assertEqual(self.result, True)
+        self.assertEqual(self.max_running, 1)
+
+    def test_catch_up(self):
+        state = ThreadSafeDict()
+        running = threading.Event()
+        sched = Scheduler(state, running, False)
+        self.assertEqual(sched._next_deadline(100, 102, 10, None), (112, True))
+        self.assertEqual(sched._next_deadline(100, 102, 10, "skip"), (110, True))
+        self.assertEqual(sched._next_deadline(100, 125, 10, "skip"), (130, False))
+        self.assertEqual(sched._next_deadline(100, 125, 10, "coalesce"), (130, True))
+        self.assertEqual(sched._next_deadline(100, 125, 10, "burst"), (110, True))
+
+    def test_cancel_reschedule(self):
+        for timers in ["heap", "wheel"]:
+            self.result = False
+            state = ThreadSafeDict()
+            running = threading.Event()
+            running.set()
+            sched = Scheduler(state, running, False, SchedulerOptions(timers=timers))
+            _id = sched.queue(self.test_func, 60, True)
+            self.assertTrue(sched.reschedule(_id, 0))
+            sched.queue(sched.cancel, 0, False, _id)
+            sched.start()
+            self.assertEqual(self.result, True)
+            self.assertFalse(sched.cancel(_id))
+
+    def test_timeout_abandon(self):
+        for workers in [0, 2]:
+            self.result = False
+            state = ThreadSafeDict()
+            running = threading.Event()
+            running.set()
+            sched = Scheduler(state, running, False, SchedulerOptions(workers=workers))
+            _id = sched.run(self.hung_func, timeout=1, abandon=True)
+            sched.queue(self.test_func, 2)
+            start = time.monotonic()
+            sched.start()
+            self.assertEqual(self.result, True)
+            self.assertLess(time.monotonic() - start, 5)
+            self.assertEqual(state["scheduler"]["overruns"], 1)
+            self.assertEqual(state["scheduler"]["tasks"][_id]["overruns"], 1)
+
+    def test_watchdog_restart(self):
+        # pylint: disable=protected-access
+        running = threading.Event()
+        running.set()
+        sched = Scheduler(ThreadSafeDict(), running, False)
+        sched.state_running()
+        sched._start_watchdog()
+        watchdog = sched._watchdog
+        sched.state_running(False)
+        sched.state_running()
+        sched._start_watchdog()
+        time.sleep(1.5)
+        self.assertIs(sched._watchdog, watchdog)
+        self.assertTrue(watchdog.is_alive())
+
+        sched.state_running(False)
+        time.sleep(1.5)
+        self.assertIsNone(sched._watchdog)
+        sched.state_running()
+        sched._start_watchdog()
+        self.assertTrue(sched._watchdog.is_alive())
+        sched.state_running(False)
+
+    def test_phase(self):
+        state = ThreadSafeDict()
+        running = threading.Event()
+        options = SchedulerOptions(spread=0.5, jitter=2, seed="host1")
+        sched = Scheduler(state, running, False, options)
+        phase = sched._phase("collector", 30)
+        self.assertGreaterEqual(phase, 0)
+        self.assertLess(phase, 17)
+        self.assertEqual(phase, sched._phase("collector", 30))
+        self.assertNotEqual(phase, sched._phase("events", 30))
+        other = Scheduler(state, running, False, options._replace(seed="host2"))
+        self.assertNotEqual(phase, other._phase("collector", 30))
+        self.assertEqual(Scheduler(state, running, False)._phase("collector", 30), 0)
+
+    def test_sub_second(self):
+        self.count = 0
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = Scheduler(state, running, False)
+        _id = sched.queue(self.count_func, 0.05, True)
+        sched.queue(sched.cancel, 0.52, False, _id)
+        start = time.monotonic()
+        sched.start()
+        self.assertLess(time.monotonic() - start, 1)
+        self.assertGreaterEqual(self.count, 9)
+
+    def test_wake_window(self):
+        self.count = 0
+        self.result = []
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = Scheduler(state, running, False, SchedulerOptions(wake_window=1))
+        _id = sched.queue(self.count_func, 0.1, True)
+        start = time.monotonic()
+        sched.queue(lambda: self.result.append(time.monotonic() - start), 0.3)
+        sched.queue(sched.cancel, 1.05, False, _id)
+        sched.start()
+        self.assertGreaterEqual(self.result[0], 0.3)
+        self.assertGreaterEqual(self.count, 8)
+        self.assertLessEqual(self.count, 12)
+
+    def test_maint_one_shot(self):
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = Scheduler(state, running, False)
+        for num in range(100):
+            sched.run(self.append_func, num, timeout=10)
+        self.result = []
+        sched.start()
+        self.assertEqual(len(self.result), 100)
+        sched._sched_maint()  # pylint: disable=protected-access
+        self.assertEqual(state[SCHEDULER][TASKS], {})
+        self.assertEqual(sched._timeouts, {})  # pylint: disable=protected-access
+
+    def test_task_identity(self):
+        # pylint: disable=protected-access
+        state = ThreadSafeDict()
+        running = threading.Event()
+        options = SchedulerOptions(
+            workers=2, timeouts={"TestScheduler.slow_func": 5, "count_func": 1}
+        )
+        sched = Scheduler(state, running, False, options)
+        other = TestScheduler()
+        self.assertNotEqual(task_key(self.slow_func), task_key(other.slow_func))
+        self.assertEqual(task_key(self.slow_func), task_key(self.slow_func))
+        self.assertTrue(sched._acquire(self.slow_func))
+        self.assertTrue(sched._acquire(other.slow_func))
+        self.assertFalse(sched._acquire(self.slow_func))
+        self.assertEqual(sched._default_timeout(self.slow_func), 5)
+        self.assertEqual(sched._default_timeout(self.count_func), 1)
+        self.assertIsNone(sched._default_timeout(self.test_func))
+
+    def test_options(self):
+        options = SchedulerOptions.from_config(
+            {"mode": "thread", "workers": 2, "catch_up": None}, "host1"
+        )
+        self.assertEqual(options.workers, 2)
+        self.assertIsNone(options.catch_up)
+        self.assertEqual(options.timers, "heap")
+        self.assertEqual(options.seed, "host1")
+        self.assertEqual(SchedulerOptions.from_config(None), SchedulerOptions())
+
+    def test_priority(self):
+        self.result = []
+        state = ThreadSafeDict()
+        running = threading.Event()
+        running.set()
+        sched = Scheduler(state, running, False)
+        sched.run(self.append_func, "low", priority=PRIORITY_LOW)
+        sched.run(self.append_func, "normal")
+        sched.run(self.append_func, "high", priority=PRIORITY_HIGH)
+        sched.start()
+        self.assertEqual(self.result, ["high", "normal", "low"])
+
+    def test_starvation(self):
+        ready = ReadyQueue(limit=2)
+        for num in range(6):
+            ready.append((f"high_{num}",), PRIORITY_HIGH)
+        ready.append(("low",), PRIORITY_LOW)
+        ready.append(("normal",), PRIORITY_NORMAL)
+        self.assertIn("low", ready)
+        order = [ready.popleft()[1][0] for _ in range(8)]
+        self.assertEqual(
+            order,
+            ["high_0", "high_1", "normal", "low", "high_2", "high_3", "high_4", "high_5"],
+        )
+        self.assertNotIn("low", ready)
+        ready.requeue([(PRIORITY_LOW, ("low",))])
+        self.assertIn("low", ready)
+
+    def append_func(self, value):
+        self.result.append(value)
+
+    def count_func(self):
+        self.count += 1
+
+    def hung_func(self):
+        time.sleep(6)
+
+    def slow_func(self):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        time.sleep(0.2)
+        with self.lock:
+            self.running -= 1
+
 
 if __name__ == "__main__":
     unittest.main()
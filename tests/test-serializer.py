@@ -0,0 +1,32 @@
+"""UnitTests for serializer.py"""
+
+import unittest
+from datetime import datetime
+
+
+from service.serializer import JsonSerializer, OrjsonSerializer, get_serializer, orjson
+
+
+class TestSerializer(unittest.TestCase):
+    def test_json(self):
+        data = {"state": 1.5, "boot": datetime(2024, 1, 2, 3, 4, 5), 1: {"a"}}
+        encoded = JsonSerializer.dumps(data)
+        self.assertEqual(
+            encoded, '{"state":1.5,"boot":"2024-01-02 03:04:05","1":"{\'a\'}"}'
+        )
+        self.assertEqual(JsonSerializer.loads(JsonSerializer.dumpb(data))["1"], "{'a'}")
+        self.assertEqual(JsonSerializer.loadb(bytearray(b'{"a":1}')), {"a": 1})
+        self.assertIs(get_serializer("json"), JsonSerializer)
+        self.assertIs(get_serializer("unknown"), JsonSerializer)
+
+    @unittest.skipIf(orjson is None, "orjson is not installed")
+    def test_orjson(self):
+        data = {"state": 1.5, "boot": datetime(2024, 1, 2, 3, 4, 5), 1: {"a"}}
+        self.assertEqual(OrjsonSerializer.dumps(data), JsonSerializer.dumps(data))
+        self.assertEqual(OrjsonSerializer.loads(b'{"a":[1,2]}'), {"a": [1, 2]})
+        self.assertEqual(OrjsonSerializer.loadb(bytearray(b'{"a":1}')), {"a": 1})
+        self.assertIs(get_serializer(), OrjsonSerializer)
+
+
+if __name__ == "__main__":
+    unittest.main()
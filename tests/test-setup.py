@@ -0,0 +1,63 @@
+"""UnitTests for device/setup.py"""
+
+import unittest
+
+
+from helpers import new_config
+from device.setup import setup_sensor, setup_discovery, discovery_hash
+
+
+class TestSetup(unittest.TestCase):
+    def test_setup_sensor(self):
+        data = setup_sensor(new_config(), "Processor Percent")
+        self.assertEqual(
+            data["topic"], "homeassistant/sensor/host_processor_percent/config"
+        )
+        payload = data["payload"]
+        self.assertEqual(payload["state_topic"], f"{payload['~']}/state")
+        self.assertEqual(payload["value_template"], "{{ value_json.state }}")
+
+    def test_setup_sensor_batch(self):
+        config = new_config()
+        payload = setup_sensor(
+            config, "Processor Percent", batch_topic="devices/host"
+        )["payload"]
+        self.assertEqual(payload["state_topic"], "devices/host/state")
+        self.assertEqual(
+            payload["value_template"], "{{ value_json['processor_percent'] }}"
+        )
+        self.assertEqual(payload["json_attributes_topic"], "devices/host/attrib")
+        self.assertEqual(
+            payload["json_attributes_template"],
+            "{{ value_json.get('processor_percent', {}) | tojson }}",
+        )
+
+        payload = setup_sensor(
+            config, "Battery Plugged In", batch_topic="devices/host"
+        )["payload"]
+        self.assertEqual(payload["state_topic"], "devices/host/state")
+        self.assertEqual(payload["payload_on"], "True")
+
+        payload = setup_sensor(config, "Screen", batch_topic="devices/host")["payload"]
+        self.assertEqual(payload["state_topic"], f"{payload['~']}/state")
+
+    def test_setup_discovery(self):
+        config = new_config()
+        data = setup_discovery(config, "Processor Percent")
+        payload = data["payload"]
+        self.assertEqual(payload["name"], "Processor Percent")
+        self.assertEqual(payload["object_id"], "host_processor_percent")
+        self.assertEqual(payload["availability_topic"], "devices/host/status")
+
+        _hash = discovery_hash(payload)
+        self.assertEqual(
+            _hash, discovery_hash(setup_discovery(config, "Processor Percent")["payload"])
+        )
+        config.sensors.icons["processor_percent"] = "cpu-64-bit"
+        self.assertNotEqual(
+            _hash, discovery_hash(setup_discovery(config, "Processor Percent")["payload"])
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,137 @@
+"""UnitTests for states.py"""
+
+import threading
+import unittest
+
+
+from config import HISTORY_SENSORS
+from service.states import StateStore, SensorHistory, HistoryTier
+
+
+class TestStateStore(unittest.TestCase):
+    def test_snapshot(self):
+        store = StateStore({"cpu": 10})
+        snapshot = store.snapshot()
+        store.set("cpu", 20)
+        store.update({"memory": 50})
+        self.assertEqual(snapshot["cpu"], 10)
+        self.assertNotIn("memory", snapshot)
+        self.assertEqual(store.get("cpu"), 20)
+        self.assertEqual(store.version, 2)
+        with self.assertRaises(TypeError):
+            snapshot["cpu"] = 30
+
+    def test_transaction(self):
+        store = StateStore()
+        with store as states:
+            states["cpu"] = 10
+            states["memory"] = 50
+            self.assertNotIn("cpu", store)
+
+        self.assertEqual(store.copy(), {"cpu": 10, "memory": 50})
+        self.assertEqual(store.version, 1)
+
+        with self.assertRaises(ValueError):
+            with store as states:
+                states["cpu"] = 99
+                raise ValueError("abort")
+
+        self.assertEqual(store["cpu"], 10)
+        self.assertEqual(store.pop("cpu"), 10)
+        self.assertIsNone(store.pop("cpu"))
+        self.assertEqual(len(store), 1)
+
+    def test_changed_since(self):
+        store = StateStore()
+        store.update({"cpu": 10, "memory": 50, "load": [1, 2]})
+        version, keys = store.changed_since(0)
+        self.assertEqual(version, 1)
+        self.assertEqual(sorted(keys), ["cpu", "load", "memory"])
+
+        store.update({"cpu": 10, "memory": 50})
+        self.assertEqual(store.changed_since(version), (1, []))
+
+        store.set("cpu", 11)
+        store.set("load", store.get("load"))
+        version, keys = store.changed_since(version)
+        self.assertEqual(version, 3)
+        self.assertEqual(sorted(keys), ["cpu", "load"])
+        self.assertEqual(store.key_version("cpu"), 2)
+        self.assertEqual(store.key_version("memory"), 1)
+
+        store.pop("memory")
+        self.assertEqual(store.changed_since(version), (4, ["memory"]))
+
+        store.remove(["cpu", "load", "missing"])
+        self.assertEqual(len(store), 0)
+        version, keys = store.changed_since(4)
+        self.assertEqual((version, sorted(keys)), (5, ["cpu", "load"]))
+        store.remove(["cpu"])
+        self.assertEqual(store.version, 5)
+
+    def test_concurrent_writers(self):
+        store = StateStore()
+
+        def writer(prefix):
+            for num in range(200):
+                store.set(f"{prefix}_{num}", num)
+
+        threads = [
+            threading.Thread(target=writer, args=(idx,)) for idx in range(4)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(store), 800)
+        self.assertEqual(store.version, 800)
+
+
+class TestSensorHistory(unittest.TestCase):
+    def test_tier(self):
+        tier = HistoryTier(60, 10)
+        for num in range(1200):
+            tier.add(num, num % 60)
+
+        buckets = list(tier.buckets(0, 1199))
+        self.assertEqual(len(buckets), 10)
+        self.assertEqual(buckets[0][0], 600)
+        self.assertEqual(buckets[-1][1:], (0.0, 59.0, 1770.0, 60))
+
+        tier.add(0, 100)
+        self.assertEqual(list(tier.buckets(0, 59)), [])
+
+    def test_history(self):
+        history = SensorHistory(HISTORY_SENSORS, {1: 60, 60: 60})
+        for num in range(600):
+            history.record_states(
+                {
+                    "processor_percent": num % 10,
+                    "coretemp_0": "41.5",
+                    "cpu_thermal_temp_0": 40,
+                    "ip": "x",
+                },
+                1000 + num,
+            )
+        history.record("load", True, 1600)
+
+        self.assertEqual(
+            sorted(history.sensors()),
+            ["coretemp_0", "cpu_thermal_temp_0", "processor_percent"],
+        )
+        stats = history.stats("processor_percent", 30, 1599)
+        self.assertEqual(stats, {"count": 30, "min": 0.0, "max": 9.0, "mean": 4.5})
+        stats = history.stats("processor_percent", 600, 1599)
+        self.assertEqual(stats["max"], 9.0)
+        self.assertGreaterEqual(stats["count"], 540)
+        self.assertEqual(history.stats("coretemp_0", 60, 1599)["mean"], 41.5)
+        self.assertIsNone(history.stats("load", 60, 1599))
+
+        series = history.series("processor_percent", 600, 60, 1599)
+        self.assertEqual(len(series), 11)
+        self.assertEqual(series[-1][1], 4.5)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+"""UnitTests for timers.py"""
+
+import unittest
+
+
+from service.timers import HeapTimers, TimingWheel
+
+
+class TestTimers(unittest.TestCase):
+    def check_backend(self, timers, late=0.0):
+        for num in range(100):
+            timers.push((num * 0.5, f"task_{num}", num))
+
+        self.assertEqual(len(timers), 100)
+        self.assertEqual(timers.cancel("task_10")[2], 10)
+        self.assertIsNone(timers.cancel("task_10"))
+        timers.push((0.2, "task_20", 20))
+        self.assertEqual(len(timers), 99)
+
+        due = timers.pop_due(5.0)
+        self.assertEqual(
+            [task[1] for task in due],
+            ["task_0", "task_20", "task_1", "task_2", "task_3"]
+            + [f"task_{num}" for num in range(4, 10)],
+        )
+        self.assertEqual(len(timers), 88)
+        self.assertLessEqual(timers.next_deadline(), 5.5 + late)
+        self.assertEqual(timers.pop_due(5.0), [])
+        self.assertEqual(len(timers.pop_due(100.0)), 88)
+        self.assertIsNone(timers.next_deadline())
+
+    def test_heap(self):
+        self.check_backend(HeapTimers())
+
+    def test_wheel(self):
+        self.check_backend(TimingWheel(0, tick=0.1, slots=64), late=0.1)
+
+    def test_wheel_levels(self):
+        timers = TimingWheel(0, tick=1, slots=4)
+        deadlines = [0, 3, 5, 17, 63, 64, 255, 256, 1000, 5000]
+        for num, deadline in enumerate(deadlines):
+            timers.push((deadline, f"task_{num}", num))
+
+        timers.push((2000, "task_8", 8))
+        self.assertEqual(timers.cancel("task_9")[0], 5000)
+        fired = []
+        now = 0
+        while timers.next_deadline() is not None:
+            now = timers.next_deadline()
+            for task in timers.pop_due(now):
+                self.assertLessEqual(task[0], now)
+                self.assertLessEqual(now, task[0] + 1)
+                fired.append(task[0])
+
+        self.assertEqual(fired, [0, 3, 5, 17, 63, 64, 255, 256, 2000])
+        self.assertEqual(len(timers), 0)
+
+
+if __name__ == "__main__":
+    unittest.main()